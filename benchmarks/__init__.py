@@ -0,0 +1,7 @@
+"""Benchmarks for obs_clinic_migration using synthetic data"""
+
+import sys
+from pathlib import Path
+
+# the obs_clinic_migration modules import each other as top level modules
+sys.path.insert(0, str(Path(__file__).parent.parent/'obs_clinic_migration'))
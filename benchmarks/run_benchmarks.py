@@ -0,0 +1,268 @@
+"""Time obs_clinic_migration on synthetic data and save the results as JSON
+
+Usage (from the repository root):
+
+    python -m benchmarks.run_benchmarks --subjects 5000 --output results.json
+
+Each benchmark reports the fastest wall time over --repeat runs and the peak
+memory allocated during a run (measured with tracemalloc). Save the results
+of two runs and compare the JSON files to find regressions.
+"""
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from benchmarks import synthetic_data
+import obs_clinic_migration
+import obs_clinic_migration_preprocessing
+
+RESULTS_DIR = Path(__file__).parent/'results'
+
+
+def measure(func, repeat=3, setup=None):
+    """Measure the wall time and peak allocated memory of a function
+
+    Parameters
+    ----------
+    func : callable
+        Function to measure; called with the result of setup if provided
+    repeat : int, optional
+        Number of timed runs, by default 3
+    setup : callable, optional
+        Called before each run (not timed) to create func's argument, by
+        default None
+
+    Returns
+    -------
+    dict
+        'time_s': fastest wall time in seconds, 'peak_mb': peak memory
+        allocated in MB (from a separate, untimed run)
+    """
+    times = []
+    for _ in range(repeat):
+        args = [setup()] if setup is not None else []
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows down allocation so memory is measured separately
+    args = [setup()] if setup is not None else []
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time_s': min(times), 'peak_mb': peak / 2**20}
+
+
+def run_benchmarks(
+    num_subjects=1000, num_stubs=20, stub_repeat=6, repeat=3, num_forms=20
+):
+    """Run every benchmark on synthetic data
+
+    Parameters
+    ----------
+    num_subjects : int, optional
+        Number of subjects in the synthetic Rave export, by default 1000
+    num_stubs : int, optional
+        Number of coded stubs per form, by default 20
+    stub_repeat : int, optional
+        Number of instances of the repeating form, by default 6
+    repeat : int, optional
+        Number of timed runs per benchmark, by default 3
+    num_forms : int, optional
+        Number of other forms in the Rave export used by the preprocessing
+        benchmarks, by default 20
+
+    Returns
+    -------
+    dict
+        The key is the benchmark name and the value is the result of measure
+    """
+    single_df, single_dict = synthetic_data.make_rave_export(
+        num_subjects, num_stubs, stub_repeat=0, seed=1
+    )
+    repeat_df, repeat_dict = synthetic_data.make_rave_export(
+        num_subjects, num_stubs, stub_repeat=stub_repeat, seed=2
+    )
+    data_dict = pd.concat(
+        [
+            synthetic_data.make_redcap_data_dict(single_dict),
+            synthetic_data.make_redcap_data_dict(repeat_dict)
+        ],
+        ignore_index=True
+    ).drop_duplicates('Variable / Field Name')
+    # preprocessing runs on the Rave export of every form
+    wide_rave_df, specify_specs = synthetic_data.make_wide_rave_export(
+        num_subjects, num_forms, num_stubs, stub_repeat
+    )
+    date_cols = [f'DATE{col_num}' for col_num in range(num_stubs)]
+
+    def redcap_conv(main_df, ravestub_redcap_dict, stub_repeat_num):
+        return obs_clinic_migration.RedcapConv(
+            dict(ravestub_redcap_dict), stub_repeat_num,
+            main_df=main_df, redcap_data_dict=data_dict
+        )
+
+    repeat_conv = redcap_conv(repeat_df, repeat_dict, stub_repeat)
+    repeat_dde = synthetic_data.make_dde_export(repeat_conv.data)
+    # DDE export of every form: other forms' columns and subjects
+    wide_dde = pd.concat(
+        [
+            repeat_dde,
+            pd.DataFrame(
+                {
+                    'obs_id': (20100001 + np.arange(20 * num_subjects))
+                    .astype(str)
+                }
+            )
+        ],
+        ignore_index=True
+    )
+    wide_dde = pd.concat(
+        [
+            wide_dde,
+            pd.DataFrame(
+                '1', index=wide_dde.index,
+                columns=[f'other_field_{i}' for i in range(300)]
+            )
+        ],
+        axis=1
+    )
+    spelling_dict = {
+        field_name: {'NO': 'No', 'YES': 'Yes'}
+        for field_name in list(repeat_dict.values())[0:num_stubs]
+    }
+
+    benchmarks = {
+        'RedcapConv.__init__ (single)': (
+            lambda: redcap_conv(single_df, single_dict, 0), None
+        ),
+        'RedcapConv.__init__ (repeat)': (
+            lambda: redcap_conv(repeat_df, repeat_dict, stub_repeat), None
+        ),
+        'RedcapConv.change_str': (
+            lambda conv: conv.change_str(spelling_dict),
+            lambda: redcap_conv(repeat_df, repeat_dict, stub_repeat)
+        ),
+        'RedcapConv.remove_na': (
+            lambda conv: conv.remove_na(),
+            lambda: redcap_conv(repeat_df, repeat_dict, stub_repeat)
+        ),
+        'RedcapConv.compare_conv_dde': (
+            lambda: repeat_conv.compare_conv_dde(repeat_dde), None
+        ),
+        'RedcapConv.compare_conv_dde (10 forms, wide export)': (
+            lambda: [
+                repeat_conv.compare_conv_dde(wide_dde) for _ in range(10)
+            ],
+            None
+        ),
+        'rave_date_unknown': (
+            lambda rave_df: obs_clinic_migration_preprocessing
+            .rave_date_unknown(
+                rave_df, 'MEDHX_NY_', 'Yes', 'ONSET_YR_', stub_repeat
+            ),
+            wide_rave_df.copy
+        ),
+        'rave_date_unknown_batch': (
+            lambda rave_df: obs_clinic_migration_preprocessing
+            .rave_date_unknown_batch(
+                rave_df, [('MEDHX_NY_', 'Yes', 'ONSET_YR_', stub_repeat)]
+            ),
+            wide_rave_df.copy
+        ),
+        'create_specify_col': (
+            lambda rave_df: [
+                obs_clinic_migration_preprocessing.create_specify_col(
+                    rave_df=rave_df, **specify_spec
+                )
+                for specify_spec in specify_specs
+            ],
+            wide_rave_df.copy
+        ),
+        'create_specify_col_batch': (
+            lambda rave_df: obs_clinic_migration_preprocessing
+            .create_specify_col_batch(rave_df, specify_specs),
+            wide_rave_df.copy
+        ),
+        'to_datetime (per column)': (
+            lambda rave_df: [
+                pd.to_datetime(rave_df[col_name]).dt.strftime('%Y-%m-%d')
+                for col_name in date_cols
+            ],
+            wide_rave_df.copy
+        ),
+        'normalize_dates': (
+            lambda rave_df: obs_clinic_migration_preprocessing
+            .normalize_dates(rave_df, date_cols),
+            wide_rave_df.copy
+        ),
+    }
+
+    results = {}
+    for name, (func, setup) in benchmarks.items():
+        results[name] = measure(func, repeat=repeat, setup=setup)
+        print(
+            f"{name}: {results[name]['time_s']:.4f} s, "
+            f"{results[name]['peak_mb']:.1f} MB"
+        )
+
+    return results
+
+
+def main():
+    """Parse command line arguments, run benchmarks and save results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subjects', type=int, default=1000)
+    parser.add_argument('--stubs', type=int, default=20)
+    parser.add_argument('--stub-repeat', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--forms', type=int, default=20)
+    parser.add_argument(
+        '--output', type=Path, default=None,
+        help='JSON file for the results; by default a timestamped file in '
+        'benchmarks/results'
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.subjects, args.stubs, args.stub_repeat, args.repeat,
+        args.forms
+    )
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'parameters': {
+            'subjects': args.subjects,
+            'stubs': args.stubs,
+            'stub_repeat': args.stub_repeat,
+            'repeat': args.repeat,
+            'forms': args.forms
+        },
+        'versions': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__
+        },
+        'results': results
+    }
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR/(
+            datetime.now().strftime('%Y%m%d_%H%M%S') + '.json'
+        )
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f'Results saved to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""Generate synthetic Rave exports, REDCap data dictionaries and DDE exports
+
+The study data is proprietary, so benchmarks use synthetic data with the same
+structure: a wide Rave flat export with one row per subject, labelled answers
+('Yes', 'No', ...), repeating stubs (e.g. STUB1_1, STUB1_2), date parts and
+'please specify' columns with a large proportion of missing values.
+"""
+
+import numpy as np
+import pandas as pd
+
+CHOICES = '1, No | 2, Yes | 99, Unknown'
+LABELS = ['No', 'Yes', 'Unknown']
+DATA_DICT_COLS = [
+    'Variable / Field Name', 'Form Name', 'Section Header', 'Field Type',
+    'Field Label', 'Choices, Calculations, OR Slider Labels', 'Field Note',
+    'Text Validation Type OR Show Slider Number'
+]
+
+
+def make_rave_export(
+    num_subjects=1000, num_stubs=20, stub_repeat=0, missing_rate=0.5,
+    num_text_stubs=2, seed=0
+):
+    """Generate a synthetic Rave flat export for a single form
+
+    Parameters
+    ----------
+    num_subjects : int, optional
+        Number of subjects (rows), by default 1000
+    num_stubs : int, optional
+        Number of coded (labelled) stubs, by default 20
+    stub_repeat : int, optional
+        Number of instances of each stub; 0 for a non-repeating form, by
+        default 0
+    missing_rate : float, optional
+        Proportion of missing answers, by default 0.5. For repeating forms,
+        later instances are missing more often (a subject with 3 pregnancies
+        only has the first 3 instances).
+    num_text_stubs : int, optional
+        Number of free text stubs, by default 2
+    seed : int, optional
+        Seed for the random number generator, by default 0
+
+    Returns
+    -------
+    pandas.dataframe
+        Rave flat export with all columns as strings
+    dict
+        ravestub_redcap_dict mapping the Rave stubs to REDCap field names
+    """
+    rng = np.random.default_rng(seed)
+    rave_cols = {
+        'Subject': (10100001 + np.arange(num_subjects)).astype(str)
+    }
+    ravestub_redcap_dict = {}
+
+    if stub_repeat == 0:
+        instance_suffixes = ['']
+        present = np.ones((num_subjects, 1), dtype=bool)
+    else:
+        instance_suffixes = [str(i) for i in range(1, stub_repeat + 1)]
+        # number of instances each subject has
+        num_instances = rng.integers(0, stub_repeat + 1, size=num_subjects)
+        present = (
+            np.arange(stub_repeat)[np.newaxis, :]
+            < num_instances[:, np.newaxis]
+        )
+
+    stub_names = (
+        [f'STUB{k}_' for k in range(num_stubs)]
+        + [f'TEXT{k}_' for k in range(num_text_stubs)]
+    )
+    for stub_num, stub_name in enumerate(stub_names):
+        if stub_repeat == 0:
+            stub_name = stub_name.rstrip('_')
+        ravestub_redcap_dict[stub_name] = f'field_{stub_num}'
+    for instance_num, suffix in enumerate(instance_suffixes):
+        for stub_name in ravestub_redcap_dict:
+            if stub_name.startswith('STUB'):
+                values = rng.choice(LABELS, size=num_subjects).astype(object)
+            else:
+                values = np.array(
+                    [f'free text {i}' for i in range(num_subjects)],
+                    dtype=object
+                )
+            missing = (
+                (rng.random(num_subjects) < missing_rate)
+                | ~present[:, instance_num]
+            )
+            values[missing] = np.nan
+            rave_cols[stub_name + suffix] = values
+
+    return pd.DataFrame(rave_cols), ravestub_redcap_dict
+
+
+def make_date_export(
+    num_subjects=1000, max_occur_num=6, missing_rate=0.5, seed=0
+):
+    """Generate Rave columns used by rave_date_unknown
+
+    Parameters
+    ----------
+    num_subjects : int, optional
+        Number of subjects (rows), by default 1000
+    max_occur_num : int, optional
+        Number of occurrences of the date stub, by default 6
+    missing_rate : float, optional
+        Proportion of missing date parts, by default 0.5
+    seed : int, optional
+        Seed for the random number generator, by default 0
+
+    Returns
+    -------
+    pandas.dataframe
+        Columns 'MEDHX_NY_<i>' (dependency), 'ONSET_YR_YYYY_<i>',
+        'ONSET_YR_MM_<i>' and 'ONSET_YR_DD_<i>' for each occurrence; some
+        years are '1900' (date unknown)
+    """
+    rng = np.random.default_rng(seed)
+    rave_cols = {
+        'Subject': (10100001 + np.arange(num_subjects)).astype(str)
+    }
+    for occur_num in range(1, max_occur_num + 1):
+        rave_cols[f'MEDHX_NY_{occur_num}'] = rng.choice(
+            np.array(['Yes', 'No', np.nan], dtype=object), size=num_subjects
+        )
+        years = rng.choice(
+            np.array(['1900', '1999', '2005', '2012'], dtype=object),
+            size=num_subjects
+        )
+        months = rng.integers(1, 13, size=num_subjects).astype(str)
+        days = rng.integers(1, 29, size=num_subjects).astype(str)
+        date_parts = [('YYYY_', years), ('MM_', months), ('DD_', days)]
+        for suffix, values in date_parts:
+            values = values.astype(object)
+            values[rng.random(num_subjects) < missing_rate] = np.nan
+            rave_cols[f'ONSET_YR_{suffix}{occur_num}'] = values
+
+    return pd.DataFrame(rave_cols)
+
+
+def make_specify_export(num_subjects=1000, num_cols=20, seed=0):
+    """Generate coded / label column pairs used by create_specify_col
+
+    Parameters
+    ----------
+    num_subjects : int, optional
+        Number of subjects (rows), by default 1000
+    num_cols : int, optional
+        Number of coded / label column pairs, by default 20
+    seed : int, optional
+        Seed for the random number generator, by default 0
+
+    Returns
+    -------
+    pandas.dataframe
+        Columns 'CODE<k>' and 'LABEL<k>'; code '99' is 'please specify' and
+        its label is free text
+    list of dictionaries
+        create_specify_col keyword arguments (excluding rave_df) for each
+        column pair
+    """
+    rng = np.random.default_rng(seed)
+    rave_cols = {}
+    specs = []
+    for col_num in range(num_cols):
+        codes = rng.choice(
+            np.array(['1', '2', '99', np.nan], dtype=object), size=num_subjects
+        )
+        labels = np.where(
+            codes == '99',
+            np.array([f'specified {i}' for i in range(num_subjects)]),
+            np.where(codes == '1', 'No', 'Yes')
+        ).astype(object)
+        labels[pd.isna(codes)] = np.nan
+        rave_cols[f'CODE{col_num}'] = codes
+        rave_cols[f'LABEL{col_num}'] = labels
+        specs.append({
+            'create_col': f'SPECIFY{col_num}',
+            'coded_col': f'CODE{col_num}',
+            'label_col': f'LABEL{col_num}',
+            'label_code': '99',
+            'label_ans': 'Other'
+        })
+
+    return pd.DataFrame(rave_cols), specs
+
+
+def make_rave_date_export(
+    num_subjects=1000, num_cols=20, missing_rate=0.5, seed=0
+):
+    """Generate Rave date columns used by normalize_dates
+
+    Parameters
+    ----------
+    num_subjects : int, optional
+        Number of subjects (rows), by default 1000
+    num_cols : int, optional
+        Number of date columns, by default 20
+    missing_rate : float, optional
+        Proportion of missing dates, by default 0.5
+    seed : int, optional
+        Seed for the random number generator, by default 0
+
+    Returns
+    -------
+    pandas.dataframe
+        Columns 'DATE<k>' with dates in the Rave format (e.g. '09SEP2019')
+        between 2013 and 2019
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2013-01-01', '2019-12-31').strftime('%d%b%Y')
+    dates = dates.str.upper().to_numpy(dtype=object)
+    rave_cols = {}
+    for col_num in range(num_cols):
+        values = rng.choice(dates, size=num_subjects)
+        values[rng.random(num_subjects) < missing_rate] = np.nan
+        rave_cols[f'DATE{col_num}'] = values
+
+    return pd.DataFrame(rave_cols)
+
+
+def make_wide_rave_export(
+    num_subjects=1000, num_forms=20, num_stubs=20, stub_repeat=6, seed=0
+):
+    """Generate a Rave flat export of every form, as exported from Rave
+
+    The preprocessing columns (make_date_export, make_specify_export and
+    make_rave_date_export) are placed among the columns of num_forms
+    repeating forms (make_rave_export), so the export has the width of the
+    real one (about 2700 columns with the defaults).
+
+    Parameters
+    ----------
+    num_subjects : int, optional
+        Number of subjects (rows), by default 1000
+    num_forms : int, optional
+        Number of other forms, by default 20
+    num_stubs : int, optional
+        Number of coded stubs per form, specify column pairs and date
+        columns, by default 20
+    stub_repeat : int, optional
+        Number of instances of each form's stubs and of the date stub, by
+        default 6
+    seed : int, optional
+        Seed for the random number generator, by default 0
+
+    Returns
+    -------
+    pandas.dataframe
+        Rave flat export with all columns as strings
+    list of dictionaries
+        create_specify_col keyword arguments (excluding rave_df) for each
+        specify column pair
+    """
+    form_dfs = []
+    for form_num in range(num_forms):
+        form_df, _ = make_rave_export(
+            num_subjects, num_stubs, stub_repeat=stub_repeat,
+            seed=seed + form_num
+        )
+        form_dfs.append(
+            form_df.drop(columns='Subject').add_prefix(f'FORM{form_num}_')
+        )
+    specify_df, specify_specs = make_specify_export(
+        num_subjects, num_stubs, seed=seed
+    )
+    preprocessing_dfs = [
+        make_date_export(num_subjects, stub_repeat, seed=seed)
+        .drop(columns='Subject'),
+        specify_df,
+        make_rave_date_export(num_subjects, num_stubs, seed=seed)
+    ]
+    # preprocessing columns between forms, not at the end of the export
+    middle = len(form_dfs) // 2
+    rave_dfs = form_dfs[:middle] + preprocessing_dfs + form_dfs[middle:]
+
+    rave_cols = {
+        'Subject': (10100001 + np.arange(num_subjects)).astype(str)
+    }
+    for rave_df in rave_dfs:
+        rave_cols.update(
+            (col_name, rave_df[col_name].to_numpy(dtype=object))
+            for col_name in rave_df.columns
+        )
+
+    return pd.DataFrame(rave_cols), specify_specs
+
+
+def make_redcap_data_dict(ravestub_redcap_dict, form_name='synthetic_form'):
+    """Generate a REDCap data dictionary for a synthetic form
+
+    Parameters
+    ----------
+    ravestub_redcap_dict : dict
+        ravestub_redcap_dict from make_rave_export
+    form_name : str, optional
+        REDCap form name, by default 'synthetic_form'
+
+    Returns
+    -------
+    pandas.dataframe
+        Data dictionary; coded stubs are radio fields with CHOICES and free
+        text stubs are text fields
+    """
+    rows = [{'Variable / Field Name': 'obs_id', 'Field Type': 'text'}]
+    for stub_name, field_name in ravestub_redcap_dict.items():
+        is_coded = stub_name.startswith('STUB')
+        rows.append({
+            'Variable / Field Name': field_name,
+            'Form Name': form_name,
+            'Field Type': 'radio' if is_coded else 'text',
+            'Field Label': stub_name,
+            'Choices, Calculations, OR Slider Labels': (
+                CHOICES if is_coded else np.nan
+            ),
+        })
+
+    return pd.DataFrame(rows, columns=DATA_DICT_COLS)
+
+
+def make_dde_export(
+    redcap_data, num_subjects=40, discrepancy_rate=0.01, seed=0
+):
+    """Generate a double data entry export from converted data
+
+    Parameters
+    ----------
+    redcap_data : pandas.dataframe
+        Converted data (RedcapConv.data)
+    num_subjects : int, optional
+        Number of subjects with double data entry, by default 40
+    discrepancy_rate : float, optional
+        Proportion of values entered differently, by default 0.01
+    seed : int, optional
+        Seed for the random number generator, by default 0
+
+    Returns
+    -------
+    pandas.dataframe
+        Double data entry export with all columns as strings
+    """
+    rng = np.random.default_rng(seed)
+    subjects = redcap_data['obs_id'].drop_duplicates()
+    dde_subjects = rng.choice(
+        subjects.to_numpy(), size=min(num_subjects, len(subjects)),
+        replace=False
+    )
+    redcap_dde = redcap_data.loc[
+        redcap_data['obs_id'].isin(dde_subjects)
+    ].astype(str).where(redcap_data.notna())
+
+    value_cols = [
+        col_name for col_name in redcap_dde.columns
+        if col_name not in ['obs_id', 'redcap_repeat_instance']
+    ]
+    discrepant = rng.random((len(redcap_dde), len(value_cols))) < (
+        discrepancy_rate
+    )
+    values = redcap_dde[value_cols].to_numpy(dtype=object)
+    values[discrepant] = '99'
+    redcap_dde[value_cols] = values
+
+    return redcap_dde.reset_index(drop=True)
@@ -0,0 +1,354 @@
+"""Index the double data entry REDCap export once for every form comparison
+
+RedcapConv.compare_conv_dde only needs the rows of the converted subjects and
+the columns of the converted form. A DdeSnapshot indexes the records of the
+double data entry (DDE) export by obs_id, event, repeat instrument and repeat
+instance, splits its columns by instrument and converts a column to strings
+the first time it is compared, so comparing many forms does not copy, convert
+or search the whole export each time:
+
+>>> snapshot = DdeSnapshot(obs_data_sets.redcap_clinic)
+>>> conv.compare_conv_dde(snapshot)
+"""
+
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from redcap_codebook import CHECKBOX_SEP, FIELD_NAME_COL
+
+# columns identifying a record of a REDCap export, in order
+RECORD_COLS = [
+    'obs_id', 'redcap_event_name', 'redcap_repeat_instrument',
+    'redcap_repeat_instance'
+]
+# data dictionary column with the instrument of each field
+FORM_NAME_COL = 'Form Name'
+# suffix of the column with the status of each instrument
+COMPLETE_SUFFIX = '_complete'
+
+# snapshots built by DdeSnapshot.of keyed by id(redcap_dde); each entry is
+# removed when its export is garbage collected
+_SNAPSHOTS = {}
+
+
+class DdeSnapshot:
+    """Read-only, indexed double data entry REDCap export
+
+    Attributes
+    ----------
+    columns : pandas.Index
+        Columns of the export
+    record_cols : list
+        Columns of RECORD_COLS in the export
+    record_index : pandas.MultiIndex
+        Record columns of every row as strings (missing values are np.NaN),
+        in the order of the export
+    obs_ids : pandas.Index
+        Distinct obs_id of the export as strings
+    """
+    def __init__(self, redcap_dde, redcap_data_dict=None):
+        """Index a double data entry REDCap export
+
+        Parameters
+        ----------
+        redcap_dde : pandas.dataframe
+            Dataframe containing the double data entry REDCap; it must not be
+            modified while the snapshot is in use
+        redcap_data_dict : pandas.dataframe, optional
+            Data dictionary used to find the columns of each instrument
+            ('Form Name'), by default None (the columns before each
+            instrument's '_complete' column are used)
+        """
+        # a shallow copy shares the export's arrays without keeping the
+        # export itself alive (see of)
+        self._redcap_dde = redcap_dde.copy(deep=False)
+        self.columns = redcap_dde.columns
+        self.index = redcap_dde.index
+        self.record_cols = [
+            col_name for col_name in RECORD_COLS if col_name in redcap_dde
+        ]
+        self._str_cols = {}
+        self._lock = threading.Lock()
+
+        self.record_index = pd.MultiIndex.from_arrays(
+            [self.str_column(col_name) for col_name in self.record_cols],
+            names=self.record_cols
+        )
+        # position of each row's obs_id in self.obs_ids (-1 if missing)
+        self._obs_codes = self.record_index.codes[0]
+        self.obs_ids = self.record_index.levels[0]
+
+        # position of each column and the columns of each instrument, in the
+        # order of the export; None for columns outside any instrument
+        self._col_positions = {
+            col_name: col_num for col_num, col_name in enumerate(self.columns)
+        }
+        self._col_instruments = self._find_col_instruments(redcap_data_dict)
+        self._instrument_cols = {}
+        for col_name in self.columns:
+            if col_name not in self.record_cols:
+                self._instrument_cols.setdefault(
+                    self._col_instruments.get(col_name), []
+                ).append(col_name)
+
+    @classmethod
+    def of(cls, redcap_dde):
+        """Return the snapshot of an export, building it only once
+
+        Parameters
+        ----------
+        redcap_dde : pandas.dataframe or DdeSnapshot
+            Dataframe containing the double data entry REDCap; a snapshot is
+            returned as is
+
+        Returns
+        -------
+        DdeSnapshot
+            Snapshot shared by every caller using the same redcap_dde object
+
+        Notes
+        -----
+        The cache only refers to redcap_dde weakly and discards the snapshot
+        when redcap_dde is garbage collected; a snapshot kept by the caller
+        remains usable. If redcap_dde is modified in place, construct a new
+        DdeSnapshot directly.
+        """
+        if isinstance(redcap_dde, cls):
+            return redcap_dde
+
+        key = id(redcap_dde)
+        cached = _SNAPSHOTS.get(key)
+        if cached is not None and cached[0]() is redcap_dde:
+            return cached[1]
+
+        snapshot = cls(redcap_dde)
+        _SNAPSHOTS[key] = (weakref.ref(redcap_dde), snapshot)
+        weakref.finalize(redcap_dde, _SNAPSHOTS.pop, key, None)
+
+        return snapshot
+
+    def __len__(self):
+        return len(self.index)
+
+    def str_column(self, col_name):
+        """Return a column's values as strings
+
+        Parameters
+        ----------
+        col_name : str
+            Column of the export
+
+        Returns
+        -------
+        numpy.ndarray
+            Read-only object array of strings; missing values are np.NaN.
+            The column is only converted the first time.
+        """
+        with self._lock:
+            if col_name not in self._str_cols:
+                col = self._redcap_dde[col_name]
+                values = col.astype(str).where(col.notna()).to_numpy(
+                    dtype=object
+                )
+                values.flags.writeable = False
+                self._str_cols[col_name] = values
+            return self._str_cols[col_name]
+
+    def rows(self, obs_ids=None, repeat_instrument=None):
+        """Return the positions of records
+
+        Parameters
+        ----------
+        obs_ids : list-like, optional
+            Subjects (compared as strings), by default None (every subject)
+        repeat_instrument : str, optional
+            Only return the rows of this repeating instrument, by default None
+            (every row)
+
+        Returns
+        -------
+        numpy.ndarray
+            Row positions in the order of the export
+        """
+        if obs_ids is None:
+            rows = np.arange(len(self))
+        else:
+            # compare the integer codes of the indexed obs_id rather than
+            # strings
+            obs_codes = self.obs_ids.get_indexer(
+                pd.unique(pd.Series(obs_ids, dtype=object).astype(str))
+            )
+            rows = np.flatnonzero(
+                np.isin(self._obs_codes, obs_codes[obs_codes >= 0])
+            )
+        if repeat_instrument is not None:
+            # compare the integer codes of the indexed repeat instrument
+            # rather than strings
+            if 'redcap_repeat_instrument' not in self.record_cols:
+                return rows[:0]
+            level_num = self.record_cols.index('redcap_repeat_instrument')
+            instruments = self.record_index.levels[level_num]
+            if repeat_instrument not in instruments:
+                return rows[:0]
+            rows = rows[
+                self.record_index.codes[level_num][rows]
+                == instruments.get_loc(repeat_instrument)
+            ]
+
+        return rows
+
+    def slice(self, col_names, rows=None):
+        """Return columns of some records as strings
+
+        Parameters
+        ----------
+        col_names : list
+            Columns of the export
+        rows : numpy.ndarray, optional
+            Row positions (see rows), by default None (every row)
+
+        Returns
+        -------
+        pandas.dataframe
+            New dataframe of strings (missing values are np.NaN) with the
+            index labels of the export
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+
+        return pd.DataFrame(
+            {
+                col_name: self.str_column(col_name)[rows]
+                for col_name in col_names
+            },
+            index=self.index[rows],
+            columns=list(col_names)
+        )
+
+    def _find_col_instruments(self, redcap_data_dict=None):
+        """Map the columns of the export to their instrument
+
+        Parameters
+        ----------
+        redcap_data_dict : pandas.dataframe, optional
+            Data dictionary with the instrument of each field ('Form Name'),
+            by default None (the columns before each instrument's
+            '_complete' column are used)
+
+        Returns
+        -------
+        dict
+            The key is a column (including checkbox choice columns and
+            '_complete' columns) and the value is its instrument; columns
+            outside any instrument are not included
+        """
+        col_instruments = {}
+        if redcap_data_dict is not None:
+            field_instruments = dict(zip(
+                redcap_data_dict[FIELD_NAME_COL],
+                redcap_data_dict[FORM_NAME_COL]
+            ))
+            for col_name in self.columns:
+                if str(col_name).endswith(COMPLETE_SUFFIX):
+                    instrument = str(col_name)[:-len(COMPLETE_SUFFIX)]
+                else:
+                    instrument = field_instruments.get(
+                        str(col_name).partition(CHECKBOX_SEP)[0]
+                    )
+                if pd.notna(instrument):
+                    col_instruments[col_name] = instrument
+            return col_instruments
+
+        # REDCap exports each instrument's columns followed by its
+        # '_complete' column
+        instrument_cols = []
+        for col_name in self.columns:
+            instrument_cols.append(col_name)
+            if str(col_name).endswith(COMPLETE_SUFFIX):
+                instrument = str(col_name)[:-len(COMPLETE_SUFFIX)]
+                col_instruments.update(
+                    (instrument_col, instrument)
+                    for instrument_col in instrument_cols
+                )
+                instrument_cols = []
+        return col_instruments
+
+    def instrument_cols(self, instrument):
+        """Return the columns of an instrument
+
+        Parameters
+        ----------
+        instrument : str
+            REDCap instrument (form) name
+
+        Returns
+        -------
+        list
+            Columns of the export belonging to the instrument, including
+            checkbox choice columns and the instrument's '_complete' column,
+            excluding the record columns
+        """
+        if instrument is None:
+            return []
+        return list(self._instrument_cols.get(instrument, []))
+
+    def shared_cols(self, col_names):
+        """Return the columns of the export among col_names
+
+        Only the record columns, the columns of the instruments of col_names
+        (see instrument_cols) and the columns outside any instrument are
+        searched, rather than every column of the export.
+
+        Parameters
+        ----------
+        col_names : list-like
+            Columns, e.g. of the converted data
+
+        Returns
+        -------
+        list
+            Columns of col_names in the export, in the order of the export
+        """
+        col_names = set(col_names)
+        # None: columns outside any instrument
+        instruments = {
+            self._col_instruments.get(col_name)
+            for col_name in col_names if col_name in self._col_positions
+        }
+        shared = [
+            col_name for col_name in self.record_cols if col_name in col_names
+        ]
+        for instrument in instruments:
+            shared.extend(
+                col_name
+                for col_name in self._instrument_cols.get(instrument, [])
+                if col_name in col_names
+            )
+
+        return sorted(shared, key=self._col_positions.__getitem__)
+
+    def instrument(self, instrument, obs_ids=None, repeating=False):
+        """Return the records and columns of an instrument
+
+        Parameters
+        ----------
+        instrument : str
+            REDCap instrument (form) name
+        obs_ids : list-like, optional
+            Subjects, by default None (every subject)
+        repeating : bool, optional
+            The instrument is a repeating instrument; only its repeat
+            instances are returned, by default False
+
+        Returns
+        -------
+        pandas.dataframe
+            Record columns and instrument columns (see instrument_cols) of
+            the rows with data in at least one instrument column, as strings
+        """
+        col_names = self.instrument_cols(instrument)
+        rows = self.rows(obs_ids, instrument if repeating else None)
+        instrument_df = self.slice(self.record_cols + col_names, rows)
+
+        return instrument_df.loc[instrument_df[col_names].notna().any(axis=1)]
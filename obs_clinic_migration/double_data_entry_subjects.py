@@ -1,57 +1,92 @@
-"""Script to generate double data entry subjects"""
+"""Select subjects for double data entry
 
-from itertools import compress
+Run as a script to print the OBS IDs of the subjects selected from
+obs_data_sets.rave_clinic.
+"""
+
+import numpy as np
 import obs_data_sets
 
 NUM_MIN_NA_SUBJECTS = 40
+MAX_SUBJECT_ID = 91299999
+
+# number of set bits in each possible byte
+_POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], np.uint8)
+
 
-clinic_temp = obs_data_sets.rave_clinic
-clinic_temp = clinic_temp.loc[clinic_temp['Subject'].astype(int) <= 91299999]
+def select_dde_subjects(
+    rave_df, num_subjects=NUM_MIN_NA_SUBJECTS, max_subject_id=MAX_SUBJECT_ID,
+    subject_col='Subject'
+):
+    """Select the subjects which together have data in the most columns
 
-# only review columns with data in them
-col_names = [
-    col_name for col_name in list(clinic_temp.columns.values)
-    if clinic_temp[col_name].notnull().astype(int).sum() > 0
-]
+    Greedy maximum coverage: the subject with data in the most columns is
+    selected, the columns are marked as covered, and the subject with data in
+    the most uncovered columns is selected next, repeating until num_subjects
+    are selected. Each subject's non-null columns are packed into a bitset so
+    each iteration is a vectorized AND and bit count over all subjects.
 
-# min_na_subjects will contain OBS IDs of relevant subjects (i.e. minimum
-# number of NAs)
-min_na_subjects = []
+    Parameters
+    ----------
+    rave_df : pandas.dataframe
+        Dataframe containing the Rave data in the wide format
+    num_subjects : int, optional
+        Number of subjects to select, by default NUM_MIN_NA_SUBJECTS
+    max_subject_id : int, optional
+        Only subjects with an ID less than or equal to max_subject_id are
+        considered; None considers all subjects, by default MAX_SUBJECT_ID
+    subject_col : str, optional
+        Name of the column containing the subject ID, by default 'Subject'
 
-# loop will find the OBS ID with the lowest number of columns with missing
-# data; add it to the list; remove the OBS ID; and repeat according to
-# NUM_MIN_NA_SUBJECTS
+    Returns
+    -------
+    dict
+        The key is the selected subject (in order of selection) and the value
+        is a list of the previously uncovered columns the subject has data in
 
-for _ in range(1, (NUM_MIN_NA_SUBJECTS + 1)):
+    Notes
+    -----
+    Ties are resolved in favour of the subject listed first in rave_df.
+    Columns without data for any subject are ignored and do not affect the
+    selection. The previous script's loop paired the null mask of every
+    column with the columns with data, so it selected different subjects
+    when some columns were empty.
+    """
+    if max_subject_id is not None:
+        rave_df = rave_df.loc[
+            rave_df[subject_col].astype(int) <= max_subject_id
+        ]
+    subjects = rave_df[subject_col].tolist()
+    data_df = rave_df.drop(columns=subject_col)
 
-    # create a column, 'sum_na', which counts the number of NA's (i.e. empty
-    # column values) the subject has
-    clinic_temp['sum_na'] = 0
-    for col_name in col_names:
-        clinic_temp['sum_na'] = (
-            clinic_temp['sum_na'] + clinic_temp[col_name].isnull().astype(int)
+    # only review columns with data in them
+    notnull = data_df.notna().to_numpy()
+    has_data = notnull.any(axis=0)
+    col_names = data_df.columns[has_data]
+    subject_bits = np.packbits(notnull[:, has_data], axis=1)
+    uncovered_bits = np.packbits(np.ones(len(col_names), dtype=bool))
+
+    available = np.ones(len(subjects), dtype=bool)
+    selected = {}
+    for _ in range(min(num_subjects, len(subjects))):
+        num_uncovered = _POPCOUNT[subject_bits & uncovered_bits].sum(
+            axis=1, dtype=np.int64
         )
-    print(clinic_temp['sum_na'].min())
-
-    # find the subject with the lowest number of NA's
-    min_na_subject = clinic_temp['Subject'].loc[
-        clinic_temp['sum_na'] == clinic_temp['sum_na'].min()
-    ].iloc[0]
-
-    # find which columns which have NA's for the min_na_subject
-    col_names = list(compress(col_names, clinic_temp[
-        clinic_temp['Subject'] == min_na_subject
-    ].isnull().iloc[0].tolist()))
-    # need to keep 'Subject' column to track subjects
-    col_names.append('Subject')
-
-    print(col_names[0:10])
-    # create new dataframe which excludes min_na_subject and has the
-    # appropriate column names
-    clinic_temp = clinic_temp.loc[
-        clinic_temp['Subject'] != min_na_subject, col_names
-    ]
-
-    min_na_subjects.append(min_na_subject)
-
-print(min_na_subjects)
+        num_uncovered[~available] = -1
+        subject_idx = int(np.argmax(num_uncovered))
+
+        covered_bits = subject_bits[subject_idx] & uncovered_bits
+        covered = np.unpackbits(covered_bits)[:len(col_names)].astype(bool)
+        selected[subjects[subject_idx]] = col_names[covered].tolist()
+
+        uncovered_bits &= ~subject_bits[subject_idx]
+        available[subject_idx] = False
+
+    return selected
+
+
+if __name__ == '__main__':
+    min_na_subjects = select_dde_subjects(obs_data_sets.rave_clinic)
+    for min_na_subject, covered_cols in min_na_subjects.items():
+        print(min_na_subject, len(covered_cols), covered_cols[0:10])
+    print(list(min_na_subjects))
@@ -0,0 +1,511 @@
+"""Run the conversion of many REDCap forms from declarative form specs
+
+Each form is described by a form spec (a dictionary) instead of a series of
+notebook cells. For example:
+
+{
+    'name': 'base_dem',
+    'ravestub_redcap_dict': {
+        'BASE_ASSESS_DT': 'base_assess_date',
+        'DOB': 'base_dem_dob'
+    },
+    'stub_repeat': 0,
+    'event_name': 'baseline_assessmen_arm_1',
+    'complete_col': 'baseline_assessment_complete',
+    'preprocessing': [
+        ('rave_date_unknown', {
+            'date_dependency': 'MEDHX_NY_',
+            'dependency_answer': 'Yes',
+            'rave_date_stub': 'ONSET_YR_',
+            'max_occur_num': 3
+        })
+    ],
+    'spelling_dict': {'base_curr_mode_conception': {'Unknown': np.NaN}}
+}
+
+See FORM_SPEC_DEFAULTS for the optional keys. A stub_repeat of None is
+detected from the Rave columns (see rave_header_index).
+
+Incremental runs (fingerprint_dir) fingerprint each subject's source columns
+per form and only convert subjects that are new or changed since the previous
+run, writing a delta import file (name + '_delta.csv'). The new fingerprints
+are only saved by commit_fingerprints, once the import file is imported:
+
+>>> results = run_forms(form_specs, fingerprint_dir=FINGERPRINT_DIR)
+>>> # import each results[name]['output_path'] into REDCap, then
+>>> commit_fingerprints(results['base_dem'])
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import hashlib
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import obs_clinic_migration
+import obs_clinic_migration_preprocessing
+import obs_data_sets
+import preprocessing_plan
+import rave_header_index
+import source_view
+
+REQUIRED_SPEC_KEYS = [
+    'name', 'ravestub_redcap_dict', 'stub_repeat', 'event_name',
+    'complete_col'
+]
+FORM_SPEC_DEFAULTS = {
+    # name of REDCap column for repeat instances (see RedcapConv.prep_imp)
+    'repeat_instrument': None,
+    # spelling corrections (see RedcapConv.change_str)
+    'spelling_dict': None,
+    # list of (function, kwargs) applied to the Rave dataframe in order;
+    # function is a callable or the name of a function in
+    # obs_clinic_migration_preprocessing and must accept a rave_df keyword
+    # argument and return the modified dataframe
+    'preprocessing': [],
+    # remove rows without data (see RedcapConv.remove_na)
+    'remove_na': True,
+    # compare to the double data entry (see RedcapConv.compare_conv_dde)
+    'compare_dde': True,
+    'additional_ignore_cols': None,
+    # columns with a constant value added before RedcapConv.prep_imp (e.g.
+    # {'incl_excl_entry_type': 1})
+    'constant_cols': {},
+    # name of the REDCap import file; by default name + '.csv'
+    'output_file': None,
+    # measure the stages of the conversion (see RedcapConv profile)
+    'profile': False,
+    # check recoded values against the data dictionary's choices (see
+    # RedcapConv.validate_choices)
+    'validate_choices': True,
+}
+
+# preprocessing steps run lazily for the columns of the form (see
+# preprocessing_plan.PreprocessingPlan); forms with other steps copy and
+# preprocess the whole Rave dataframe
+PLAN_STEPS = preprocessing_plan.STEPS
+
+# default directory of the subject fingerprints of incremental runs
+FINGERPRINT_DIR = obs_data_sets.PROCESSED_DIR/'fingerprints'
+
+# data shared by every form run in a worker process (see _init_worker)
+_SOURCE = {}
+
+
+def run_forms(
+    form_specs, output_dir=obs_data_sets.PROCESSED_DIR, max_workers=None,
+    main_df=None, redcap_data_dict=None, redcap_dde=None,
+    fingerprint_dir=None
+):
+    """Convert each form and write its REDCap import file
+
+    Forms are converted in parallel in a process pool. The source data is
+    sent to each worker process once and shared read only by the forms (see
+    source_view.SourceView); forms with preprocessing steps work on their own
+    copy (of only the columns they need, see PLAN_STEPS).
+
+    Parameters
+    ----------
+    form_specs : list of dictionaries
+        One form spec per REDCap form (see module docstring)
+    output_dir : str or pathlib.Path, optional
+        Directory where the REDCap import files are written, by default
+        obs_data_sets.PROCESSED_DIR
+    max_workers : int, optional
+        Number of worker processes; 1 converts the forms in the current
+        process, by default None (the number of processors)
+    main_df : pandas.dataframe, optional
+        Dataframe containing the Rave data in the wide format, by default None
+        (each worker uses obs_data_sets.rave_clinic)
+    redcap_data_dict : pandas.dataframe, optional
+        Finalized project's data dictionary derived from REDCap, by default
+        None (each worker uses obs_data_sets.redcap_data_dict)
+    redcap_dde : pandas.dataframe, optional
+        Dataframe containing the double data entry REDCap, by default None
+        (each worker uses obs_data_sets.redcap_clinic)
+    fingerprint_dir : str or pathlib.Path, optional
+        Directory of the subject fingerprints (e.g. FINGERPRINT_DIR); when
+        given, only new or changed subjects are converted (see run_form and
+        commit_fingerprints), by default None (every subject is converted)
+
+    Returns
+    -------
+    dict
+        The key is the form name and the value is the result of run_form
+    """
+    form_specs = [validate_form_spec(form_spec) for form_spec in form_specs]
+    source = (main_df, redcap_data_dict, redcap_dde)
+
+    if max_workers == 1:
+        _init_worker(*source)
+        results = [
+            run_form(form_spec, output_dir, fingerprint_dir)
+            for form_spec in form_specs
+        ]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=source
+        ) as executor:
+            results = list(executor.map(
+                run_form, form_specs,
+                [output_dir] * len(form_specs),
+                [fingerprint_dir] * len(form_specs)
+            ))
+
+    return {
+        form_spec['name']: result
+        for form_spec, result in zip(form_specs, results)
+    }
+
+
+def validate_form_spec(form_spec):
+    """Check a form spec and fill in default values
+
+    Parameters
+    ----------
+    form_spec : dict
+        Form spec (see module docstring)
+
+    Returns
+    -------
+    dict
+        Copy of form_spec including every key in FORM_SPEC_DEFAULTS
+
+    Raises
+    ------
+    ValueError
+        If a required key is missing or an unknown key is present
+    """
+    missing_keys = [key for key in REQUIRED_SPEC_KEYS if key not in form_spec]
+    unknown_keys = [
+        key for key in form_spec
+        if key not in REQUIRED_SPEC_KEYS and key not in FORM_SPEC_DEFAULTS
+    ]
+    if missing_keys or unknown_keys:
+        raise ValueError(
+            f"Form spec '{form_spec.get('name')}' is missing keys "
+            f"{missing_keys} or has unknown keys {unknown_keys}"
+        )
+
+    return {**FORM_SPEC_DEFAULTS, **form_spec}
+
+
+def run_form(
+    form_spec, output_dir=obs_data_sets.PROCESSED_DIR, fingerprint_dir=None
+):
+    """Convert a single form and write its REDCap import file
+
+    Parameters
+    ----------
+    form_spec : dict
+        Form spec (see module docstring)
+    output_dir : str or pathlib.Path, optional
+        Directory where the REDCap import file is written, by default
+        obs_data_sets.PROCESSED_DIR
+    fingerprint_dir : str or pathlib.Path, optional
+        Directory of the subject fingerprints, by default None. When given,
+        the fingerprints of the previous run are loaded from
+        fingerprint_dir/(name + '.json') and only subjects whose fingerprint
+        changed are converted, compared and written to a delta import file
+        (name + '_delta.csv' unless output_file is given). Every subject is
+        converted when there are no previous fingerprints or the form spec or
+        data dictionary changed. The new fingerprints are not saved; pass
+        the result to commit_fingerprints once the import file is imported,
+        otherwise the next run converts the same subjects again.
+
+    Returns
+    -------
+    dict
+        'output_path': path of the REDCap import file (None if no subject
+        changed), 'num_rows': number of rows written, 'dde_discrepancies':
+        result of RedcapConv.compare_conv_dde (None if not compared),
+        'num_subjects': number of subjects converted, 'removed_subjects': list
+        of subjects in the previous run's fingerprints that are no longer in
+        the Rave data (incremental runs only), 'profile_report':
+        RedcapConv.profiler.report() with a 'form' column (None if not
+        profiled), 'recode_issues': RedcapConv.recode_issues,
+        'choice_violations': result of RedcapConv.validate_choices (None if
+        not validated), 'fingerprints': new fingerprints saved by
+        commit_fingerprints (None if not an incremental run)
+    """
+    form_spec = validate_form_spec(form_spec)
+    main_df = _source('main_df')
+    source_df = main_df
+    plan = None
+    if form_spec['preprocessing'] and all(
+        step in PLAN_STEPS for step, _ in form_spec['preprocessing']
+    ):
+        plan = preprocessing_plan.PreprocessingPlan(
+            _source_view()
+        ).add_form_spec_steps(form_spec['preprocessing'])
+    elif form_spec['preprocessing']:
+        main_df = main_df.copy()
+        for step, step_kwargs in form_spec['preprocessing']:
+            if isinstance(step, str):
+                step = getattr(obs_clinic_migration_preprocessing, step)
+            main_df = step(rave_df=main_df, **step_kwargs)
+
+    if form_spec['stub_repeat'] is None:
+        # stubs may be columns created by the preprocessing steps
+        form_spec['stub_repeat'] = rave_header_index.RaveHeaderIndex.of(
+            main_df if plan is None else plan
+        ).stub_repeat(form_spec['ravestub_redcap_dict'])
+    if plan is not None:
+        # only the steps and columns needed by the form are run and copied
+        main_df = plan.materialize_form(
+            form_spec['ravestub_redcap_dict'], form_spec['stub_repeat']
+        )
+
+    output_file = form_spec['output_file'] or form_spec['name'] + '.csv'
+    removed_subjects = []
+    new_fingerprints = None
+    if fingerprint_dir is not None:
+        fingerprint_path = Path(fingerprint_dir)/(form_spec['name'] + '.json')
+        spec_hash = _spec_hash(form_spec, _source('redcap_data_dict'))
+        fingerprints = subject_fingerprints(
+            main_df,
+            obs_clinic_migration.RedcapConv.required_cols(
+                form_spec['ravestub_redcap_dict'], form_spec['stub_repeat']
+            )
+        )
+        new_fingerprints = {
+            'fingerprint_path': fingerprint_path,
+            'spec_hash': spec_hash,
+            'fingerprints': fingerprints
+        }
+        previous = load_fingerprints(fingerprint_path, spec_hash)
+        if previous is not None:
+            is_changed = (
+                fingerprints != fingerprints.index.map(previous.get)
+            ).to_numpy()
+            main_df = main_df.loc[
+                main_df['Subject'].isin(fingerprints.index[is_changed])
+            ]
+            removed_subjects = sorted(set(previous) - set(fingerprints.index))
+            output_file = (
+                form_spec['output_file'] or form_spec['name'] + '_delta.csv'
+            )
+
+    if len(main_df) == 0:
+        return {
+            'output_path': None,
+            'num_rows': 0,
+            'dde_discrepancies': None,
+            'num_subjects': 0,
+            'removed_subjects': removed_subjects,
+            'profile_report': None,
+            'recode_issues': None,
+            'choice_violations': None,
+            'fingerprints': new_fingerprints
+        }
+
+    if main_df is source_df:
+        # unmodified source data is shared (read only) by the forms run in
+        # this process
+        main_df = _source_view()
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict=form_spec['ravestub_redcap_dict'],
+        stub_repeat=form_spec['stub_repeat'],
+        main_df=main_df,
+        redcap_data_dict=_source('redcap_data_dict'),
+        profile=form_spec['profile']
+    )
+    if form_spec['spelling_dict'] is not None:
+        conv.change_str(form_spec['spelling_dict'])
+    if form_spec['remove_na']:
+        conv.remove_na()
+
+    choice_violations = None
+    if form_spec['validate_choices']:
+        choice_violations = conv.validate_choices()
+
+    dde_discrepancies = None
+    if form_spec['compare_dde']:
+        dde_discrepancies = conv.compare_conv_dde(
+            _source('redcap_dde'), form_spec['additional_ignore_cols']
+        )
+
+    for col_name, col_value in form_spec['constant_cols'].items():
+        conv.data[col_name] = col_value
+    conv.prep_imp(
+        form_spec['event_name'],
+        form_spec['complete_col'],
+        form_spec['repeat_instrument']
+    )
+
+    output_path = Path(output_dir)/output_file
+    conv.data.to_csv(output_path, index=False)
+
+    profile_report = None
+    if form_spec['profile']:
+        profile_report = conv.profiler.report()
+        profile_report.insert(0, 'form', form_spec['name'])
+
+    return {
+        'output_path': output_path,
+        'num_rows': len(conv.data),
+        'dde_discrepancies': dde_discrepancies,
+        'num_subjects': len(main_df),
+        'removed_subjects': removed_subjects,
+        'profile_report': profile_report,
+        'recode_issues': conv.recode_issues,
+        'choice_violations': choice_violations,
+        'fingerprints': new_fingerprints
+    }
+
+
+def commit_fingerprints(form_result):
+    """Save the fingerprints of an incremental run once it is imported
+
+    Call after the form's import file (form_result['output_path']) is
+    imported into REDCap, so the next run only converts subjects changed
+    since. If the import failed, don't call it: the next run converts the
+    same subjects again.
+
+    Parameters
+    ----------
+    form_result : dict
+        Result of run_form (or a value of the result of run_forms)
+
+    Returns
+    -------
+    None
+    """
+    if form_result['fingerprints'] is not None:
+        save_fingerprints(**form_result['fingerprints'])
+
+
+def subject_fingerprints(rave_df, rave_cols):
+    """Fingerprint each subject's Rave data
+
+    Parameters
+    ----------
+    rave_df : pandas.dataframe
+        Rave data in the wide format (one row per subject)
+    rave_cols : list
+        Rave columns used by the form, including 'Subject' (see
+        RedcapConv.required_cols); columns missing from rave_df are ignored
+
+    Returns
+    -------
+    pandas.series
+        Hex string fingerprint of the values in rave_cols indexed by subject
+    """
+    rave_cols = [col_name for col_name in rave_cols if col_name in rave_df]
+    values = rave_df[rave_cols].astype(object)
+    # missing values (np.NaN, None or pandas.NA) hash the same
+    values = values.where(values.notna(), None)
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+    return pd.Series(
+        [format(row_hash, '016x') for row_hash in hashes],
+        index=pd.Index(rave_df['Subject'].to_numpy(), name='Subject'),
+        dtype=object
+    )
+
+
+def load_fingerprints(fingerprint_path, spec_hash):
+    """Load the subject fingerprints saved by a previous run
+
+    Parameters
+    ----------
+    fingerprint_path : str or pathlib.Path
+        JSON file written by save_fingerprints
+    spec_hash : str
+        Hash of the current form spec and data dictionary
+
+    Returns
+    -------
+    dict or None
+        Fingerprint for each subject, or None if there are no fingerprints or
+        they were created with a different form spec or data dictionary
+    """
+    fingerprint_path = Path(fingerprint_path)
+    if not fingerprint_path.exists():
+        return None
+    with open(fingerprint_path) as file:
+        saved = json.load(file)
+    if saved.get('spec_hash') != spec_hash:
+        return None
+
+    return saved['fingerprints']
+
+
+def save_fingerprints(fingerprint_path, spec_hash, fingerprints):
+    """Save subject fingerprints for the next incremental run
+
+    Parameters
+    ----------
+    fingerprint_path : str or pathlib.Path
+        JSON file; replaced if it exists
+    spec_hash : str
+        Hash of the form spec and data dictionary
+    fingerprints : pandas.series
+        Result of subject_fingerprints
+    """
+    fingerprint_path = Path(fingerprint_path)
+    fingerprint_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = fingerprint_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(
+            {'spec_hash': spec_hash, 'fingerprints': fingerprints.to_dict()},
+            file
+        )
+    os.replace(temp_path, fingerprint_path)
+
+
+def _spec_hash(form_spec, redcap_data_dict):
+    """Hash the parts of a conversion that apply to every subject"""
+    spec_json = json.dumps(
+        {
+            key: value for key, value in form_spec.items()
+            if key not in [
+                'compare_dde', 'additional_ignore_cols', 'profile',
+                'validate_choices'
+            ]
+        },
+        sort_keys=True,
+        default=lambda value: getattr(value, '__qualname__', repr(value))
+    )
+    data_dict_hash = pd.util.hash_pandas_object(
+        redcap_data_dict.astype(object), index=False
+    ).to_numpy().sum(dtype=np.uint64)
+
+    return hashlib.sha256(
+        (spec_json + str(data_dict_hash)).encode()
+    ).hexdigest()
+
+
+def _init_worker(main_df=None, redcap_data_dict=None, redcap_dde=None):
+    """Store the source data shared by the forms run in this process"""
+    _SOURCE['main_df'] = main_df
+    _SOURCE['main_view'] = None
+    _SOURCE['redcap_data_dict'] = redcap_data_dict
+    _SOURCE['redcap_dde'] = redcap_dde
+
+
+def _source_view():
+    """Return a read-only view of the Rave data shared by every form"""
+    main_df = _source('main_df')
+    if (
+        _SOURCE.get('main_view') is None
+        or _SOURCE['main_view'][0] is not main_df
+    ):
+        _SOURCE['main_view'] = (main_df, source_view.SourceView(main_df))
+
+    return _SOURCE['main_view'][1]
+
+
+def _source(name):
+    """Return source data, falling back to obs_data_sets"""
+    if _SOURCE.get(name) is not None:
+        return _SOURCE[name]
+
+    return obs_data_sets.load({
+        'main_df': 'rave_clinic',
+        'redcap_data_dict': 'redcap_data_dict',
+        'redcap_dde': 'redcap_clinic'
+    }[name])
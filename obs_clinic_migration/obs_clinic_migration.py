@@ -2,7 +2,22 @@
 
 import pandas as pd
 import numpy as np
+import dde_snapshot
 import obs_data_sets
+import rave_header_index
+import redcap_import_writer
+import source_view
+from redcap_codebook import Codebook, redcap_str_dict
+from stage_profiler import StageProfiler, profiled_method
+
+# columns of RedcapConv.recode_issues
+ISSUE_COLS = [
+    'stage', 'field', 'raw_value', 'count', 'example_obs_ids', 'exception'
+]
+# maximum number of obs_id listed for each issue
+MAX_EXAMPLE_OBS_IDS = 5
+# values, other than missing values, considered empty by RedcapConv.remove_na
+EMPTY_VALUES = ['nan', '0']
 
 
 class RedcapConv:
@@ -13,12 +28,26 @@ class RedcapConv:
     data : pandas.dataframe
         Clinical data derived from the Rave database that is being converted to
         the REDCap format
+    codebook : redcap_codebook.Codebook
+        Parsed REDCap data dictionary used to recode self.data; shared with
+        other instances using the same data dictionary
+    profiler : stage_profiler.StageProfiler
+        Wall time, rows/columns in and out, and peak memory of each stage
+        (e.g. profiler.report()); stages are only measured if enabled with the
+        profile argument
+    recode_issues : pandas.dataframe
+        Values that could not be recoded and exceptions raised while recoding
+        in __init__ and change_str, and Rave stubs with more instance columns
+        than stub_repeat; one row per field and value (or exception) with the
+        columns in ISSUE_COLS (see print_recode_issues)
     """
     def __init__(
         self, ravestub_redcap_dict, stub_repeat,
-        main_df=obs_data_sets.rave_clinic,
-        redcap_data_dict=obs_data_sets.redcap_data_dict,
-        recode_long=True
+        main_df=None,
+        redcap_data_dict=None,
+        recode_long=True,
+        profile=False,
+        print_issues=False
     ):
         """Convert Rave dataframe to REDCap
 
@@ -26,39 +55,129 @@ class RedcapConv:
         ----------
         ravestub_redcap_dict : dict
             Dictionary which maps the Rave stub columns (keys) to the REDCap
-            columns (values)
-        stub_repeat : int
+            columns (values); it is not modified
+        stub_repeat : int or None
             Maximum number of repeats expected For example, if
             stub_repeat = 2, expecting column_x_1 and column_x_2 in Rave
-            dataframe.
-        main_df : pandas.dataframe, optional
+            dataframe. None detects it from the Rave columns (see
+            rave_header_index.RaveHeaderIndex.stub_repeat).
+        main_df : pandas.dataframe or source_view.SourceView, optional
             Dataframe containing the Rave data to be manipulated. It is
-            expected the dataframe is in the wide format, by default
-            obs_data_sets.rave_clinic
+            expected the dataframe is in the wide format, by default None
+            (obs_data_sets.rave_clinic is used). It is not modified; use a
+            SourceView shared by many instances to avoid repeated subsetting.
         redcap_data_dict : pandas.dataframe, optional
             Finalized project's data dictionary derived from REDCap, by default
-            obs_data_sets.redcap_data_dict
+            None (obs_data_sets.redcap_data_dict is used)
         recode_long : bool, optional
             When True, will execute self._recoded_based_redcap_data_dict
             (changes values in df (self.data) columns based on
             variable coding in redcap_data_dict), by default True
+        profile : bool, callable or stage_profiler.StageProfiler, optional
+            Measure the stages of the conversion ('subset', 'wide_to_long',
+            'recode', 'change_str', 'remove_na', 'compare_conv_dde',
+            'compare_conv_dde_cells' and 'prep_imp') in self.profiler. True
+            enables measurement, a callable is called with the record of each
+            stage as it finishes and a StageProfiler is used as is (e.g. to
+            collect the stages of many forms), by default False
+        print_issues : bool, optional
+            Print a summary of self.recode_issues after recoding, by default
+            False
         """
-        # convert relevant data from wide to long depending on
-        # iterations/stub_repeat
-        if stub_repeat == 0:
-            rave_long = self._rave_single(ravestub_redcap_dict, main_df)
+        self.profiler = StageProfiler.from_option(profile)
+        self.recode_issues = pd.DataFrame(columns=ISSUE_COLS)
+        if main_df is None:
+            main_df = obs_data_sets.rave_clinic
+        if redcap_data_dict is None:
+            redcap_data_dict = obs_data_sets.redcap_data_dict
+        self.codebook = Codebook.from_data_dict(redcap_data_dict)
+        if stub_repeat is None:
+            stub_repeat = rave_header_index.RaveHeaderIndex.of(
+                main_df
+            ).stub_repeat(ravestub_redcap_dict)
         elif stub_repeat > 0:
-            rave_long = self._rave_wide_long(
-                ravestub_redcap_dict, stub_repeat, main_df
+            self._check_stub_repeat(ravestub_redcap_dict, stub_repeat, main_df)
+
+        # read-only projection of only the columns of interest
+        with self.profiler.stage('subset', main_df) as stage:
+            rave_wide = source_view.project(
+                main_df, self.required_cols(ravestub_redcap_dict, stub_repeat)
             )
+            stage.set(rave_wide)
+
+        # convert relevant data from wide to long depending on
+        # iterations/stub_repeat
+        with self.profiler.stage('wide_to_long', rave_wide) as stage:
+            if stub_repeat == 0:
+                rave_long = self._rave_single(ravestub_redcap_dict, rave_wide)
+            elif stub_repeat > 0:
+                rave_long = self._rave_wide_long(
+                    ravestub_redcap_dict, stub_repeat, rave_wide
+                )
+            stage.set(rave_long)
         # recode values based on REDCap data dictionary
         if recode_long:
-            self.data = self._recoded_based_redcap_data_dict(
-                data_dict_df=redcap_data_dict, rave_long=rave_long
-            )
+            with self.profiler.stage('recode', rave_long) as stage:
+                self.data = self._recoded_based_redcap_data_dict(
+                    rave_long=rave_long
+                )
+                stage.set(self.data)
+            if print_issues:
+                self.print_recode_issues()
         else:
             self.data = rave_long
 
+    @staticmethod
+    def required_cols(ravestub_redcap_dict, stub_repeat):
+        """List the Rave columns needed to convert a form
+
+        Parameters
+        ----------
+        ravestub_redcap_dict : dict
+            Dictionary which maps the Rave stub columns (keys) to the REDCap
+            columns (values)
+        stub_repeat : int
+            Maximum number of repeats expected For example, if
+            stub_repeat = 2, expecting column_x_1 and column_x_2 in Rave
+            dataframe.
+
+        Returns
+        -------
+        list
+            'Subject' followed by the Rave columns including iterations of
+            each stub (e.g. COL_1, COL_2) if stub_repeat > 0
+        """
+        return rave_header_index.form_columns(
+            ravestub_redcap_dict, stub_repeat
+        )
+
+    def _check_stub_repeat(self, ravestub_redcap_dict, stub_repeat, main_df):
+        """Record stubs with more instance columns than stub_repeat
+
+        These instances would not be converted; each stub is added to
+        self.recode_issues.
+        """
+        index = rave_header_index.RaveHeaderIndex.of(main_df)
+        instances = {
+            stub_name: index.instances(stub_name)
+            for stub_name in ravestub_redcap_dict
+            if index.instances(stub_name) > stub_repeat
+        }
+        if instances:
+            self._add_issues(pd.DataFrame(
+                [
+                    [
+                        'wide_to_long', ravestub_redcap_dict[stub_name],
+                        np.nan, np.nan, [],
+                        f"has {num_instances} instance columns in Rave "
+                        f"('{stub_name}'); only stub_repeat = {stub_repeat} "
+                        "are converted."
+                    ]
+                    for stub_name, num_instances in instances.items()
+                ],
+                columns=ISSUE_COLS
+            ))
+
     @staticmethod
     def _rave_wide_long(ravestub_redcap_dict, stub_repeat, main_df):
         """Convert and clean Rave data from wide to long with >1 instances
@@ -75,9 +194,10 @@ class RedcapConv:
             Maximum number of repeats expected For example, if
             stub_repeat = 2, expecting column_x_1 and column_x_2 in Rave
             dataframe.
-        main_df : pandas.dataframe
+        main_df : pandas.dataframe or source_view.SourceView
              Dataframe containing the Rave data to be manipulated. It is
-             expected the dataframe is in the wide format.
+             expected the dataframe is in the wide format. It is not
+             modified.
 
         Returns
         -------
@@ -90,43 +210,41 @@ class RedcapConv:
         """
         # create list of column names including iterations of stub
         # (e.g. COL_1, COL_2)
-        df_cols = ['Subject']
-        for i in range(1, (stub_repeat + 1)):
-            for stub_name in ravestub_redcap_dict.keys():
-                df_cols.append(stub_name + str(i))
-
-        # subset dataframe
-        sub_df = main_df.loc[:, df_cols]
-        sub_df = (pd.wide_to_long(
-            sub_df,
-            stubnames=ravestub_redcap_dict.keys(),
-            i='Subject',
-            j='redcap_repeat_instance'
-        ).reset_index())
-
-        # remove blank rows after ignoring 'Subject', and
-        # 'redcap_repeat_instance'
-        sub_df_cols = [
-            col_name
-            for col_name in list(sub_df)
-            if col_name not in ['Subject', 'redcap_repeat_instance']
+        df_cols = RedcapConv.required_cols(ravestub_redcap_dict, stub_repeat)
+        rave_wide = source_view.project(main_df, df_cols)
+
+        # stack the stub x instance column blocks into long columns, keeping
+        # only instances with data in at least one stub (e.g. COL_1 and COL_2
+        # become rows 1 to n and n + 1 to 2n of COL_)
+        num_subjects = len(rave_wide)
+        stub_names = list(ravestub_redcap_dict.keys())
+        has_data = rave_wide.notna(df_cols[1:]).reshape(
+            num_subjects, stub_repeat, len(stub_names)
+        ).any(axis=2)
+        keep_rows = [
+            np.flatnonzero(has_data[:, i]) for i in range(stub_repeat)
         ]
-        sub_df.dropna(subset=sub_df_cols, thresh=1, inplace=True)
-
-        # check to see if manipulated file contains the same number of
-        # instances as function argument
-        if sub_df['redcap_repeat_instance'].max() != stub_repeat:
-            print(
-                'max redcap_repeat_instance = '
-                 + str(sub_df['redcap_repeat_instance'].max())
-                 + '; stub_repeat = ' + str(stub_repeat)
-            )
 
-        # modifications
-        sub_df.rename(columns=ravestub_redcap_dict, inplace=True)
-        sub_df.rename(columns={'Subject': 'obs_id'}, inplace=True)
-        sub_df['redcap_repeat_instance'] = (
-            sub_df['redcap_repeat_instance'].astype(str)
+        long_cols = {
+            'obs_id': np.concatenate([
+                rave_wide.object_values('Subject')[rows] for rows in keep_rows
+            ]),
+            'redcap_repeat_instance': np.concatenate([
+                np.full(len(rows), str(i + 1), dtype=object)
+                for i, rows in enumerate(keep_rows)
+            ])
+        }
+        for stub_name in stub_names:
+            long_cols[ravestub_redcap_dict[stub_name]] = np.concatenate([
+                rave_wide.object_values(stub_name + str(i + 1))[rows]
+                for i, rows in enumerate(keep_rows)
+            ])
+        sub_df = pd.DataFrame(
+            long_cols,
+            # same index as stacking every instance and then removing rows
+            index=np.concatenate([
+                rows + i * num_subjects for i, rows in enumerate(keep_rows)
+            ])
         )
 
         return sub_df
@@ -142,9 +260,10 @@ class RedcapConv:
         ravestub_redcap_dict : dict
             dictionary which maps the Rave stub columns (keys) to the REDCap
             columns (values)
-        main_df : pandas.dataframe
+        main_df : pandas.dataframe or source_view.SourceView
              Dataframe containing the Rave data to be manipulated. It is
-             expected the dataframe is in the wide format.
+             expected the dataframe is in the wide format. It is not
+             modified.
 
         Returns
         -------
@@ -160,17 +279,19 @@ class RedcapConv:
         to a long format if there is only a single instance.
         """
         # change column name for consistency with REDCap
-        ravestub_redcap_dict['Subject'] = 'obs_id'
+        rave_redcap_cols = {**ravestub_redcap_dict, 'Subject': 'obs_id'}
 
         # create a dataframe with only the columns of interest which are
         # derived from the ravestub_redcap_dict
-        sub_df = main_df.loc[:, ravestub_redcap_dict.keys()]
-        sub_df.rename(columns=ravestub_redcap_dict, inplace=True)
+        rave_wide = source_view.project(
+            main_df, RedcapConv.required_cols(ravestub_redcap_dict, 0)
+        )
+        sub_df = rave_wide.to_frame(rave_redcap_cols)
 
         return sub_df
 
     def _recoded_based_redcap_data_dict(
-            self, rave_long, data_dict_df=obs_data_sets.redcap_data_dict
+            self, rave_long, data_dict_df=None
     ):
         """Recode Rave long dataframe based on REDCap data dictionary
 
@@ -183,17 +304,21 @@ class RedcapConv:
             dataframe in which values will be changed
         data_dict_df : pandas.dataframe, optional
             data dictionary export from REDCap containing variable coding,
-            by default obs_data_sets.redcap_data_dict
+            by default None (self.codebook is used)
 
         Returns
         -------
         pandas.dataframe
-            Rave data set recoded based on REDCap data dictionary
+            Rave data set recoded based on REDCap data dictionary; missing
+            values remain np.NaN
 
-        Notes:
-        Known issue with '.to_string' method, need to set max_colwidth
-        https://github.com/pandas-dev/pandas/issues/9784
+        Notes
+        -----
+        Columns without coding information in the data dictionary are not
+        recoded.
         """
+        codebook = self._get_codebook(data_dict_df)
+
         redcap_var_names = [
             col_name
             for col_name in rave_long.columns.values.tolist()
@@ -202,50 +327,99 @@ class RedcapConv:
 
         for redcap_var_name in redcap_var_names:
             # get REDCap coding info from data dictionary
-            redcap_data_dict_value = data_dict_df.loc[
-                data_dict_df['Variable / Field Name'] == redcap_var_name,
-                'Choices, Calculations, OR Slider Labels'
-            ]
-
-            # if coding info is avaiable, convert to Python dict
-            if not redcap_data_dict_value.isna().bool():
-                redcap_data_dict_value_rev = self._redcap_str_dict(
-                    redcap_data_dict_value.to_string(index=False)
-                )
+            redcap_data_dict_value_rev = codebook.choices(redcap_var_name)
+
+            # only recode if coding info is avaiable
+            if redcap_data_dict_value_rev is not None:
 
-            # only prints value counts if there is a REDCap coding information
                 try:
-                    rave_long[redcap_var_name] = (
-                        rave_long[redcap_var_name].astype(str).replace(
+                    rave_long[redcap_var_name], unmapped_labels = (
+                        self._recode_col(
+                            rave_long[redcap_var_name],
                             redcap_data_dict_value_rev
                         )
                     )
-                    rave_long_counts = (
-                        rave_long[redcap_var_name].value_counts()
-                    )
                     # check if any issues
-                    for value_count_index in rave_long_counts.index:
-                        if not self._isfloat(value_count_index):
-                            print(
-                                (
-                                    f"Column '{redcap_var_name}', "
-                                    "variable '{value_count_index}' has an "
-                                    "issue."
-                                )
-                            )
+                    self._add_unmapped_issues(
+                        'recode', rave_long, redcap_var_name, unmapped_labels
+                    )
 
                 except Exception as ex:
-                    template = (
-                        "An exception of type {0} occurred. Arguments:\n{1!r}"
-                    )
-                    message = template.format(type(ex).__name__, ex.args)
-                    print('\n')
-                    print(redcap_var_name)
-                    print(message)
-        rave_long.replace('nan', np.nan, regex=True, inplace=True)
+                    self._add_exception_issue('recode', redcap_var_name, ex)
 
         return rave_long
 
+    @staticmethod
+    def _recode_col(rave_col, *label_maps):
+        """Recode a column by remapping its distinct values
+
+        The column is converted to a categorical once and the mappings are
+        applied to the categories (i.e. the distinct values) rather than to
+        every row.
+
+        Parameters
+        ----------
+        rave_col : pandas.series
+            Column in which values will be changed
+        *label_maps : dict
+            Dictionaries where the key is the current value and the value is
+            the new value. Dictionaries are applied in order (e.g. a spelling
+            correction followed by the REDCap coding).
+
+        Returns
+        -------
+        pandas.series
+            Recoded column; values are strings and missing values are np.NaN
+        list
+            Distinct values, after applying all but the last dictionary, that
+            are not keys of the last dictionary (i.e. were not recoded)
+        """
+        rave_cat = rave_col.astype('category')
+        categories = rave_cat.cat.categories.astype(str)
+        for label_map in label_maps[:-1]:
+            categories = pd.Index(np.where(
+                categories.isin(list(label_map)),
+                categories.map(label_map.get),
+                categories
+            ))
+        is_label = categories.isin(list(label_maps[-1]))
+        unmapped_labels = categories[~is_label].tolist()
+
+        # the last entry is used for missing values (category code -1)
+        recoded_values = np.empty(len(categories) + 1, dtype=object)
+        recoded_values[:-1] = np.where(
+            is_label, categories.map(label_maps[-1].get), categories
+        )
+        recoded_values[-1] = np.nan
+
+        return (
+            pd.Series(
+                recoded_values[rave_cat.cat.codes.to_numpy()],
+                index=rave_col.index,
+                name=rave_col.name
+            ),
+            unmapped_labels
+        )
+
+    def _get_codebook(self, data_dict_df=None):
+        """Return the codebook for a data dictionary
+
+        Parameters
+        ----------
+        data_dict_df : pandas.dataframe, optional
+            data dictionary export from REDCap containing variable coding,
+            by default None (self.codebook is used)
+
+        Returns
+        -------
+        redcap_codebook.Codebook
+            Parsed REDCap data dictionary
+        """
+        if data_dict_df is None:
+            return self.codebook
+
+        return Codebook.from_data_dict(data_dict_df)
+
     def _isfloat(self, value):
         """Check if value is a 'float' type
 
@@ -296,20 +470,11 @@ class RedcapConv:
         -----
         Function will process commas in answer label correctly; however,
         if the answer label contains a bar (|), this will be interpreted
-        as a new entry.
+        as a new entry. See redcap_codebook.redcap_str_dict.
         """
-        str_dict = {}
-        val_key_lst = input_str.split(' | ')
-
-        for val_key in val_key_lst:
-            val_key_split_lst = val_key.split(', ', 1)
-
-            str_dict[
-                str(val_key_split_lst[1])
-            ] = str(val_key_split_lst[0]).lstrip()
-
-        return str_dict
+        return redcap_str_dict(input_str)
 
+    @profiled_method('prep_imp')
     def prep_imp(self, event_name, complete_col, repeat_instrument=None):
         """Prepare data file for REDCap import
 
@@ -345,8 +510,49 @@ class RedcapConv:
         obs_col = self.data.pop('obs_id')
         self.data.insert(0, 'obs_id', obs_col)
 
+    def write_import_files(
+        self, output_dir, file_stem, max_records=None, max_bytes=None,
+        compress=False, max_workers=None
+    ):
+        """Write self.data to REDCap import files split by records or size
+
+        A record's rows (e.g. its repeat instances) are never split across
+        files. Performed after self.prep_imp.
+
+        Parameters
+        ----------
+        output_dir : str or pathlib.Path
+            Directory where the import files are written
+        file_stem : str
+            Import files are named file_stem + '_001.csv', ...
+        max_records : int, optional
+            Maximum number of records (obs_id) per file, by default None (no
+            limit)
+        max_bytes : int, optional
+            Maximum size of each (uncompressed) file in bytes, by default None
+            (no limit)
+        compress : bool, optional
+            Write gzip-compressed files, by default False
+        max_workers : int, optional
+            Number of threads writing files concurrently, by default None
+
+        Returns
+        -------
+        list of pathlib.Path
+            The import files in order (see
+            redcap_import_writer.write_import_files)
+        """
+        return redcap_import_writer.write_import_files(
+            self.data, output_dir, file_stem,
+            max_records=max_records,
+            max_bytes=max_bytes,
+            compress=compress,
+            max_workers=max_workers
+        )
+
+    @profiled_method('change_str')
     def change_str(
-        self, spelling_dict, data_dict_df=obs_data_sets.redcap_data_dict
+        self, spelling_dict, data_dict_df=None, print_issues=False
     ):
         """Manually change column values after initilizing data set
 
@@ -372,8 +578,12 @@ class RedcapConv:
             }
         data_dict_df : dictionary, optional
             REDCap data dictionary that contains REDCap data dictionary string
-            (see self._redcap_str_dict), by default
-            obs_data_sets.redcap_data_dict
+            (see self._redcap_str_dict), by default None (self.codebook is
+            used)
+        print_issues : bool, optional
+            Print a summary of self.recode_issues, by default False. Values
+            that still could not be recoded after the spelling correction are
+            added to self.recode_issues.
 
         Returns
         -------
@@ -394,42 +604,134 @@ class RedcapConv:
         ['correct_spelling', 'redcap_spelling_1', 'redcap_spelling_2']
 
         """
+        codebook = self._get_codebook(data_dict_df)
+
         for key, val in spelling_dict.items():
-            redcap_data_dict_value = data_dict_df.loc[
-                data_dict_df['Variable / Field Name'] == key,
-                'Choices, Calculations, OR Slider Labels'
-            ].to_string(index=False)
-            redcap_data_dict_value_rev = self._redcap_str_dict(
-                redcap_data_dict_value
-            )
+            redcap_data_dict_value_rev = codebook.choices(key)
             try:
                 # replace column values with the 'correct' values (values
                 # associated with a REDCap dictionary value)
-                self.data[key] = self.data[key].astype(str).replace(val)
-                self.data[key] = (
-                    self.data[key].astype(str).replace(
-                        redcap_data_dict_value_rev
-                    )
+                self.data[key], unmapped_labels = self._recode_col(
+                    self.data[key], val, redcap_data_dict_value_rev or {}
                 )
-                self.data.replace('nan', np.nan, regex=True, inplace=True)
-
-                print(self.data[key].value_counts())
+                if redcap_data_dict_value_rev is not None:
+                    self._add_unmapped_issues(
+                        'change_str', self.data, key, unmapped_labels
+                    )
             except Exception as ex:
-                template = (
-                    "An exception of type {0} occurred. Arguments:\n{1!r}"
+                self._add_exception_issue('change_str', key, ex)
+
+        if print_issues:
+            self.print_recode_issues()
+
+    def print_recode_issues(self):
+        """Print a summary of self.recode_issues
+
+        Prints one line per field with the number of values that could not
+        be recoded and the number of affected rows, and one line per
+        exception.
+
+        Returns
+        -------
+        None
+        """
+        if self.recode_issues.empty:
+            print('No recode issues.')
+            return
+
+        is_exception = self.recode_issues['exception'].notna()
+        unmapped = self.recode_issues.loc[~is_exception]
+        if not unmapped.empty:
+            unmapped_summary = unmapped.groupby(
+                ['stage', 'field'], sort=False
+            ).agg(
+                num_values=('raw_value', 'size'),
+                num_rows=('count', 'sum')
+            )
+            for row in unmapped_summary.reset_index().itertuples():
+                print(
+                    f"{row.stage}: column '{row.field}' has "
+                    f"{int(row.num_values)} value(s) in {int(row.num_rows)} "
+                    "row(s) that could not be recoded."
                 )
-                message = template.format(type(ex).__name__, ex.args)
-                print('\n')
-                print(key)
-                print(message)
+        for row in self.recode_issues.loc[is_exception].itertuples():
+            print(f"{row.stage}: column '{row.field}' {row.exception}")
+
+    def _add_unmapped_issues(self, stage, data_df, col_name, unmapped_labels):
+        """Add values that could not be recoded to self.recode_issues
+
+        Parameters
+        ----------
+        stage : str
+            Name of the method recoding the column
+        data_df : pandas.dataframe
+            Recoded data including 'obs_id' and col_name
+        col_name : str
+            Recoded column
+        unmapped_labels : list
+            Distinct values that were not recoded (see self._recode_col);
+            numeric values are not considered an issue
+
+        Returns
+        -------
+        None
+        """
+        unmapped_labels = [
+            unmapped_label for unmapped_label in unmapped_labels
+            if not self._isfloat(unmapped_label)
+        ]
+        if not unmapped_labels:
+            return
+
+        is_unmapped = data_df[col_name].isin(unmapped_labels)
+        unmapped_df = data_df.loc[is_unmapped, ['obs_id', col_name]]
+        grouped = unmapped_df.groupby(col_name, sort=True)['obs_id']
+        issues = pd.DataFrame(
+            {
+                'stage': stage,
+                'field': col_name,
+                'raw_value': grouped.size().index.to_numpy(dtype=object),
+                'count': grouped.size().to_numpy(),
+                'example_obs_ids': grouped.apply(
+                    lambda obs_ids: obs_ids.drop_duplicates()
+                    .head(MAX_EXAMPLE_OBS_IDS).tolist()
+                ).to_numpy(),
+                'exception': np.nan
+            },
+            columns=ISSUE_COLS
+        )
+        self._add_issues(issues)
+
+    def _add_exception_issue(self, stage, col_name, ex):
+        """Add an exception raised while recoding to self.recode_issues"""
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        self._add_issues(pd.DataFrame(
+            [[
+                stage, col_name, np.nan, np.nan, [],
+                template.format(type(ex).__name__, ex.args)
+            ]],
+            columns=ISSUE_COLS
+        ))
+
+    def _add_issues(self, issues):
+        """Append issues to self.recode_issues"""
+        if self.recode_issues.empty:
+            self.recode_issues = issues.reset_index(drop=True)
+        else:
+            self.recode_issues = pd.concat(
+                [self.recode_issues, issues], ignore_index=True
+            )
 
+    @profiled_method('compare_conv_dde')
     def compare_conv_dde(self, redcap_dde, additional_ignore_cols=None):
         """Compare converted Rave data to double data entry REDCap
 
         Parameters
         ----------
-        redcap_dde : pandas.dataframe
-            Dataframe containing the double data entry REDCap
+        redcap_dde : pandas.dataframe or dde_snapshot.DdeSnapshot
+            Dataframe containing the double data entry REDCap; it is indexed
+            once (see dde_snapshot.DdeSnapshot.of) and shared by every
+            comparison
         additional_ignore_cols : list, optional
             Columns to ignore when compare the converted Rave data (self.data)
             and the double data entry REDCap (redcap_dde), by default None
@@ -437,6 +739,10 @@ class RedcapConv:
         Returns
         -------
         pandas.dataframe
+            Rows of the double data entry REDCap and the converted Rave data
+            which do not have an identical row in the other dataset. Columns
+            are in the order of redcap_dde (ignored columns excluded),
+            followed by the 'Source' column identifying the dataset.
 
         Notes
         -----
@@ -444,64 +750,18 @@ class RedcapConv:
         indiates redcap; higher is rave converted) to easily locate
         # discrepancies
         """
-        # aren't concerned with data type, only values
-        rave_converted = self.data.astype(str)
-        rave_converted[rave_converted.notnull()] = rave_converted.astype(str)
-        redcap_dde = redcap_dde.astype(str)
-
-        # from redcap_dde, create dataframe containing the subjects and columns
-        # in both rave_converted and redcap_dde
-        subjects_intersect = [
-            subject
-            for subject in list(rave_converted['obs_id'])
-            if subject in list(redcap_dde['obs_id'])
-        ]
-        columns_intersect = [
-            column
-            for column in list(redcap_dde.columns.values)
-            if column in list(rave_converted.columns.values)
-        ]
-        redcap_dde_sub = redcap_dde.loc[
-            redcap_dde['obs_id'].isin(subjects_intersect),
-            columns_intersect
-        ]
-
-        # remove rows which don't have data in them (after excluding 'obs_id')
-        redcap_dde_sub.replace('nan', np.nan, regex=True, inplace=True)
-        redcap_dde_sub = redcap_dde_sub.dropna(
-            subset=[
-                column
-                for column in columns_intersect
-                if column not in ['obs_id', 'redcap_repeat_instance']
-            ],
-            thresh=1,
-            inplace=False
+        rave_converted_sub, redcap_dde_sub, _, _ = self._dde_intersect(
+            redcap_dde, additional_ignore_cols
         )
-        redcap_dde_sub = redcap_dde_sub.astype(str)
-
-        # only investigate intersecting subjects in converted dataframe
-        rave_converted_sub = rave_converted.loc[
-            rave_converted['obs_id'].isin(subjects_intersect),
-            columns_intersect
-        ]
 
         # add 'Source' column so origin of discrepancies can be identified and
         # combine into one dataframe
         rave_converted_sub['Source'] = 'RaveConverted'
         redcap_dde_sub['Source'] = 'REDCapDDE'
-        eval_df = redcap_dde_sub.append(
-                rave_converted_sub, ignore_index=True
+        eval_df = pd.concat(
+            [redcap_dde_sub, rave_converted_sub], ignore_index=True
         )
 
-        # columns to ignore in the comparison
-        # remove/ignore columns that are free text (i.e. 'text' in 'Field
-        # Type' in the REDcap data dictionary)
-        ignore_cols = []
-        if additional_ignore_cols is not None:
-            ignore_cols.extend(additional_ignore_cols)
-        if ignore_cols:
-            eval_df.drop(ignore_cols, axis=1, inplace=True)
-
         # drop rows that have the same value between Rave and REDCap
         # (i.e. are correct) ignoring 'Source'; should only have rows with
         # discrepancies
@@ -520,36 +780,407 @@ class RedcapConv:
 
         return eval_df
 
-    def remove_na(self):
+    @profiled_method('compare_conv_dde_cells')
+    def compare_conv_dde_cells(self, redcap_dde, additional_ignore_cols=None):
+        """Compare converted Rave data to double data entry REDCap by cell
+
+        Records are matched on 'obs_id' (and 'redcap_repeat_instance' if
+        available) with a hash join and every compared column is checked, so
+        each discrepancy is reported as a separate row.
+
+        Parameters
+        ----------
+        redcap_dde : pandas.dataframe or dde_snapshot.DdeSnapshot
+            Dataframe containing the double data entry REDCap; it is indexed
+            once (see dde_snapshot.DdeSnapshot.of) and shared by every
+            comparison
+        additional_ignore_cols : list, optional
+            Columns to ignore when compare the converted Rave data (self.data)
+            and the double data entry REDCap (redcap_dde), by default None
+
+        Returns
+        -------
+        pandas.dataframe
+            One row per discrepancy with the record columns ('obs_id' and, if
+            available, 'redcap_repeat_instance'), 'field', 'rave_value' and
+            'dde_value'. A record missing from one dataset has np.NaN values
+            for that dataset.
+
+        Notes
+        -----
+        Only subjects in both datasets are compared. Missing values in both
+        datasets are considered equal.
+        """
+        rave_converted_sub, redcap_dde_sub, key_cols, compare_cols = (
+            self._dde_intersect(redcap_dde, additional_ignore_cols)
+        )
+
+        # hash join on the record columns; records only in one dataset are
+        # kept with missing values for the other dataset
+        eval_df = pd.merge(
+            rave_converted_sub, redcap_dde_sub,
+            on=key_cols, how='outer', suffixes=('_rave', '_dde')
+        )
+        rave_values = eval_df[
+            [col + '_rave' for col in compare_cols]
+        ].to_numpy(dtype=object)
+        dde_values = eval_df[
+            [col + '_dde' for col in compare_cols]
+        ].to_numpy(dtype=object)
+        rave_na = pd.isna(rave_values)
+        dde_na = pd.isna(dde_values)
+        discrepant = (rave_na != dde_na) | (
+            ~rave_na & ~dde_na & (rave_values != dde_values)
+        )
+
+        row_num, col_num = np.nonzero(discrepant)
+        discrepancies = eval_df[key_cols].iloc[row_num].reset_index(drop=True)
+        discrepancies['field'] = np.array(compare_cols, dtype=object)[col_num]
+        discrepancies['rave_value'] = rave_values[row_num, col_num]
+        discrepancies['dde_value'] = dde_values[row_num, col_num]
+
+        return discrepancies.sort_values(
+            by=key_cols, kind='mergesort'
+        ).reset_index(drop=True)
+
+    def _dde_intersect(self, redcap_dde, additional_ignore_cols=None):
+        """Subset converted data and double data entry to shared data
+
+        Parameters
+        ----------
+        redcap_dde : pandas.dataframe or dde_snapshot.DdeSnapshot
+            Dataframe containing the double data entry REDCap; it is indexed
+            once (see dde_snapshot.DdeSnapshot.of) and shared by every
+            comparison
+        additional_ignore_cols : list, optional
+            Columns to ignore when compare the converted Rave data (self.data)
+            and the double data entry REDCap (redcap_dde), by default None
+
+        Returns
+        -------
+        pandas.dataframe
+            Converted Rave data (self.data) for subjects and columns in both
+            datasets, in the column order of redcap_dde
+        pandas.dataframe
+            Double data entry REDCap for subjects and columns in both datasets,
+            excluding rows without data, in the column order of redcap_dde
+        list
+            Record columns ('obs_id' and, if available,
+            'redcap_repeat_instance')
+        list
+            Columns to compare
+
+        Notes
+        -----
+        Values are converted to strings (we aren't concerned with data type,
+        only values) after subsetting; missing values remain np.NaN.
+        """
+        redcap_dde = dde_snapshot.DdeSnapshot.of(redcap_dde)
+
+        # from redcap_dde, find the subjects and columns in both self.data
+        # and redcap_dde; only the column slices of the instruments of
+        # self.data are searched
+        rave_obs_id = self.data['obs_id'].astype(str)
+        columns_intersect = redcap_dde.shared_cols(self.data.columns)
+        key_cols = [
+            column
+            for column in ['obs_id', 'redcap_repeat_instance']
+            if column in columns_intersect
+        ]
+        ignore_cols = set(additional_ignore_cols or [])
+        compare_cols = [
+            column
+            for column in columns_intersect
+            if column not in key_cols and column not in ignore_cols
+        ]
+
+        # only the rows of the converted subjects (found through the record
+        # index) and the shared columns of redcap_dde are converted to
+        # strings; remove rows which don't have data in them (after excluding
+        # 'obs_id' and 'redcap_repeat_instance')
+        redcap_dde_sub = redcap_dde.slice(
+            columns_intersect, redcap_dde.rows(rave_obs_id)
+        ).dropna(
+            subset=[
+                column for column in columns_intersect
+                if column not in key_cols
+            ],
+            thresh=1
+        )
+        rave_converted_sub = self.data.loc[
+            rave_obs_id.isin(redcap_dde.obs_ids), columns_intersect
+        ]
+
+        # keep the column order of redcap_dde
+        kept_cols = [
+            column
+            for column in columns_intersect
+            if column in key_cols or column not in ignore_cols
+        ]
+
+        return (
+            self._as_str(rave_converted_sub[kept_cols]),
+            redcap_dde_sub[kept_cols],
+            key_cols,
+            compare_cols
+        )
+
+    @staticmethod
+    def _as_str(data_df):
+        """Convert values to strings, leaving missing values as np.NaN"""
+        return data_df.astype(str).where(data_df.notna())
+
+    @profiled_method('remove_na')
+    def remove_na(
+        self, empty_values=None, field_empty_values=None,
+        keep_valid_codes=False
+    ):
         """Remove rows that don't contain relevant data
 
-        Removes rows of the processed data frame (self.data), excluding
-        'obs_id' and 'redcap_repeat_instance', which contain only NaN, 'nan'
-        or '0'
+        Removes rows of the processed data frame (self.data) where every
+        column, excluding 'obs_id' and 'redcap_repeat_instance', is missing
+        (np.NaN) or an empty value (by default 'nan' or '0'). The empty values
+        of every column are found in a single pass and rows are filtered once.
+
+        Parameters
+        ----------
+        empty_values : list of str, optional
+            Values, other than missing values, that are considered empty, by
+            default None (EMPTY_VALUES)
+        field_empty_values : dict, optional
+            Maps REDCap field names to the list of empty values used for the
+            field instead of empty_values, by default None
+        keep_valid_codes : bool, optional
+            When True, an empty value that is a valid code of the field in
+            the data dictionary (e.g. '0' of a yesno field or of a radio field
+            with '0, None') is not considered empty, by default False
 
         Returns
         -------
         None
+
+        Notes
+        -----
+        Values are compared as strings (e.g. the integer 0 matches '0').
         """
-        data_w_na = self.data
+        if empty_values is None:
+            empty_values = EMPTY_VALUES
+        field_empty_values = field_empty_values or {}
 
         # ignore 'obs_id' and 'redcap_repeat_instance'
-        relevant_cols = data_w_na.columns[~data_w_na.columns.isin(
-            ['obs_id', 'redcap_repeat_instance']
-        )]
+        relevant_cols = [
+            col_name for col_name in self.data.columns
+            if col_name not in ['obs_id', 'redcap_repeat_instance']
+        ]
+
+        is_empty = np.empty((len(self.data), len(relevant_cols)), dtype=bool)
+        for col_num, col_name in enumerate(relevant_cols):
+            col = self.data[col_name]
+            col_empty_values = field_empty_values.get(col_name, empty_values)
+            if keep_valid_codes:
+                valid_codes = self._valid_codes(col_name)
+                col_empty_values = [
+                    empty_value for empty_value in col_empty_values
+                    if empty_value not in valid_codes
+                ]
+            col_na = col.isna()
+            if (
+                pd.api.types.is_numeric_dtype(col.dtype)
+                or pd.api.types.is_bool_dtype(col.dtype)
+            ):
+                col = col.astype(str)
+            is_empty[:, col_num] = (
+                col_na | col.isin(col_empty_values)
+            ).to_numpy(dtype=bool)
+
+        self.data = self.data.loc[~is_empty.all(axis=1)]
+
+    def validate_choices(self, col_names=None):
+        """Find recoded values that are not allowed codes of their field
+
+        Recoding leaves values that are not labels of the field as they are
+        and numeric values are not reported as recode issues, so a numeric
+        Rave label or a code that is not one of the field's choices would be
+        imported as is. Every radio, dropdown, yesno, truefalse and checkbox
+        column of self.data is checked against the codes in the data
+        dictionary (see redcap_codebook.Codebook.choice_violations).
+
+        Parameters
+        ----------
+        col_names : list, optional
+            Columns of self.data to check, by default None (every column)
+
+        Returns
+        -------
+        pandas.dataframe
+            One row per column and value that is not allowed with the columns
+            in redcap_codebook.VIOLATION_COLS ('field', 'value', 'count' and
+            'rows', the index labels of the rows of self.data with the
+            value); empty if every value is allowed
+        """
+        return self.codebook.choice_violations(self.data, col_names)
+
+    def _valid_codes(self, field_name):
+        """Return the codes of a field in the data dictionary
+
+        Parameters
+        ----------
+        field_name : str
+            REDCap field name
+
+        Returns
+        -------
+        set
+            Codes of the field's choices; '0' and '1' for yesno and truefalse
+            fields; empty for fields without choices
+        """
+        if self.codebook.field_types.get(field_name) in ['yesno', 'truefalse']:
+            return {'0', '1'}
+
+        return set(self.codebook.code_label.get(field_name, {}))
 
-        # remove NaN columns
-        data_wo_na = data_w_na.dropna(
-            subset=list(relevant_cols), how='all'
+
+def convert_in_chunks(
+    ravestub_redcap_dict, stub_repeat, output_path, event_name, complete_col,
+    repeat_instrument=None, spelling_dict=None, csv_path=None, encoding=None,
+    chunksize=1000, redcap_data_dict=None, return_issues=False
+):
+    """Convert the Rave flat export to a REDCap import file in subject chunks
+
+    Reads only the columns needed for the form, a chunk of subjects at a time,
+    and for each chunk initializes RedcapConv, corrects spelling
+    (RedcapConv.change_str), removes empty rows (RedcapConv.remove_na),
+    prepares the data for import (RedcapConv.prep_imp) and appends the result
+    to output_path. Peak memory depends on chunksize rather than the size of
+    the Rave flat export.
+
+    Parameters
+    ----------
+    ravestub_redcap_dict : dict
+        Dictionary which maps the Rave stub columns (keys) to the REDCap
+        columns (values)
+    stub_repeat : int or None
+        Maximum number of repeats expected (see RedcapConv); None detects it
+        from the header of the Rave flat export
+    output_path : str or pathlib.Path
+        Path of the REDCap import CSV; overwritten if it exists
+    event_name : str
+        REDCap event name (see RedcapConv.prep_imp)
+    complete_col : str
+        Name of REDCap column which indicate the status of the event (see
+        RedcapConv.prep_imp)
+    repeat_instrument : str, optional
+        Name of REDCap column for repeat instances, by default None
+    spelling_dict : dictionary of dictionaries, optional
+        Spelling corrections passed to RedcapConv.change_str, by default None
+    csv_path : str or pathlib.Path, optional
+        Path of the Rave flat export, by default None (the rave_clinic file in
+        obs_data_sets)
+    encoding : str, optional
+        Encoding of the Rave flat export, by default None (the rave_clinic
+        encoding in obs_data_sets)
+    chunksize : int, optional
+        Number of subjects (rows of the flat export) converted at a time, by
+        default 1000
+    redcap_data_dict : pandas.dataframe, optional
+        Finalized project's data dictionary derived from REDCap, by default
+        None (obs_data_sets.redcap_data_dict is used)
+    return_issues : bool, optional
+        Also return the recode issues of every chunk, by default False
+
+    Returns
+    -------
+    int
+        Number of rows written to output_path
+    pandas.dataframe
+        Only if return_issues: recode issues of every chunk combined (see
+        RedcapConv.recode_issues); a value that could not be recoded in
+        several chunks is listed once with the total count
+
+    Notes
+    -----
+    Rows are grouped by chunk, so the row order of a repeating form differs
+    from converting the whole export at once; the rows themselves are the
+    same.
+    """
+    if csv_path is None:
+        file_name, source_encoding = obs_data_sets.SOURCES['rave_clinic']
+        csv_path = obs_data_sets.RAW_DIR/file_name
+        if encoding is None:
+            encoding = source_encoding
+    if redcap_data_dict is None:
+        redcap_data_dict = obs_data_sets.redcap_data_dict
+
+    if stub_repeat is None:
+        stub_repeat = rave_header_index.RaveHeaderIndex.from_csv(
+            csv_path, encoding
+        ).stub_repeat(ravestub_redcap_dict)
+
+    rave_chunks = pd.read_csv(
+        csv_path,
+        encoding=encoding,
+        dtype=str,
+        usecols=RedcapConv.required_cols(ravestub_redcap_dict, stub_repeat),
+        chunksize=chunksize
+    )
+    num_rows = 0
+    chunk_issues = []
+    for chunk_num, rave_chunk in enumerate(rave_chunks):
+        conv = RedcapConv(
+            ravestub_redcap_dict=ravestub_redcap_dict,
+            stub_repeat=stub_repeat,
+            main_df=rave_chunk,
+            redcap_data_dict=redcap_data_dict
         )
-        data_wo_cols = data_wo_na[relevant_cols]
-        # still contains 'nan' strings and '0', convert to 'nan' to '0'
-        data_wo_nan = data_wo_na.loc[
-            ~(
-                data_wo_cols.astype(str).replace({'nan': '0'}) == '0'
-            ).all(axis=1)
-        ]
-        # remove both 'nan' and '0'
-        data_wo = data_wo_nan.dropna(subset=list(relevant_cols), how='all')
+        if spelling_dict is not None:
+            conv.change_str(spelling_dict)
+        conv.remove_na()
+        conv.prep_imp(event_name, complete_col, repeat_instrument)
+        conv.data.to_csv(
+            output_path,
+            mode='w' if chunk_num == 0 else 'a',
+            header=chunk_num == 0,
+            index=False
+        )
+        num_rows += len(conv.data)
+        chunk_issues.append(conv.recode_issues)
 
-        self.data = data_wo
+    if not return_issues:
+        return num_rows
+
+    return num_rows, _combine_issues(chunk_issues)
+
+
+def _combine_issues(issues_list):
+    """Combine the recode issues of many RedcapConv instances
+
+    Values that could not be recoded are grouped by stage, field and value,
+    summing their counts and keeping the first MAX_EXAMPLE_OBS_IDS example
+    obs_id; identical exceptions are listed once.
+    """
+    issues = pd.concat(
+        [pd.DataFrame(columns=ISSUE_COLS)] + list(issues_list),
+        ignore_index=True
+    )
+    is_exception = issues['exception'].notna()
+    unmapped = issues.loc[~is_exception]
+    if not unmapped.empty:
+        unmapped = unmapped.groupby(
+            ['stage', 'field', 'raw_value'], sort=False
+        ).agg(
+            count=('count', 'sum'),
+            example_obs_ids=(
+                'example_obs_ids',
+                lambda obs_id_lists: list(dict.fromkeys(
+                    obs_id for obs_ids in obs_id_lists for obs_id in obs_ids
+                ))[:MAX_EXAMPLE_OBS_IDS]
+            )
+        ).reset_index()
+        unmapped['exception'] = np.nan
+    exceptions = issues.loc[is_exception].drop_duplicates(
+        subset=['stage', 'field', 'exception']
+    )
+
+    return pd.concat(
+        [unmapped[ISSUE_COLS], exceptions[ISSUE_COLS]], ignore_index=True
+    )
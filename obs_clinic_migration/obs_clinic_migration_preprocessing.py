@@ -1,6 +1,14 @@
 """Functions to preprocess data before calling obs_clinic_migration"""
 
 import numpy as np
+import pandas as pd
+
+# format of dates in the Rave flat export (e.g. '09SEP2019')
+RAVE_DATE_FORMAT = '%d%b%Y'
+# format of REDCap date_ymd fields
+REDCAP_DATE_FORMAT = '%Y-%m-%d'
+# columns of the unparseable value report of normalize_dates
+UNPARSEABLE_DATE_COLS = ['column', 'value', 'count']
 
 
 def rave_date_unknown(
@@ -60,69 +68,144 @@ def rave_date_unknown(
 
     """
 
-    rave_date_known_col_name = rave_date_stub + 'yn_date_'
-    rave_date_year = rave_date_stub + year_suffix
-    rave_date_month = rave_date_stub + month_suffix
-    rave_date_day = rave_date_stub + day_suffix
-
-    for occur_num in range(1, (max_occur_num + 1)):
-        # indicate 'Yes' in the rave_date_known column for instances where a
-        # date is available
-        rave_df.loc[
-            (
-                (
-                    (rave_df[rave_date_year + str(occur_num)] != '1900')
-                    & (rave_df[rave_date_year + str(occur_num)].notna())
-                )
-                | (rave_df[rave_date_month + str(occur_num)].notna())
-                | (rave_df[rave_date_day + str(occur_num)].notna())
-            ), (rave_date_known_col_name + str(occur_num))
-        ] = 'Yes'
-        # indicate 'No' in the rave_date_known column for instances where a
-        # date is unavailable
-        rave_df.loc[
-            (
-                (
-                    rave_df[
-                        date_dependency + str(occur_num)
-                    ] == dependency_answer
-                )
-                & (rave_df[date_dependency + str(occur_num)].notna())
-                & (rave_df[rave_date_known_col_name + str(occur_num)].isna())
-            ), (rave_date_known_col_name + str(occur_num))
-        ] = 'No'
-        # indicate '99' (i.e.no data availble) in the rave_date_year column for
-        # instances where the year is listed as 1900
-        rave_df.loc[
-            (
-                (rave_df[rave_date_known_col_name + str(occur_num)] == 'Yes')
-                & (rave_df[rave_date_year + str(occur_num)] == '1900')
-            ), (rave_date_year + str(occur_num))
-        ] = '99'
-        # np.NaN in the rave_date_year column for instances where the
-        # no year data is availble
-        rave_df.loc[
-            (
-                (rave_df[rave_date_known_col_name + str(occur_num)] == 'No')
-                & (rave_df[rave_date_year + str(occur_num)] == '1900')
-            ), (rave_date_year + str(occur_num))
-        ] = np.NaN
-        # indicate '99' (i.e.no data availble) in the rave_date_month or
-        # rave_date_day column for instances where the data is unavailable
-        for date_val in [rave_date_month, rave_date_day]:
-
-            rave_df.loc[
-                (
-                    (
-                        rave_df[
-                            rave_date_known_col_name + str(occur_num)
-                        ] == 'Yes'
-                    )
-                    & (rave_df[date_val + str(occur_num)].isna())
-                ), (date_val + str(occur_num))
-            ] = '99'
+    return rave_date_unknown_batch(
+        rave_df,
+        [(date_dependency, dependency_answer, rave_date_stub, max_occur_num)],
+        year_suffix=year_suffix,
+        month_suffix=month_suffix,
+        day_suffix=day_suffix
+    )
+
 
-    return rave_df
+def rave_date_unknown_batch(
+    rave_df, date_specs, year_suffix='YYYY_', month_suffix='MM_',
+    day_suffix='DD_'
+):
+    """Add 'date unavailabe' columns to RAVE dataframe for many date stubs
+
+    Equivalent to calling rave_date_unknown once per date stub; however, the
+    year, month and day columns of every date stub and occurrence are
+    processed together as 2D arrays and written back to rave_df at once.
+
+    Parameters
+    ----------
+    rave_df : pandas.dataframe
+        the rave dataframe to be altered
+    date_specs : list of tuples
+        (date_dependency, dependency_answer, rave_date_stub, max_occur_num)
+        for each date stub; see rave_date_unknown. For example:
+        [
+            ('MEDHX_NY_', 'Yes', 'ONSET_YR_', 11),
+            ('CONTINUE_NY_', 'No', 'RESOLUTION_YR_', 11)
+        ]
+    year_suffix : str, optional
+        year suffix that is appended to rave_date_stub, by default 'YYYY_'
+    month_suffix : str, optional
+        month suffix that is appended to rave_date_stub, by default 'MM_'
+    day_suffix : str, optional
+        day suffix that is appended to rave_date_stub, by default 'DD_'
+
+    Returns
+    -------
+    pandas.dataframe
+        rave_df with modified dates and a new column called
+        (rave_date_stub + 'yn_date_' + iteration) for each date stub and
+        occurrence which will indicate if data is available
+
+    Raises
+    ------
+    ValueError
+        If a rave_date_stub is listed more than once
+    KeyError
+        If a date_dependency, year, month or day column is not in rave_df
+        (only the 'yn_date_' columns may be missing)
+
+    Notes
+    -----
+    Assumes '99' is the 'don't know' response and a year of '1900' was used to
+    signify date unknown. rave_df is modified in place.
+    """
+    rave_date_stubs = [date_spec[2] for date_spec in date_specs]
+    if len(set(rave_date_stubs)) != len(rave_date_stubs):
+        raise ValueError(
+            f"rave_date_stub listed more than once in {rave_date_stubs}"
+        )
+
+    # columns for each date stub and occurrence; position k in each list
+    # refers to the same date stub and occurrence
+    dependency_cols, known_cols, year_cols, month_cols, day_cols = (
+        [], [], [], [], []
+    )
+    dependency_answers = []
+    for (
+        date_dependency, dependency_answer, rave_date_stub, max_occur_num
+    ) in date_specs:
+        for occur_num in range(1, (max_occur_num + 1)):
+            dependency_cols.append(date_dependency + str(occur_num))
+            dependency_answers.append(dependency_answer)
+            known_cols.append(rave_date_stub + 'yn_date_' + str(occur_num))
+            year_cols.append(rave_date_stub + year_suffix + str(occur_num))
+            month_cols.append(rave_date_stub + month_suffix + str(occur_num))
+            day_cols.append(rave_date_stub + day_suffix + str(occur_num))
+    missing_cols = [
+        col_name
+        for col_name in dependency_cols + year_cols + month_cols + day_cols
+        if col_name not in rave_df
+    ]
+    if missing_cols:
+        raise KeyError(f'{missing_cols} not in the Rave dataframe')
+
+    dependency, dependency_na = _str_block(rave_df, dependency_cols)
+    year, year_na = _str_block(rave_df, year_cols)
+    month, month_na = _str_block(rave_df, month_cols)
+    day, day_na = _str_block(rave_df, day_cols)
+    known, known_na = _str_block(rave_df, known_cols)
+
+    # indicate 'Yes' in the rave_date_known column for instances where a
+    # date is available
+    is_yes = ((year != '1900') & ~year_na) | ~month_na | ~day_na
+    known[is_yes] = 'Yes'
+    known_na &= ~is_yes
+    # indicate 'No' in the rave_date_known column for instances where a
+    # date is unavailable
+    is_no = (
+        (dependency == np.array(dependency_answers, dtype=object))
+        & ~dependency_na
+        & known_na
+    )
+    known[is_no] = 'No'
+    known_na &= ~is_no
+    known_changed = is_yes | is_no
+    is_yes = known == 'Yes'
+    is_no = known == 'No'
+    # indicate '99' (i.e.no data availble) in the rave_date_year column for
+    # instances where the year is listed as 1900, or np.NaN where no year data
+    # is availble
+    year_1900 = year == '1900'
+    year[is_yes & year_1900] = '99'
+    year[is_no & year_1900] = np.NaN
+    # indicate '99' (i.e.no data availble) in the rave_date_month or
+    # rave_date_day column for instances where the data is unavailable
+    month[is_yes & month_na] = '99'
+    day[is_yes & day_na] = '99'
+    for values, values_na in [
+        (known, known_na), (year, year_na), (month, month_na), (day, day_na)
+    ]:
+        values[values_na & (values == '')] = np.NaN
+
+    # only the cells set above are written back
+    col_values, col_changed = {}, {}
+    for col_names, values, is_changed in [
+        (known_cols, known, known_changed),
+        (year_cols, year, year_1900 & (is_yes | is_no)),
+        (month_cols, month, is_yes & month_na),
+        (day_cols, day, is_yes & day_na)
+    ]:
+        for col_num, col_name in enumerate(col_names):
+            col_values[col_name] = values[:, col_num]
+            col_changed[col_name] = is_changed[:, col_num]
+
+    return _write_cols(rave_df, col_values, col_changed)
 
 
 def create_specify_col(
@@ -160,14 +243,317 @@ def create_specify_col(
         relevant data from the original column (label_col); original column
         (label_col) is overwritten with expected value
     """
-    # initialize new empty column
-    rave_df[create_col] = np.NaN
-    # transfer relevant data from the old column (label_col) to the new
-    # one (create_col)
-    rave_df.loc[rave_df[coded_col] == label_code, create_col] = (
-        rave_df[label_col][rave_df[coded_col] == label_code]
+    return create_specify_col_batch(
+        rave_df,
+        [
+            {
+                'create_col': create_col,
+                'coded_col': coded_col,
+                'label_col': label_col,
+                'label_code': label_code,
+                'label_ans': label_ans
+            }
+        ]
+    )
+
+
+def create_specify_col_batch(rave_df, specify_specs):
+    """Add many 'please specify' columns to RAVE dataframe at once
+
+    Equivalent to calling create_specify_col once per coded/label column
+    pair, in order (a spec may use the columns created or modified by the
+    previous specs); however, the specs are applied to the referenced columns
+    only and the results are written back to rave_df (modified in place) at
+    once.
+
+    Parameters
+    ----------
+    rave_df : pandas.dataframe
+        Dataframe the function will be performed on.
+    specify_specs : list of dictionaries or pandas.dataframe
+        create_specify_col arguments (create_col, coded_col, label_col,
+        label_code and label_ans) for each coded/label column pair; one
+        dictionary or row per pair. For repeated stubs, include
+        'max_occur_num': create_col, coded_col and label_col are then stubs
+        and the occurrence number (1 to max_occur_num) is appended to each.
+        For example:
+        [
+            {
+                'create_col': 'ANTIBIOTIC_SPEC_',
+                'coded_col': 'ANTIBIOTIC_STD_',
+                'label_col': 'ANTIBIOTIC_',
+                'label_code': '12',
+                'label_ans': 'Other',
+                'max_occur_num': 17
+            }
+        ]
+
+    Returns
+    -------
+    pandas.dataframe
+        rave_df (modified in place) with a new column (create_col) for each
+        pair containing relevant data from the original column (label_col);
+        original column (label_col) is overwritten with expected value
+
+    Raises
+    ------
+    ValueError
+        If a create_col or label_col is listed more than once
+    """
+    specify_specs = _expand_specify_specs(specify_specs)
+    for key in ['create_col', 'label_col']:
+        col_names = [specify_spec[key] for specify_spec in specify_specs]
+        if len(set(col_names)) != len(col_names):
+            raise ValueError(f"{key} listed more than once in {col_names}")
+
+    # values of the columns created or modified so far; specs are applied in
+    # order, so a spec reads the columns modified by the previous specs
+    new_values = {}
+
+    def col_values(col_name):
+        if col_name in new_values:
+            return pd.Series(new_values[col_name], index=rave_df.index)
+        return rave_df[col_name]
+
+    for specify_spec in specify_specs:
+        label_values = col_values(specify_spec['label_col']).to_numpy(
+            dtype=object
+        )
+        # transfer relevant data from the old column (label_col) to the new
+        # one (create_col)
+        is_label_code = _fill_mask(
+            col_values(specify_spec['coded_col'])
+            == specify_spec['label_code']
+        ).to_numpy()
+        specify_values = np.full(len(rave_df), np.NaN, dtype=object)
+        specify_values[is_label_code] = label_values[is_label_code]
+        new_values[specify_spec['create_col']] = specify_values
+        # overwrite data in old column with expected 'please specify' value
+        label_values = label_values.copy()
+        label_values[is_label_code] = specify_spec['label_ans']
+        new_values[specify_spec['label_col']] = label_values
+
+    return _write_cols(rave_df, new_values)
+
+
+def normalize_dates(
+    rave_df, date_cols, date_format=RAVE_DATE_FORMAT,
+    output_format=REDCAP_DATE_FORMAT, keep_unparseable=False,
+    return_report=False
+):
+    """Reformat many Rave date columns at once
+
+    Replaces calling pd.to_datetime(col).dt.strftime('%Y-%m-%d') on each
+    column. The distinct values of every column are parsed once with an
+    explicit format (no format inference) and mapped back to the columns, so
+    a date repeated across rows or columns is only parsed once.
+
+    Parameters
+    ----------
+    rave_df : pandas.dataframe
+        the rave dataframe to be altered
+    date_cols : list
+        Names of the date columns (e.g. ['BASE_ASSESS_DT', 'DOB'])
+    date_format : str, optional
+        strptime format of the Rave dates, by default RAVE_DATE_FORMAT
+        ('%d%b%Y'; e.g. '%d%b%Y %H:%M:%S' for date and time columns)
+    output_format : str, optional
+        strftime format of the reformatted dates, by default
+        REDCAP_DATE_FORMAT ('%Y-%m-%d')
+    keep_unparseable : bool, optional
+        Keep values that don't match date_format unchanged instead of
+        replacing them with np.NaN, by default False
+    return_report : bool, optional
+        Also return the report of unparseable values, by default False
+
+    Returns
+    -------
+    pandas.dataframe
+        rave_df (modified in place) with reformatted date columns
+    pandas.dataframe
+        Only if return_report: one row per column and value that did not
+        match date_format, with the columns in UNPARSEABLE_DATE_COLS
+
+    Raises
+    ------
+    KeyError
+        If a date column is not in rave_df
+
+    Notes
+    -----
+    Missing values remain missing. Only the changed cells are written to
+    rave_df.
+    """
+    missing_cols = [
+        col_name for col_name in date_cols if col_name not in rave_df
+    ]
+    if missing_cols:
+        raise KeyError(f'{missing_cols} not in the Rave dataframe')
+
+    values = np.empty((len(rave_df), len(date_cols)), dtype=object)
+    for col_num, col_name in enumerate(date_cols):
+        values[:, col_num] = rave_df[col_name].to_numpy(dtype=object)
+    # missing values are coded -1
+    codes, distinct_values = pd.factorize(values.ravel())
+    codes = codes.reshape(values.shape)
+
+    parsed = pd.to_datetime(
+        pd.Series(distinct_values, dtype=object),
+        format=date_format,
+        errors='coerce'
     )
-    # overwrite data in old column with expected 'please specify' value
-    rave_df.loc[rave_df[coded_col] == label_code, label_col] = label_ans
+    is_unparseable = parsed.isna().to_numpy()
+    # the last entry is used for missing values (code -1)
+    new_values = np.empty(len(distinct_values) + 1, dtype=object)
+    new_values[:-1] = parsed.dt.strftime(output_format).to_numpy(dtype=object)
+    if keep_unparseable:
+        new_values[:-1][is_unparseable] = distinct_values[is_unparseable]
+    else:
+        new_values[:-1][is_unparseable] = np.NaN
+    new_values[-1] = np.NaN
+
+    # a value is changed if it was reformatted or is unparseable
+    is_changed = (new_values[:-1] != distinct_values)[codes] & (codes >= 0)
+    rave_df = _write_cols(
+        rave_df,
+        {
+            col_name: new_values[codes[:, col_num]]
+            for col_num, col_name in enumerate(date_cols)
+        },
+        {
+            col_name: is_changed[:, col_num]
+            for col_num, col_name in enumerate(date_cols)
+        }
+    )
+
+    if not return_report:
+        return rave_df
+
+    reports = []
+    for col_num, col_name in enumerate(date_cols):
+        col_codes = codes[:, col_num]
+        col_codes = col_codes[col_codes >= 0]
+        col_codes = col_codes[is_unparseable[col_codes]]
+        if len(col_codes) == 0:
+            continue
+        bad_codes, counts = np.unique(col_codes, return_counts=True)
+        reports.append(pd.DataFrame(
+            {
+                'column': col_name,
+                'value': distinct_values[bad_codes],
+                'count': counts
+            },
+            columns=UNPARSEABLE_DATE_COLS
+        ))
+    report = (
+        pd.concat(reports, ignore_index=True) if reports
+        else pd.DataFrame(columns=UNPARSEABLE_DATE_COLS)
+    )
+
+    return rave_df, report
+
+
+def _expand_specify_specs(specify_specs):
+    """Return one create_specify_col_batch spec per coded/label column pair
+
+    Specs with 'max_occur_num' are expanded into one spec per occurrence.
+    """
+    if isinstance(specify_specs, pd.DataFrame):
+        specify_specs = specify_specs.to_dict('records')
+
+    expanded_specs = []
+    for specify_spec in specify_specs:
+        specify_spec = dict(specify_spec)
+        max_occur_num = specify_spec.pop('max_occur_num', None)
+        if max_occur_num is None or pd.isna(max_occur_num):
+            expanded_specs.append(specify_spec)
+            continue
+        for occur_num in range(1, int(max_occur_num) + 1):
+            expanded_specs.append({
+                **specify_spec,
+                **{
+                    key: specify_spec[key] + str(occur_num)
+                    for key in ['create_col', 'coded_col', 'label_col']
+                }
+            })
+
+    return expanded_specs
+
+
+def _str_block(rave_df, col_names):
+    """Return columns as a 2D object array and its missing value mask
+
+    Missing values are replaced by '' so the array can be compared to strings
+    regardless of the missing value marker (np.NaN or pandas.NA). Columns that
+    don't exist (e.g. 'yn_date_' columns not yet created) are treated as
+    missing.
+    """
+    values = np.empty((len(rave_df), len(col_names)), dtype=object)
+    values_na = np.ones(values.shape, dtype=bool)
+    for col_num, col_name in enumerate(col_names):
+        if col_name in rave_df:
+            values[:, col_num] = rave_df[col_name].to_numpy(dtype=object)
+            # column by column, which is faster than a 2D isna
+            values_na[:, col_num] = pd.isna(values[:, col_num])
+    values[values_na] = ''
+
+    return values, values_na
+
+
+def _write_cols(rave_df, col_values, col_changed=None):
+    """Write columns into rave_df in place and return it
+
+    Only the changed cells of existing columns are written with .loc, which
+    writes into the column's block instead of copying the block (as replacing
+    the whole column does). The changed cells are given by col_changed
+    (column name: boolean mask) or found by comparing values. Categorical
+    and extension columns are replaced and keep their type (see
+    _as_dtype_of); new columns are added with a single assignment.
+    """
+    col_changed = col_changed or {}
+    new_cols = []
+    for col_name, values in col_values.items():
+        if col_name not in rave_df:
+            new_cols.append(col_name)
+            continue
+        rave_col = rave_df[col_name]
+        if pd.api.types.is_extension_array_dtype(rave_col.dtype):
+            rave_df[col_name] = _as_dtype_of(values, rave_col)
+            continue
+        is_changed = col_changed.get(col_name)
+        if is_changed is None:
+            old_values = rave_col.to_numpy(dtype=object)
+            old_na = pd.isna(old_values)
+            values_na = pd.isna(values)
+            is_changed = (old_na != values_na) | (
+                ~old_na & ~values_na & (old_values != values)
+            )
+        if is_changed.any():
+            rave_df.loc[is_changed, col_name] = values[is_changed]
+    if new_cols:
+        rave_df[new_cols] = pd.DataFrame(
+            {col_name: col_values[col_name] for col_name in new_cols},
+            index=rave_df.index
+        )
 
     return rave_df
+
+
+def _as_dtype_of(values, rave_col):
+    """Create a column from values with the same type of column as rave_col
+
+    Categorical and extension (e.g. Arrow-backed string) columns keep their
+    type; other columns are object columns.
+    """
+    new_col = pd.Series(values, index=rave_col.index, name=rave_col.name)
+    if pd.api.types.is_categorical_dtype(rave_col.dtype):
+        return new_col.astype('category')
+    if pd.api.types.is_extension_array_dtype(rave_col.dtype):
+        return new_col.astype(rave_col.dtype)
+
+    return new_col
+
+
+def _fill_mask(mask):
+    """Convert a nullable boolean mask to bool, treating missing as False"""
+    return mask.fillna(False).astype(bool)
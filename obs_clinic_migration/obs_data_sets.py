@@ -1,24 +1,295 @@
-"""Access raw data to be manipulated during the data migration process"""
+"""Access raw data to be manipulated during the data migration process
 
+Data sets are loaded lazily the first time they are accessed (e.g.
+obs_data_sets.rave_clinic) rather than when the module is imported. Once
+parsed, a data set is cached in a columnar format (Feather) in data/interim,
+keyed by the content hash of the raw CSV, so repeat runs can skip parsing the
+raw CSV.
+
+Set COMPACT_STORAGE = True before accessing rave_clinic to store it with
+compact column types (see compact_dtypes).
+
+To convert a single form without loading the whole Rave export, read_form
+reads only the form's columns from the raw CSV using its header index.
+"""
+
+import hashlib
+import os
 from pathlib import Path
+import numpy as np
 import pandas as pd
+import rave_header_index
+
+RAW_DIR = Path(__file__).parent/"../data/raw"
+CACHE_DIR = Path(__file__).parent/"../data/interim"
+PROCESSED_DIR = Path(__file__).parent/"../data/processed"
+
+# data set name: (raw CSV file name, encoding)
+SOURCES = {
+    'rave_clinic': ("OBS Flat Output 09SEP2019_475.csv", 'mbcs'),
+    'redcap_data_dict': ("OBSUAT_DataDictionary_2020-05-13.csv", None),
+    'redcap_clinic': ("redcap_double_data_entry.csv", 'mbcs'),
+}
+
+# when True, data sets in COMPACT_DATA_SETS are loaded with compact_dtypes
+COMPACT_STORAGE = False
+COMPACT_DATA_SETS = ['rave_clinic']
+# columns with more distinct values are not stored as categoricals
+MAX_CATEGORIES = 255
+
+# header indexes of the raw CSVs (see header_index)
+_HEADER_INDEXES = {}
+
+
+def __getattr__(name):
+    """Load a data set the first time it is accessed
+
+    Parameters
+    ----------
+    name : str
+        Name of the data set (a key in SOURCES)
+
+    Returns
+    -------
+    pandas.dataframe
+        Data set with all columns read as strings
+
+    Notes
+    -----
+    The loaded data set is stored as a module attribute so subsequent access
+    does not call this function and modifications made to the data set (e.g.
+    in the notebooks) persist for the session.
+    """
+    if name not in SOURCES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    file_name, encoding = SOURCES[name]
+    data_set = read_csv_cached(RAW_DIR/file_name, encoding=encoding)
+    if COMPACT_STORAGE and name in COMPACT_DATA_SETS:
+        data_set = compact_dtypes(data_set)
+    globals()[name] = data_set
+
+    return data_set
+
+
+def load(name):
+    """Return a data set, loading it if it has not been accessed yet
+
+    Parameters
+    ----------
+    name : str
+        Name of the data set (a key in SOURCES)
+
+    Returns
+    -------
+    pandas.dataframe
+        Data set with all columns read as strings
+    """
+    if name in globals():
+        return globals()[name]
+
+    return __getattr__(name)
+
+
+def header_index(name='rave_clinic'):
+    """Return the header index of a data set's raw CSV
+
+    The header is only read the first time; the index is reused afterwards.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the data set (a key in SOURCES), by default 'rave_clinic'
+
+    Returns
+    -------
+    rave_header_index.RaveHeaderIndex
+    """
+    if name not in _HEADER_INDEXES:
+        file_name, encoding = SOURCES[name]
+        _HEADER_INDEXES[name] = rave_header_index.RaveHeaderIndex.from_csv(
+            RAW_DIR/file_name, encoding
+        )
+
+    return _HEADER_INDEXES[name]
+
+
+def read_form(ravestub_redcap_dict, stub_repeat=None):
+    """Read only the Rave columns needed to convert a form
+
+    Uses rave_clinic if it is already loaded, otherwise reads only the form's
+    columns from the raw CSV (see header_index).
+
+    Parameters
+    ----------
+    ravestub_redcap_dict : dict
+        Dictionary which maps the Rave stub columns (keys) to the REDCap
+        columns (values)
+    stub_repeat : int, optional
+        Maximum number of repeats expected (see RedcapConv), by default None
+        (detected from the header)
+
+    Returns
+    -------
+    pandas.dataframe
+        Rave data in the wide format with only the form's columns
+    """
+    if 'rave_clinic' in globals():
+        rave_df = load('rave_clinic')
+        if stub_repeat is None:
+            stub_repeat = rave_header_index.RaveHeaderIndex.of(
+                rave_df
+            ).stub_repeat(ravestub_redcap_dict)
+        return rave_df[
+            rave_header_index.form_columns(ravestub_redcap_dict, stub_repeat)
+        ].copy()
+
+    return header_index('rave_clinic').read_form(
+        ravestub_redcap_dict, stub_repeat
+    )
+
+
+def file_hash(file_path, block_size=2**20):
+    """Calculate the SHA-256 hash of a file's contents
+
+    Parameters
+    ----------
+    file_path : str or pathlib.Path
+        Path of the file to hash
+    block_size : int, optional
+        Number of bytes read at a time, by default 2**20
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the file's contents
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+def read_csv_cached(csv_path, encoding=None, cache_dir=CACHE_DIR):
+    """Read a raw CSV as strings, reusing a cached columnar copy if available
+
+    Parameters
+    ----------
+    csv_path : str or pathlib.Path
+        Path of the raw CSV
+    encoding : str, optional
+        Encoding of the raw CSV, by default None
+    cache_dir : str or pathlib.Path, optional
+        Directory in which the cached copy is stored, by default CACHE_DIR
+
+    Returns
+    -------
+    pandas.dataframe
+        Data set with all columns read as strings and missing values as
+        np.NaN
+
+    Notes
+    -----
+    The cache requires pyarrow; if it is not installed the raw CSV is parsed
+    every time. Cached copies of previous versions of the raw CSV are removed
+    when a new copy is written. The copy is written to a temporary file and
+    then renamed, so concurrent processes can share the cache.
+    """
+    csv_path = Path(csv_path)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return _read_csv(csv_path, encoding)
+
+    cache_dir = Path(cache_dir)
+    cache_path = cache_dir/f"{csv_path.stem}-{file_hash(csv_path)}.feather"
+    if cache_path.exists():
+        data_set = pd.read_feather(cache_path)
+        # Feather stores missing strings as null which are read back as None
+        return data_set.where(data_set.notna(), np.nan)
+
+    data_set = _read_csv(csv_path, encoding)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale_path in cache_dir.glob(f"{csv_path.stem}-*.feather"):
+        if stale_path == cache_path:
+            continue
+        try:
+            stale_path.unlink()
+        except FileNotFoundError:
+            # already removed by another process
+            pass
+    # processes reading the same raw CSV (e.g. migration_runner workers)
+    # never see a partially written copy
+    temp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+    data_set.to_feather(temp_path)
+    os.replace(temp_path, cache_path)
+
+    return data_set
+
+
+def compact_dtypes(data_set, max_categories=MAX_CATEGORIES, keep_cols=None):
+    """Store string columns as categoricals or Arrow-backed strings
+
+    Most Rave columns are empty or contain a handful of repeated labels (e.g.
+    'Yes', 'No', '99'). These low cardinality columns are stored as
+    categoricals and the remaining columns as Arrow-backed strings, which
+    uses several times less memory than Python string objects.
+
+    Parameters
+    ----------
+    data_set : pandas.dataframe
+        Data set with all columns read as strings
+    max_categories : int, optional
+        Columns with at most max_categories distinct values, and at most one
+        distinct value for every two non-missing values, are stored as
+        categoricals, by default MAX_CATEGORIES
+    keep_cols : list, optional
+        Columns which are not converted, by default None (['Subject'])
+
+    Returns
+    -------
+    pandas.dataframe
+        Data set with compact column types
+
+    Notes
+    -----
+    Arrow-backed strings require pandas >= 1.3 and pyarrow; otherwise high
+    cardinality columns are not converted. Missing values in Arrow-backed
+    string columns are pandas.NA rather than np.NaN.
+    """
+    if keep_cols is None:
+        keep_cols = ['Subject']
+    string_dtype = _arrow_string_dtype()
+
+    col_dtypes = {}
+    for col_name in data_set.columns:
+        if col_name in keep_cols:
+            continue
+        num_values = data_set[col_name].count()
+        num_unique = data_set[col_name].nunique()
+        if num_unique <= max_categories and 2 * num_unique <= num_values:
+            col_dtypes[col_name] = 'category'
+        elif string_dtype is not None:
+            col_dtypes[col_name] = string_dtype
+
+    return data_set.astype(col_dtypes)
+
+
+def _arrow_string_dtype():
+    """Return the Arrow-backed string dtype or None if unavailable"""
+    try:
+        import pyarrow  # noqa: F401
+        return pd.StringDtype('pyarrow')
+    except (ImportError, TypeError, ValueError):
+        return None
+
 
-rave_clinic = pd.read_csv(
-    Path(__file__).parent/"../data/raw/OBS Flat Output 09SEP2019_475.csv",
-    encoding='mbcs',
-    low_memory=False,
-    dtype=str
-)
-
-redcap_data_dict = pd.read_csv(
-    Path(__file__).parent/"../data/raw/OBSUAT_DataDictionary_2020-05-13.csv",
-    low_memory=False,
-    dtype=str
-)
-
-redcap_clinic = pd.read_csv(
-    Path(__file__).parent/"../data/raw/redcap_double_data_entry.csv",
-    encoding='mbcs',
-    low_memory=False,
-    dtype=str
-)
+def _read_csv(csv_path, encoding=None):
+    """Parse a raw CSV with all columns read as strings"""
+    return pd.read_csv(
+        csv_path,
+        encoding=encoding,
+        low_memory=False,
+        dtype=str
+    )
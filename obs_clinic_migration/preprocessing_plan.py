@@ -0,0 +1,381 @@
+"""Record Rave preprocessing steps and run them only for the columns needed
+
+Instead of modifying the whole wide Rave dataframe cell by cell, steps are
+recorded in a PreprocessingPlan and materialized for the columns a form
+needs:
+
+>>> plan = PreprocessingPlan(obs_data_sets.rave_clinic)
+>>> plan.rave_date_unknown('MEDHX_NY_', 'Yes', 'ONSET_YR_', 11)
+>>> plan.create_specify_col(
+...     'ANTIBIOTIC_SPEC_1', 'ANTIBIOTIC_STD_1', 'ANTIBIOTIC_1', '12', 'Other'
+... )
+>>> rave_df = plan.materialize_form(ravestub_redcap_dict, stub_repeat)
+
+Only the steps producing columns the form needs (directly or through another
+step) are run, on a copy of only the columns they use. Consecutive
+independent rave_date_unknown or create_specify_col steps are fused into a
+single rave_date_unknown_batch or create_specify_col_batch call, and
+consecutive normalize_dates steps with the same formats into a single
+normalize_dates call. The source dataframe is never modified.
+"""
+
+import pandas as pd
+import obs_clinic_migration
+import obs_clinic_migration_preprocessing
+import source_view
+
+# preprocessing functions that can be recorded by name (see
+# PreprocessingPlan.add_form_spec_steps)
+STEPS = ['rave_date_unknown', 'create_specify_col', 'normalize_dates']
+
+
+class PreprocessingPlan:
+    """Lazily evaluated preprocessing steps of the Rave dataframe
+
+    Attributes
+    ----------
+    steps : list of PlanStep
+        Recorded steps in the order they are applied
+    """
+    def __init__(self, main_df):
+        """Create an empty plan
+
+        Parameters
+        ----------
+        main_df : pandas.dataframe or source_view.SourceView
+            Rave data in the wide format; it is not modified
+        """
+        self._source = source_view.SourceView.of(main_df)
+        self.steps = []
+
+    def rave_date_unknown(
+        self, date_dependency, dependency_answer, rave_date_stub,
+        max_occur_num, year_suffix='YYYY_', month_suffix='MM_',
+        day_suffix='DD_'
+    ):
+        """Record a obs_clinic_migration_preprocessing.rave_date_unknown step
+
+        See obs_clinic_migration_preprocessing.rave_date_unknown for the
+        parameters. The 'yn_date_' columns are read if they exist; the other
+        columns must be in the source dataframe or be created by an earlier
+        step.
+
+        Returns
+        -------
+        PreprocessingPlan
+            self, so steps can be chained
+        """
+        suffixes = (year_suffix, month_suffix, day_suffix)
+        input_cols, output_cols = [], []
+        for occur_num in range(1, (max_occur_num + 1)):
+            date_cols = [
+                rave_date_stub + suffix + str(occur_num) for suffix in suffixes
+            ]
+            known_col = rave_date_stub + 'yn_date_' + str(occur_num)
+            input_cols += (
+                [date_dependency + str(occur_num), known_col] + date_cols
+            )
+            output_cols += [known_col] + date_cols
+
+        date_spec = (
+            date_dependency, dependency_answer, rave_date_stub, max_occur_num
+        )
+        return self._add(PlanStep(
+            'rave_date_unknown',
+            date_spec,
+            input_cols,
+            output_cols,
+            fuse_key=suffixes
+        ))
+
+    def create_specify_col(
+        self, create_col, coded_col, label_col, label_code, label_ans
+    ):
+        """Record a obs_clinic_migration_preprocessing.create_specify_col step
+
+        See obs_clinic_migration_preprocessing.create_specify_col for the
+        parameters.
+
+        Returns
+        -------
+        PreprocessingPlan
+            self, so steps can be chained
+        """
+        return self._add(PlanStep(
+            'create_specify_col',
+            {
+                'create_col': create_col,
+                'coded_col': coded_col,
+                'label_col': label_col,
+                'label_code': label_code,
+                'label_ans': label_ans
+            },
+            [coded_col, label_col],
+            [create_col, label_col],
+            fuse_key=()
+        ))
+
+    def normalize_dates(
+        self, date_cols,
+        date_format=obs_clinic_migration_preprocessing.RAVE_DATE_FORMAT,
+        output_format=obs_clinic_migration_preprocessing.REDCAP_DATE_FORMAT,
+        keep_unparseable=False
+    ):
+        """Record a obs_clinic_migration_preprocessing.normalize_dates step
+
+        See obs_clinic_migration_preprocessing.normalize_dates for the
+        parameters.
+
+        Returns
+        -------
+        PreprocessingPlan
+            self, so steps can be chained
+        """
+        return self._add(PlanStep(
+            'normalize_dates',
+            list(date_cols),
+            list(date_cols),
+            list(date_cols),
+            fuse_key=(date_format, output_format, keep_unparseable)
+        ))
+
+    def add_step(self, func, input_cols, output_cols, **kwargs):
+        """Record any preprocessing step
+
+        Parameters
+        ----------
+        func : callable
+            Called as func(rave_df=rave_df, **kwargs) and returns the
+            modified dataframe; rave_df only contains the columns needed by
+            the plan
+        input_cols : list
+            Columns read by func
+        output_cols : list
+            Columns created or modified by func
+        **kwargs
+            Keyword arguments passed to func
+
+        Returns
+        -------
+        PreprocessingPlan
+            self, so steps can be chained
+        """
+        return self._add(PlanStep(
+            func, kwargs, list(input_cols), list(output_cols)
+        ))
+
+    def add_form_spec_steps(self, preprocessing):
+        """Record the preprocessing steps of a migration_runner form spec
+
+        Parameters
+        ----------
+        preprocessing : list
+            (function, kwargs) of each step; function must be the name of a
+            function in STEPS
+
+        Returns
+        -------
+        PreprocessingPlan
+            self, so steps can be chained
+
+        Raises
+        ------
+        ValueError
+            If a step can't be recorded (e.g. a callable whose columns are
+            unknown)
+        """
+        for step, step_kwargs in preprocessing:
+            if step not in STEPS:
+                raise ValueError(
+                    f'Columns used by preprocessing step {step!r} are unknown'
+                )
+            getattr(self, step)(**step_kwargs)
+
+        return self
+
+    @property
+    def columns(self):
+        """Columns of the source followed by the columns created by the steps
+
+        Used to detect a form's stub_repeat before materializing (see
+        rave_header_index.RaveHeaderIndex.of).
+        """
+        col_names = list(self._source.columns)
+        source_cols = set(col_names)
+        for step in self.steps:
+            for col_name in step.output_cols:
+                if col_name not in source_cols:
+                    source_cols.add(col_name)
+                    col_names.append(col_name)
+
+        return pd.Index(col_names, dtype=object)
+
+    def prune(self, col_names):
+        """Return the steps needed to compute columns
+
+        Parameters
+        ----------
+        col_names : list
+            Columns needed (e.g. RedcapConv.required_cols)
+
+        Returns
+        -------
+        list of PlanStep
+            Steps, in order, whose output is needed directly or by a later
+            needed step
+        set
+            Columns needed from the source dataframe, including the input
+            columns of the needed steps
+        """
+        needed_cols = set(col_names)
+        needed_steps = []
+        for step in reversed(self.steps):
+            if needed_cols.intersection(step.output_cols):
+                needed_steps.append(step)
+                needed_cols.update(step.input_cols)
+        needed_steps.reverse()
+
+        return needed_steps, needed_cols
+
+    def materialize(self, col_names):
+        """Run the steps needed to compute columns
+
+        Parameters
+        ----------
+        col_names : list
+            Columns needed (e.g. RedcapConv.required_cols)
+
+        Returns
+        -------
+        pandas.dataframe
+            New dataframe with the needed source columns after running the
+            needed steps (and any other column these steps created)
+
+        Raises
+        ------
+        KeyError
+            If a column read by a needed step is neither in the source
+            dataframe nor created by an earlier step
+        """
+        needed_steps, needed_cols = self.prune(col_names)
+        source_cols = [
+            col_name for col_name in self._source.columns
+            if col_name in needed_cols
+        ]
+        rave_df = self._source.project(source_cols).to_frame()
+
+        for step_group in _fuse(needed_steps):
+            rave_df = _run(step_group, rave_df)
+
+        return rave_df
+
+    def materialize_form(self, ravestub_redcap_dict, stub_repeat):
+        """Run the steps needed to convert a form
+
+        Parameters
+        ----------
+        ravestub_redcap_dict : dict
+            Dictionary which maps the Rave stub columns (keys) to the REDCap
+            columns (values)
+        stub_repeat : int
+            Maximum number of repeats expected (see RedcapConv)
+
+        Returns
+        -------
+        pandas.dataframe
+            Rave data to pass to RedcapConv as main_df
+        """
+        return self.materialize(
+            obs_clinic_migration.RedcapConv.required_cols(
+                ravestub_redcap_dict, stub_repeat
+            )
+        )
+
+    def _add(self, step):
+        self.steps.append(step)
+        return self
+
+
+class PlanStep:
+    """A recorded preprocessing step
+
+    Attributes
+    ----------
+    func : str or callable
+        Name of a function in STEPS or a callable (see
+        PreprocessingPlan.add_step)
+    args : tuple, dict or list
+        Date spec (see rave_date_unknown_batch), specify spec (see
+        create_specify_col_batch), date columns (see normalize_dates) or
+        keyword arguments of func
+    input_cols : list
+        Columns read by the step
+    output_cols : list
+        Columns created or modified by the step
+    fuse_key : tuple or None
+        Consecutive steps with the same func and fuse_key can be run in a
+        single batch call; None if the step can't be fused
+    """
+    def __init__(self, func, args, input_cols, output_cols, fuse_key=None):
+        self.func = func
+        self.args = args
+        self.input_cols = input_cols
+        self.output_cols = output_cols
+        self.fuse_key = fuse_key
+
+
+def _fuse(steps):
+    """Group consecutive steps that can run in a single batch call
+
+    Steps are fused if they have the same func and fuse_key and don't use
+    or modify the columns modified by another step of the group.
+    """
+    step_groups = []
+    for step in steps:
+        if step_groups:
+            group = step_groups[-1]
+            group_outputs = set().union(
+                *[group_step.output_cols for group_step in group]
+            )
+            if (
+                step.fuse_key is not None
+                and step.func == group[0].func
+                and step.fuse_key == group[0].fuse_key
+                and not group_outputs.intersection(step.input_cols)
+                and not group_outputs.intersection(step.output_cols)
+            ):
+                group.append(step)
+                continue
+        step_groups.append([step])
+
+    return step_groups
+
+
+def _run(step_group, rave_df):
+    """Run a group of fused steps (see _fuse) on rave_df"""
+    func = step_group[0].func
+    if func == 'rave_date_unknown':
+        year_suffix, month_suffix, day_suffix = step_group[0].fuse_key
+        return obs_clinic_migration_preprocessing.rave_date_unknown_batch(
+            rave_df,
+            [step.args for step in step_group],
+            year_suffix=year_suffix,
+            month_suffix=month_suffix,
+            day_suffix=day_suffix
+        )
+    if func == 'create_specify_col':
+        return obs_clinic_migration_preprocessing.create_specify_col_batch(
+            rave_df, [step.args for step in step_group]
+        )
+
+    if func == 'normalize_dates':
+        date_format, output_format, keep_unparseable = step_group[0].fuse_key
+        return obs_clinic_migration_preprocessing.normalize_dates(
+            rave_df,
+            [col_name for step in step_group for col_name in step.args],
+            date_format=date_format,
+            output_format=output_format,
+            keep_unparseable=keep_unparseable
+        )
+
+    return func(rave_df=rave_df, **step_group[0].args)
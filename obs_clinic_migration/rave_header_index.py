@@ -0,0 +1,322 @@
+"""Index the columns of the Rave flat export by stub, date part and instance
+
+Rave flat export columns are named stub + instance number for repeated
+fields (e.g. 'MEDHX_NY_1', 'ONSET_YR_YYYY_1') and date fields are split into
+year, month and day columns. A RaveHeaderIndex parses the header once so a
+form's columns can be found, and read from the flat file, without loading
+the whole export:
+
+>>> index = RaveHeaderIndex.from_csv(csv_path, encoding='mbcs')
+>>> index.stub_repeat({'MEDHX_NY_': 'medhx_ny'})
+11
+>>> rave_df = index.read_form({'MEDHX_NY_': 'medhx_ny'})
+"""
+
+import functools
+import re
+import numpy as np
+import pandas as pd
+
+# columns of RaveHeaderIndex.cols
+INDEX_COLS = ['position', 'stub', 'instance', 'date_stub', 'date_suffix']
+# suffixes of the year, month and day columns of a date (see
+# obs_clinic_migration_preprocessing.rave_date_unknown)
+DATE_SUFFIXES = ['YYYY_', 'MM_', 'DD_']
+
+_INSTANCE_PATTERN = re.compile(r'^(?P<stub>.+_)(?P<instance>[0-9]+)$')
+
+
+class RaveHeaderIndex:
+    """Parsed header of the Rave flat export
+
+    Attributes
+    ----------
+    cols : pandas.dataframe
+        One row per column, indexed by column name, with the columns in
+        INDEX_COLS: position in the file, stub (the column name without the
+        instance number, which is the key used in ravestub_redcap_dict),
+        instance (0 for columns without an instance number), and date_stub
+        and date_suffix for date columns (e.g. 'ONSET_YR_' and 'YYYY_' for
+        'ONSET_YR_YYYY_1'; otherwise None). It is shared by the indexes of
+        the same columns and must not be modified.
+    csv_path : pathlib.Path or None
+        Flat export the header was read from
+    encoding : str or None
+        Encoding of the flat export
+    """
+    def __init__(self, columns, csv_path=None, encoding=None):
+        """Index column names
+
+        Parameters
+        ----------
+        columns : list-like
+            Column names in the order of the flat export (e.g.
+            rave_df.columns)
+        csv_path : str or pathlib.Path, optional
+            Flat export the columns were read from, by default None (the
+            index can't read columns, see from_csv)
+        encoding : str, optional
+            Encoding of the flat export, by default None
+        """
+        self.cols, self._max_instances = _parse_columns(tuple(columns))
+        self.csv_path = csv_path
+        self.encoding = encoding
+
+    @classmethod
+    def from_csv(cls, csv_path, encoding=None):
+        """Index the header of a flat export without reading its rows
+
+        Parameters
+        ----------
+        csv_path : str or pathlib.Path
+            Path of the Rave flat export
+        encoding : str, optional
+            Encoding of the flat export, by default None
+
+        Returns
+        -------
+        RaveHeaderIndex
+        """
+        columns = pd.read_csv(
+            csv_path, encoding=encoding, nrows=0, dtype=str
+        ).columns
+        return cls(columns, csv_path, encoding)
+
+    @classmethod
+    def of(cls, main_df):
+        """Index the columns of Rave data
+
+        Parameters
+        ----------
+        main_df : pandas.dataframe, source_view.SourceView or
+                preprocessing_plan.PreprocessingPlan
+            Rave data in the wide format; the columns of a plan include the
+            columns created by its steps
+
+        Returns
+        -------
+        RaveHeaderIndex
+            Index of main_df's columns; the parsed columns are cached so
+            indexing the same columns again is fast
+        """
+        return cls(main_df.columns)
+
+    def instances(self, stub_name):
+        """Return the number of instances of a stub
+
+        Parameters
+        ----------
+        stub_name : str
+            Rave stub (e.g. 'MEDHX_NY_')
+
+        Returns
+        -------
+        int
+            Highest instance number of the stub's columns; 0 if the stub has
+            no numbered columns
+        """
+        return self._max_instances.get(stub_name, 0)
+
+    def stub_repeat(self, ravestub_redcap_dict):
+        """Detect the stub_repeat of a form from the columns
+
+        Parameters
+        ----------
+        ravestub_redcap_dict : dict
+            Dictionary which maps the Rave stub columns (keys) to the REDCap
+            columns (values)
+
+        Returns
+        -------
+        int
+            0 if every key is a column (single instance form), otherwise the
+            highest instance number of the keys' numbered columns (see
+            RedcapConv stub_repeat)
+
+        Raises
+        ------
+        KeyError
+            If a key is neither a column nor a stub of numbered columns
+        ValueError
+            If some keys are columns and others are stubs of numbered columns
+        """
+        stub_names = [
+            stub_name for stub_name in ravestub_redcap_dict
+            if stub_name != 'Subject'
+        ]
+        instances = [self.instances(stub_name) for stub_name in stub_names]
+        is_col = [stub_name in self.cols.index for stub_name in stub_names]
+        missing = [
+            stub_name for stub_name, num, col in zip(
+                stub_names, instances, is_col
+            )
+            if num == 0 and not col
+        ]
+        if missing:
+            raise KeyError(f'{missing} not in the Rave columns')
+        if any(instances) and not all(instances):
+            raise ValueError(
+                'ravestub_redcap_dict mixes columns and stubs of numbered '
+                f'columns: {stub_names}'
+            )
+
+        return max(instances, default=0)
+
+    def positions(self, col_names):
+        """Return the positions of columns in the flat export
+
+        Parameters
+        ----------
+        col_names : list
+            Column names
+
+        Returns
+        -------
+        numpy.ndarray
+
+        Raises
+        ------
+        KeyError
+            If a column is not in the header
+        """
+        missing = [
+            col_name for col_name in col_names
+            if col_name not in self.cols.index
+        ]
+        if missing:
+            raise KeyError(f'{missing} not in the Rave columns')
+
+        return self.cols.loc[list(col_names), 'position'].to_numpy()
+
+    def read_columns(self, col_names):
+        """Read only some columns of the flat export
+
+        Parameters
+        ----------
+        col_names : list
+            Column names
+
+        Returns
+        -------
+        pandas.dataframe
+            Columns in the order of col_names, read as strings with missing
+            values as np.NaN
+
+        Raises
+        ------
+        ValueError
+            If the index was not created from a file (see from_csv)
+        KeyError
+            If a column is not in the header
+        """
+        if self.csv_path is None:
+            raise ValueError('The index was not created from a flat export')
+        positions = self.positions(col_names)
+        data_set = pd.read_csv(
+            self.csv_path,
+            encoding=self.encoding,
+            usecols=positions,
+            low_memory=False,
+            dtype=str
+        )
+        # usecols returns the columns in the order of the file
+        data_set.columns = self.cols.index[np.unique(positions)]
+
+        return data_set[list(col_names)]
+
+    def read_form(self, ravestub_redcap_dict, stub_repeat=None):
+        """Read the columns required to convert a form
+
+        Parameters
+        ----------
+        ravestub_redcap_dict : dict
+            Dictionary which maps the Rave stub columns (keys) to the REDCap
+            columns (values)
+        stub_repeat : int, optional
+            Maximum number of repeats expected (see RedcapConv), by default
+            None (detected with stub_repeat)
+
+        Returns
+        -------
+        pandas.dataframe
+            Rave data in the wide format with only the form's columns (see
+            form_columns), to pass to RedcapConv as main_df
+        """
+        if stub_repeat is None:
+            stub_repeat = self.stub_repeat(ravestub_redcap_dict)
+
+        return self.read_columns(
+            form_columns(ravestub_redcap_dict, stub_repeat)
+        )
+
+
+def form_columns(ravestub_redcap_dict, stub_repeat):
+    """List the Rave columns needed to convert a form
+
+    Parameters
+    ----------
+    ravestub_redcap_dict : dict
+        Dictionary which maps the Rave stub columns (keys) to the REDCap
+        columns (values)
+    stub_repeat : int
+        Maximum number of repeats expected For example, if stub_repeat = 2,
+        expecting column_x_1 and column_x_2 in Rave dataframe.
+
+    Returns
+    -------
+    list
+        'Subject' followed by the Rave columns including iterations of each
+        stub (e.g. COL_1, COL_2) if stub_repeat > 0
+    """
+    if stub_repeat == 0:
+        return ['Subject'] + [
+            stub_name for stub_name in ravestub_redcap_dict.keys()
+            if stub_name != 'Subject'
+        ]
+
+    df_cols = ['Subject']
+    for i in range(1, (stub_repeat + 1)):
+        for stub_name in ravestub_redcap_dict.keys():
+            df_cols.append(stub_name + str(i))
+
+    return df_cols
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_columns(columns):
+    """Parse column names
+
+    Returns RaveHeaderIndex.cols and the highest instance number of each stub
+    """
+    stubs, instances, date_stubs, date_suffixes = [], [], [], []
+    for col_name in columns:
+        match = _INSTANCE_PATTERN.match(str(col_name))
+        stub, instance = (
+            (match['stub'], int(match['instance'])) if match
+            else (col_name, 0)
+        )
+        date_stub, date_suffix = None, None
+        for suffix in DATE_SUFFIXES:
+            if match and stub.endswith('_' + suffix):
+                date_stub, date_suffix = stub[:-len(suffix)], suffix
+        stubs.append(stub)
+        instances.append(instance)
+        date_stubs.append(date_stub)
+        date_suffixes.append(date_suffix)
+
+    cols = pd.DataFrame(
+        {
+            'position': np.arange(len(columns)),
+            'stub': stubs,
+            'instance': instances,
+            'date_stub': date_stubs,
+            'date_suffix': date_suffixes
+        },
+        index=pd.Index(columns, dtype=object)
+    )
+    max_instances = (
+        cols.loc[cols['instance'] > 0].groupby('stub')['instance'].max()
+        .to_dict()
+    )
+
+    return cols, max_instances
@@ -0,0 +1,395 @@
+"""Import prepared data into REDCap through the REDCap API
+
+RedcapImportClient sends prepared data (RedcapConv.data after
+RedcapConv.prep_imp) to the REDCap API in batches of records, using several
+threads that each keep a persistent HTTP connection, and retries batches that
+fail because of connection errors or server errors.
+
+StandInRedcapServer is a local, in-process stand-in for the REDCap API record
+import used to test imports without a REDCap instance.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+import pandas as pd
+import redcap_import_writer
+
+# columns of the report returned by RedcapImportClient.import_records
+REPORT_COLS = [
+    'batch', 'num_records', 'num_rows', 'count', 'attempts', 'error'
+]
+# HTTP status codes that are retried (server busy or temporarily failing)
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+class RedcapApiError(Exception):
+    """Raised when batches could not be imported through the REDCap API
+
+    Attributes
+    ----------
+    report : pandas.dataframe
+        Report of every batch (see RedcapImportClient.import_records)
+    """
+    def __init__(self, message, report=None):
+        super().__init__(message)
+        self.report = report
+
+
+class RedcapImportClient:
+    """Batched, concurrent REDCap API record import
+
+    Attributes
+    ----------
+    api_url : str
+        URL of the REDCap API (e.g. 'https://redcap.example.org/api/')
+    token : str
+        REDCap API token of the project
+    """
+    def __init__(
+        self, api_url, token, max_records=500, max_bytes=None, max_workers=4,
+        max_retries=3, backoff=1.0, timeout=300, overwrite_behavior='normal'
+    ):
+        """Create a REDCap import client
+
+        Parameters
+        ----------
+        api_url : str
+            URL of the REDCap API (e.g. 'https://redcap.example.org/api/')
+        token : str
+            REDCap API token of the project
+        max_records : int, optional
+            Maximum number of records (obs_id) per request, by default 500
+        max_bytes : int, optional
+            Maximum size of the CSV data of each request in bytes, by default
+            None (no limit)
+        max_workers : int, optional
+            Number of requests sent concurrently, by default 4
+        max_retries : int, optional
+            Number of times a failed request is retried, by default 3
+        backoff : float, optional
+            Seconds to wait before the first retry; doubled for each
+            following retry, by default 1.0
+        timeout : float, optional
+            Seconds to wait for a response, by default 300
+        overwrite_behavior : str, optional
+            'normal' (missing values don't overwrite existing values) or
+            'overwrite', by default 'normal'
+        """
+        self.api_url = api_url
+        self.token = token
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.overwrite_behavior = overwrite_behavior
+        self._url_parts = urlsplit(api_url)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def import_records(self, import_df, raise_on_error=True):
+        """Import prepared data through the REDCap API
+
+        Parameters
+        ----------
+        import_df : pandas.dataframe
+            Data prepared for import (see RedcapConv.prep_imp); a record's
+            rows (e.g. its repeat instances) are always sent in the same
+            request
+        raise_on_error : bool, optional
+            Raise RedcapApiError if any batch failed after retrying, by
+            default True
+
+        Returns
+        -------
+        pandas.dataframe
+            One row per batch with the columns in REPORT_COLS; 'count' is the
+            number of records REDCap reports as imported and 'error' the last
+            error of a failed batch, including a response without a valid
+            count (otherwise None)
+
+        Raises
+        ------
+        RedcapApiError
+            If raise_on_error and any batch failed; every batch is attempted
+            before raising
+        """
+        batch_rows = redcap_import_writer.split_records(
+            import_df, self.max_records, self.max_bytes
+        )
+
+        def import_batch(batch_num, rows):
+            batch_df = import_df.iloc[rows]
+            result = self._post_records(batch_df.to_csv(index=False))
+            return {
+                'batch': batch_num,
+                'num_records': batch_df['obs_id'].nunique(),
+                'num_rows': len(batch_df),
+                **result
+            }
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(
+                    import_batch, range(1, len(batch_rows) + 1), batch_rows
+                ))
+        finally:
+            self._close_all_connections()
+        report = pd.DataFrame(results, columns=REPORT_COLS)
+
+        failed = report.loc[report['error'].notna()]
+        if raise_on_error and not failed.empty:
+            raise RedcapApiError(
+                f"{len(failed)} of {len(report)} batches failed; first error: "
+                f"{failed['error'].iloc[0]}",
+                report
+            )
+
+        return report
+
+    def _post_records(self, csv_data):
+        """Send one record import request, retrying if it fails
+
+        Returns
+        -------
+        dict
+            'count': number of records imported (None if failed), 'attempts':
+            number of requests sent, 'error': last error (None if imported)
+        """
+        body = urlencode({
+            'token': self.token,
+            'content': 'record',
+            'format': 'csv',
+            'type': 'flat',
+            'overwriteBehavior': self.overwrite_behavior,
+            'data': csv_data,
+            'returnContent': 'count',
+            'returnFormat': 'json'
+        })
+        error = None
+        for attempt in range(1, self.max_retries + 2):
+            if attempt > 1:
+                time.sleep(self.backoff * 2 ** (attempt - 2))
+            try:
+                status, response = self._post(body)
+            except (OSError, http.client.HTTPException) as ex:
+                # connection failed or was closed by the server
+                self._close_connection()
+                error = f'{type(ex).__name__}: {ex}'
+                continue
+            if status == 200:
+                try:
+                    count = int(json.loads(response)['count'])
+                except (ValueError, KeyError, TypeError) as ex:
+                    # not retried: the records may have been imported
+                    error = (
+                        f'Invalid response ({type(ex).__name__}: {ex}): '
+                        f'{response}'
+                    )
+                    break
+                return {'count': count, 'attempts': attempt, 'error': None}
+            error = f'HTTP {status}: {response}'
+            if status not in RETRY_STATUSES:
+                # data or permission errors won't be fixed by retrying
+                break
+
+        return {'count': None, 'attempts': attempt, 'error': error}
+
+    def _post(self, body):
+        """POST body over this thread's persistent connection"""
+        connection = self._connection()
+        connection.request(
+            'POST',
+            self._url_parts.path or '/',
+            body=body.encode('utf-8'),
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Accept': 'application/json'
+            }
+        )
+        response = connection.getresponse()
+        return response.status, response.read().decode('utf-8')
+
+    def _connection(self):
+        """Return this thread's connection, creating it if needed"""
+        if getattr(self._local, 'connection', None) is None:
+            connection_class = (
+                http.client.HTTPSConnection
+                if self._url_parts.scheme == 'https'
+                else http.client.HTTPConnection
+            )
+            self._local.connection = connection_class(
+                self._url_parts.netloc, timeout=self.timeout
+            )
+            with self._connections_lock:
+                self._connections.append(self._local.connection)
+        return self._local.connection
+
+    def _close_connection(self):
+        """Close this thread's connection"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def _close_all_connections(self):
+        """Close the connections of every thread"""
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class StandInRedcapServer:
+    """Local stand-in for the REDCap API record import
+
+    Runs an HTTP server in a background thread that accepts record imports
+    like the REDCap API. Use as a context manager:
+
+    >>> with StandInRedcapServer(token='test') as server:
+    ...     client = RedcapImportClient(server.url, 'test')
+    ...     client.import_records(import_df)
+    ...     server.records()
+
+    Attributes
+    ----------
+    token : str
+        Accepted API token; other tokens receive HTTP 403
+    fail_requests : int
+        Number of upcoming requests answered with HTTP 503 (to test
+        retrying); decremented for each failed request
+    num_requests : int
+        Number of requests received
+    max_concurrent : int
+        Maximum number of requests handled at the same time
+    """
+    def __init__(self, token='stand-in-token', fail_requests=0):
+        """Create the server (started by start or the with statement)
+
+        Parameters
+        ----------
+        token : str, optional
+            Accepted API token, by default 'stand-in-token'
+        fail_requests : int, optional
+            Number of first requests answered with HTTP 503, by default 0
+        """
+        self.token = token
+        self.fail_requests = fail_requests
+        self.num_requests = 0
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._imports = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL of the stand-in REDCap API"""
+        host, port = self._server.server_address[0:2]
+        return f'http://{host}:{port}/api/'
+
+    def start(self):
+        """Start the server on a free local port"""
+        stand_in = self
+
+        class Handler(_StandInHandler):
+            server_state = stand_in
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def records(self):
+        """Return the imported rows in the order they were received
+
+        Returns
+        -------
+        pandas.dataframe
+            Every imported row; values are strings and missing values are
+            np.NaN
+        """
+        with self._lock:
+            imports = list(self._imports)
+        if not imports:
+            return pd.DataFrame()
+
+        return pd.concat(imports, ignore_index=True)
+
+    def _import(self, params):
+        """Handle an import request; returns the HTTP status and body"""
+        with self._lock:
+            self.num_requests += 1
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                return 503, {'error': 'Service temporarily unavailable'}
+        if params.get('token') != self.token:
+            return 403, {'error': 'You do not have permissions to use the API'}
+        if params.get('content') != 'record' or params.get('format') != 'csv':
+            return 400, {'error': 'Only CSV record imports are supported'}
+
+        import_df = pd.read_csv(io.StringIO(params['data']), dtype=str)
+        with self._lock:
+            self._imports.append(import_df)
+
+        return 200, {'count': int(import_df['obs_id'].nunique())}
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Request handler of StandInRedcapServer"""
+    # keep connections open between requests like a REDCap server
+    protocol_version = 'HTTP/1.1'
+    server_state = None
+
+    def do_POST(self):
+        state = self.server_state
+        with state._lock:
+            state._concurrent += 1
+            state.max_concurrent = max(state.max_concurrent, state._concurrent)
+        try:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            params = {
+                key: values[0]
+                for key, values in parse_qs(body.decode('utf-8')).items()
+            }
+            status, response = state._import(params)
+        finally:
+            with state._lock:
+                state._concurrent -= 1
+
+        response = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        """Don't log requests to stderr"""
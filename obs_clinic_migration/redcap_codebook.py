@@ -0,0 +1,258 @@
+"""Index the REDCap data dictionary for fast variable coding lookups"""
+
+import weakref
+import pandas as pd
+
+FIELD_NAME_COL = 'Variable / Field Name'
+FIELD_TYPE_COL = 'Field Type'
+CHOICES_COL = 'Choices, Calculations, OR Slider Labels'
+VALIDATION_COL = 'Text Validation Type OR Show Slider Number'
+
+# field types where the choices column does not contain 'code, label' pairs
+NON_CHOICE_FIELD_TYPES = ['calc', 'slider']
+# field types whose values must be one of the allowed codes (see
+# Codebook.allowed_codes)
+CHOICE_FIELD_TYPES = ['radio', 'dropdown', 'yesno', 'truefalse', 'checkbox']
+# separator of a checkbox field name and a choice code in the name of an
+# import column (e.g. 'med_type___1')
+CHECKBOX_SEP = '___'
+# columns of Codebook.choice_violations
+VIOLATION_COLS = ['field', 'value', 'count', 'rows']
+
+# codebooks built by Codebook.from_data_dict keyed by id(data_dict_df)
+_CODEBOOKS = {}
+
+
+class Codebook:
+    """Parsed REDCap data dictionary
+
+    Attributes
+    ----------
+    field_types : dict
+        Maps each REDCap field name to its field type (e.g. 'radio')
+    validations : dict
+        Maps each REDCap field name to its text validation type (e.g.
+        'date_ymd'); fields without validation are not included
+    label_code : dict of dictionaries
+        Maps each REDCap field name with choices to a dictionary where the key
+        is the answer label and the value is the associated code
+    code_label : dict of dictionaries
+        Maps each REDCap field name with choices to a dictionary where the key
+        is the code and the value is the associated answer label
+    """
+    def __init__(self, data_dict_df):
+        """Parse every field in the REDCap data dictionary
+
+        Parameters
+        ----------
+        data_dict_df : pandas.dataframe
+            Data dictionary export from REDCap containing variable coding
+        """
+        self.field_types = {}
+        self.validations = {}
+        self.label_code = {}
+        self.code_label = {}
+        self._allowed_codes = {}
+
+        columns = [
+            data_dict_df[col] if col in data_dict_df
+            else pd.Series(index=data_dict_df.index, dtype=object)
+            for col in [
+                FIELD_NAME_COL, FIELD_TYPE_COL, CHOICES_COL, VALIDATION_COL
+            ]
+        ]
+        for field_name, field_type, choices, validation in zip(*columns):
+            # keep the first entry if a field is listed more than once
+            if field_name in self.field_types:
+                continue
+            self.field_types[field_name] = field_type
+            if pd.notna(validation):
+                self.validations[field_name] = validation
+            if pd.notna(choices) and field_type not in NON_CHOICE_FIELD_TYPES:
+                self.label_code[field_name] = redcap_str_dict(choices)
+                self.code_label[field_name] = {
+                    code: label
+                    for label, code in self.label_code[field_name].items()
+                }
+
+    @classmethod
+    def from_data_dict(cls, data_dict_df):
+        """Return the codebook for a data dictionary, building it only once
+
+        Parameters
+        ----------
+        data_dict_df : pandas.dataframe
+            Data dictionary export from REDCap containing variable coding
+
+        Returns
+        -------
+        Codebook
+            Codebook shared by every caller using the same data_dict_df object
+
+        Notes
+        -----
+        The codebook is discarded when data_dict_df is garbage collected. If
+        data_dict_df is modified in place, construct a new Codebook directly.
+        """
+        key = id(data_dict_df)
+        cached = _CODEBOOKS.get(key)
+        if cached is not None and cached[0]() is data_dict_df:
+            return cached[1]
+
+        codebook = cls(data_dict_df)
+        _CODEBOOKS[key] = (weakref.ref(data_dict_df), codebook)
+        weakref.finalize(data_dict_df, _CODEBOOKS.pop, key, None)
+
+        return codebook
+
+    def choices(self, field_name):
+        """Return the answer label to code mapping for a field
+
+        Parameters
+        ----------
+        field_name : str
+            REDCap field name
+
+        Returns
+        -------
+        dict or None
+            A dict where the key is the answer label and the value is the
+            associated code; None if the field has no coding information
+        """
+        return self.label_code.get(field_name)
+
+    def allowed_codes(self, col_name):
+        """Return the values allowed in an import column
+
+        Parameters
+        ----------
+        col_name : str
+            REDCap field name, or checkbox field name + CHECKBOX_SEP + code
+            for the import column of a checkbox choice
+
+        Returns
+        -------
+        list or None
+            Codes of the field's choices; '0' and '1' for yesno and truefalse
+            fields without choices and for checkbox choice columns; None if
+            the column is not a choice field (e.g. text fields)
+        """
+        if col_name not in self._allowed_codes:
+            field_name, _, code = col_name.partition(CHECKBOX_SEP)
+            field_type = self.field_types.get(field_name)
+            field_codes = self.code_label.get(field_name, {})
+            allowed_codes = None
+            if code:
+                # checkbox choices are imported as checked (1) or not (0)
+                if field_type == 'checkbox' and code in field_codes:
+                    allowed_codes = ['0', '1']
+            elif field_type in CHOICE_FIELD_TYPES and field_codes:
+                allowed_codes = list(field_codes)
+            elif field_type in ['yesno', 'truefalse']:
+                allowed_codes = ['0', '1']
+            self._allowed_codes[col_name] = allowed_codes
+
+        return self._allowed_codes[col_name]
+
+    def choice_violations(self, data_df, col_names=None):
+        """Find values of choice fields that are not allowed codes
+
+        Each radio, dropdown, yesno, truefalse and checkbox column is checked
+        against its allowed codes (see allowed_codes) with a single isin;
+        only the rows of columns with violations are grouped.
+
+        Parameters
+        ----------
+        data_df : pandas.dataframe
+            Recoded data (e.g. RedcapConv.data)
+        col_names : list, optional
+            Columns to check, by default None (every column)
+
+        Returns
+        -------
+        pandas.dataframe
+            One row per column and value that is not allowed, with the
+            columns in VIOLATION_COLS; 'rows' is the list of index labels of
+            data_df with the value. Missing values are allowed.
+
+        Notes
+        -----
+        Values are compared as strings (e.g. the integer 1 matches '1').
+        """
+        if col_names is None:
+            col_names = data_df.columns
+        violations = []
+        for col_name in col_names:
+            allowed_codes = self.allowed_codes(col_name)
+            if allowed_codes is None:
+                continue
+            col = data_df[col_name]
+            if (
+                pd.api.types.is_numeric_dtype(col.dtype)
+                or pd.api.types.is_bool_dtype(col.dtype)
+            ):
+                col = col.astype(str).where(col.notna())
+            is_violation = (col.notna() & ~col.isin(allowed_codes)).to_numpy(
+                dtype=bool
+            )
+            if not is_violation.any():
+                continue
+            grouped = pd.Series(
+                data_df.index[is_violation], index=col[is_violation]
+            ).groupby(level=0, sort=True)
+            violations.append(pd.DataFrame(
+                {
+                    'field': col_name,
+                    'value': grouped.size().index.to_numpy(dtype=object),
+                    'count': grouped.size().to_numpy(),
+                    'rows': grouped.agg(list).to_numpy()
+                },
+                columns=VIOLATION_COLS
+            ))
+
+        if not violations:
+            return pd.DataFrame(columns=VIOLATION_COLS)
+
+        return pd.concat(violations, ignore_index=True)
+
+
+def redcap_str_dict(input_str):
+    """Create Python dictionary from REDCap data dictionary string
+
+    Coding for REDCap variables are stored in the 'Choices, Calculations,
+    OR Slider Labels' column of the data dictionary. This function converts
+    the string to a dictionary.
+
+    Parameters
+    ----------
+    input_str : string
+        A string derived from the REDCap data dictionary which
+        indicates the variable coding. It is expected that the coding
+        integer and the answer label are separated by a comma and
+        entries are separated by a bar (e.g. '1, No | 2, Yes').
+
+    Returns
+    -------
+    dictionary
+        A dict where the key is the answer label (from input_str) and the
+        value is the associated integer.
+
+    Notes
+    -----
+    Function will process commas in answer label correctly; however,
+    if the answer label contains a bar (|), this will be interpreted
+    as a new entry. Entries without a comma are ignored.
+    """
+    str_dict = {}
+    val_key_lst = input_str.split(' | ')
+
+    for val_key in val_key_lst:
+        val_key_split_lst = val_key.split(', ', 1)
+        if len(val_key_split_lst) < 2:
+            continue
+
+        str_dict[
+            str(val_key_split_lst[1])
+        ] = str(val_key_split_lst[0]).strip()
+
+    return str_dict
@@ -0,0 +1,197 @@
+"""Write REDCap import files split by number of records or size
+
+Large REDCap imports time out, so prepared data (RedcapConv.data after
+RedcapConv.prep_imp) is split into several import files. A record (all rows
+with the same 'obs_id', e.g. every repeat instance) is never split across
+files.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+def write_import_files(
+    import_df, output_dir, file_stem, max_records=None, max_bytes=None,
+    compress=False, max_workers=None, record_col='obs_id'
+):
+    """Split prepared data into REDCap import files and write them
+
+    Parameters
+    ----------
+    import_df : pandas.dataframe
+        Data prepared for import (see RedcapConv.prep_imp)
+    output_dir : str or pathlib.Path
+        Directory where the import files are written
+    file_stem : str
+        Import files are named file_stem + '_001.csv', file_stem + '_002.csv',
+        ...
+    max_records : int, optional
+        Maximum number of records per file, by default None (no limit)
+    max_bytes : int, optional
+        Maximum size of each (uncompressed) file in bytes, including the
+        header, by default None (no limit). A record larger than max_bytes is
+        written to a file on its own.
+    compress : bool, optional
+        Write gzip-compressed files ('.csv.gz') e.g. for archiving, by default
+        False
+    max_workers : int, optional
+        Number of threads writing files concurrently, by default None (see
+        concurrent.futures.ThreadPoolExecutor)
+    record_col : str, optional
+        Column identifying a record, by default 'obs_id'
+
+    Returns
+    -------
+    list of pathlib.Path
+        The import files in order
+
+    Notes
+    -----
+    Rows of a record are written together in the order they appear in
+    import_df, and records are written in the order of their first row.
+    """
+    file_rows = split_records(import_df, max_records, max_bytes, record_col)
+    suffix = '.csv.gz' if compress else '.csv'
+    num_digits = max(3, len(str(len(file_rows))))
+    output_paths = [
+        Path(output_dir)/f'{file_stem}_{file_num:0{num_digits}d}{suffix}'
+        for file_num in range(1, len(file_rows) + 1)
+    ]
+
+    def write_file(rows, output_path):
+        import_df.iloc[rows].to_csv(
+            output_path,
+            index=False,
+            compression='gzip' if compress else None
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() raises any exception from the threads
+        list(executor.map(write_file, file_rows, output_paths))
+
+    return output_paths
+
+
+def split_records(
+    import_df, max_records=None, max_bytes=None, record_col='obs_id'
+):
+    """Assign the rows of prepared data to import files
+
+    Parameters
+    ----------
+    import_df : pandas.dataframe
+        Data prepared for import (see RedcapConv.prep_imp)
+    max_records : int, optional
+        Maximum number of records per file, by default None (no limit)
+    max_bytes : int, optional
+        Maximum size of each file in bytes (see csv_row_bytes), including the
+        header, by default None (no limit)
+    record_col : str, optional
+        Column identifying a record, by default 'obs_id'
+
+    Returns
+    -------
+    list of numpy.ndarray
+        Row positions (for import_df.iloc) of each file; a record's rows are
+        all in the same file
+
+    Raises
+    ------
+    ValueError
+        If max_records or max_bytes is less than 1
+    """
+    for limit in [max_records, max_bytes]:
+        if limit is not None and limit < 1:
+            raise ValueError(
+                f'max_records and max_bytes must be at least 1, not {limit}'
+            )
+    if len(import_df) == 0:
+        return []
+
+    record_codes, _ = pd.factorize(import_df[record_col].fillna(''))
+    # rows grouped by record, keeping the order within each record
+    row_order = np.argsort(record_codes, kind='stable')
+    record_starts = np.searchsorted(
+        record_codes[row_order], np.arange(record_codes.max() + 2)
+    )
+    num_records = len(record_starts) - 1
+
+    # file number of each record
+    if max_bytes is None:
+        record_file = np.arange(num_records) // (max_records or num_records)
+    else:
+        header_bytes = _header_bytes(import_df)
+        record_bytes = np.bincount(
+            record_codes, weights=csv_row_bytes(import_df)
+        ).astype(np.int64)
+        record_file = np.empty(num_records, dtype=np.int64)
+        file_num, file_records, file_bytes = 0, 0, header_bytes
+        for record_num in range(num_records):
+            if file_records > 0 and (
+                file_bytes + record_bytes[record_num] > max_bytes
+                or (max_records is not None and file_records == max_records)
+            ):
+                file_num, file_records, file_bytes = (
+                    file_num + 1, 0, header_bytes
+                )
+            record_file[record_num] = file_num
+            file_records += 1
+            file_bytes += record_bytes[record_num]
+
+    file_starts = record_starts[
+        np.searchsorted(record_file, np.arange(record_file[-1] + 2))
+    ]
+    return [
+        row_order[file_starts[i]:file_starts[i + 1]]
+        for i in range(len(file_starts) - 1)
+    ]
+
+
+def csv_row_bytes(import_df, encoding='utf-8'):
+    """Size in bytes of each row when written with DataFrame.to_csv
+
+    Parameters
+    ----------
+    import_df : pandas.dataframe
+        Data prepared for import
+    encoding : str, optional
+        Encoding of the file, by default 'utf-8'
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of bytes of each row including separators and the line
+        terminator (os.linesep)
+
+    Notes
+    -----
+    Values are sized as strings with the default to_csv quoting (values
+    containing the separator, a quote or a new line are quoted and quotes are
+    doubled); missing values are empty.
+    """
+    row_bytes = np.full(
+        len(import_df),
+        max(len(import_df.columns) - 1, 0) + len(os.linesep),
+        dtype=np.int64
+    )
+    for _, col in import_df.items():
+        values = col.astype(object)
+        values = values.where(values.notna(), '').astype(str)
+        needs_quotes = values.str.contains('[,"\r\n]', regex=True)
+        row_bytes += (
+            values.str.encode(encoding).str.len().to_numpy()
+            + values.str.count('"').to_numpy()
+            + 2 * needs_quotes.to_numpy()
+        )
+
+    return row_bytes
+
+
+def _header_bytes(import_df, encoding='utf-8'):
+    """Size in bytes of the header written by DataFrame.to_csv"""
+    return int(csv_row_bytes(
+        pd.DataFrame([import_df.columns.astype(str)]), encoding
+    )[0])
@@ -0,0 +1,246 @@
+"""Share one loaded Rave export between many form conversions
+
+A SourceView hands out read-only column projections of the wide Rave
+dataframe without copying the data, so many RedcapConv instances (possibly in
+different threads) can be built from the same export. Projections are cached
+by their list of columns.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+
+
+class SourceView:
+    """Read-only, zero-copy column access to a wide Rave dataframe
+
+    Attributes
+    ----------
+    columns : pandas.Index
+        Columns of the Rave dataframe
+    index : pandas.Index
+        Index of the Rave dataframe
+    shape : tuple
+        Number of rows and columns of the Rave dataframe
+    """
+    ndim = 2
+
+    def __init__(self, main_df):
+        """Create a view of a wide Rave dataframe
+
+        Parameters
+        ----------
+        main_df : pandas.dataframe
+            Rave data in the wide format; it must not be modified while the
+            view is in use
+        """
+        self._main_df = main_df
+        self.columns = main_df.columns
+        self.index = main_df.index
+        self.shape = main_df.shape
+        self._arrays = {}
+        self._projections = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, main_df):
+        """Return main_df if it is a view, otherwise a new view of main_df
+
+        Parameters
+        ----------
+        main_df : pandas.dataframe or SourceView
+            Rave data in the wide format
+
+        Returns
+        -------
+        SourceView
+        """
+        if isinstance(main_df, cls):
+            return main_df
+
+        return cls(main_df)
+
+    def __len__(self):
+        return len(self.index)
+
+    def column(self, col_name):
+        """Return a read-only array of a column without copying it
+
+        Parameters
+        ----------
+        col_name : str
+            Column of the Rave dataframe
+
+        Returns
+        -------
+        numpy.ndarray or pandas extension array
+            The column's values; numpy arrays are read-only views and
+            extension arrays (e.g. categoricals) must not be modified
+
+        Raises
+        ------
+        KeyError
+            If col_name is not a column
+        """
+        with self._lock:
+            if col_name not in self._arrays:
+                col = self._main_df[col_name]
+                if pd.api.types.is_extension_array_dtype(col.dtype):
+                    values = col.array
+                else:
+                    values = col.to_numpy().view()
+                    values.flags.writeable = False
+                self._arrays[col_name] = values
+            return self._arrays[col_name]
+
+    def project(self, col_names):
+        """Return a read-only projection of columns
+
+        Parameters
+        ----------
+        col_names : list
+            Columns of the Rave dataframe (e.g. RedcapConv.required_cols)
+
+        Returns
+        -------
+        SourceProjection
+            Projection shared by every caller using the same columns
+
+        Raises
+        ------
+        KeyError
+            If a column is missing from the Rave dataframe
+        """
+        key = tuple(col_names)
+        with self._lock:
+            projection = self._projections.get(key)
+        if projection is None:
+            missing_cols = [
+                col_name for col_name in key if col_name not in self.columns
+            ]
+            if missing_cols:
+                raise KeyError(f'{missing_cols} not in the Rave dataframe')
+            projection = SourceProjection(self, key)
+            with self._lock:
+                projection = self._projections.setdefault(key, projection)
+
+        return projection
+
+
+def project(main_df, col_names):
+    """Return a read-only projection of columns of Rave data
+
+    Parameters
+    ----------
+    main_df : pandas.dataframe, SourceView or SourceProjection
+        Rave data in the wide format; a projection is returned as is if it
+        has the same columns
+    col_names : list
+        Columns to project
+
+    Returns
+    -------
+    SourceProjection
+    """
+    if (
+        isinstance(main_df, SourceProjection)
+        and main_df.columns == list(col_names)
+    ):
+        return main_df
+    if isinstance(main_df, SourceProjection):
+        main_df = main_df._source_view
+
+    return SourceView.of(main_df).project(col_names)
+
+
+class SourceProjection:
+    """Read-only projection of some columns of a SourceView
+
+    Attributes
+    ----------
+    columns : list
+        Projected columns
+    index : pandas.Index
+        Index of the Rave dataframe
+    shape : tuple
+        Number of rows and projected columns
+    """
+    ndim = 2
+
+    def __init__(self, source_view, col_names):
+        """Create a projection (see SourceView.project)"""
+        self._source_view = source_view
+        self.columns = list(col_names)
+        self.index = source_view.index
+        self.shape = (len(source_view), len(self.columns))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, col_name):
+        """Return the read-only values of a projected column"""
+        if col_name not in self.columns:
+            raise KeyError(col_name)
+
+        return self._source_view.column(col_name)
+
+    def object_values(self, col_name):
+        """Return the values of a column as an object array
+
+        Object columns are returned without copying (read-only); other
+        columns are converted (e.g. categoricals).
+        """
+        values = self[col_name]
+        if isinstance(values, np.ndarray):
+            return values if values.dtype == object else values.astype(object)
+
+        return np.asarray(values.to_numpy(dtype=object))
+
+    def notna(self, col_names=None):
+        """Return a boolean array, rows x columns, of non-missing values
+
+        Parameters
+        ----------
+        col_names : list, optional
+            Projected columns, by default None (every column)
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        if col_names is None:
+            col_names = self.columns
+        not_missing = np.empty((self.shape[0], len(col_names)), dtype=bool)
+        for col_num, col_name in enumerate(col_names):
+            not_missing[:, col_num] = pd.notna(self[col_name])
+
+        return not_missing
+
+    def to_frame(self, columns=None):
+        """Copy the projection into a new dataframe
+
+        Parameters
+        ----------
+        columns : dict, optional
+            Maps projected columns to the column names of the new dataframe,
+            by default None (every projected column, not renamed)
+
+        Returns
+        -------
+        pandas.dataframe
+            New dataframe that does not share data with the Rave dataframe
+        """
+        if columns is None:
+            columns = {col_name: col_name for col_name in self.columns}
+
+        return pd.DataFrame(
+            {
+                new_name: (
+                    self[col_name] if isinstance(self[col_name], np.ndarray)
+                    else self[col_name].copy()
+                )
+                for col_name, new_name in columns.items()
+            },
+            index=self.index,
+            copy=True
+        )
@@ -0,0 +1,177 @@
+"""Record the wall time and memory of the stages of a conversion"""
+
+from contextlib import contextmanager
+import functools
+import time
+import tracemalloc
+import pandas as pd
+
+REPORT_COLS = [
+    'stage', 'time_s', 'rows_in', 'cols_in', 'rows_out', 'cols_out', 'peak_mb'
+]
+
+
+class StageProfiler:
+    """Opt-in profiler for the stages of a RedcapConv conversion
+
+    Attributes
+    ----------
+    enabled : bool
+        When False, stages are run without being measured
+    records : list of dictionaries
+        One record per measured stage with the keys in REPORT_COLS
+    callback : callable
+        Called with each record when a stage finishes, or None
+    """
+    def __init__(self, enabled=False, callback=None):
+        """Create a profiler
+
+        Parameters
+        ----------
+        enabled : bool, optional
+            Measure stages, by default False
+        callback : callable, optional
+            Called with each record (a dictionary with the keys in
+            REPORT_COLS) when a stage finishes, by default None. Providing a
+            callback enables the profiler.
+        """
+        self.enabled = enabled or callback is not None
+        self.callback = callback
+        self.records = []
+
+    @classmethod
+    def from_option(cls, profile):
+        """Create a profiler from a RedcapConv profile argument
+
+        Parameters
+        ----------
+        profile : bool, callable or StageProfiler
+            False (disabled), True (enabled), a callback (enabled; see
+            __init__) or an existing profiler which is returned as is
+
+        Returns
+        -------
+        StageProfiler
+        """
+        if isinstance(profile, cls):
+            return profile
+        if callable(profile):
+            return cls(callback=profile)
+
+        return cls(enabled=bool(profile))
+
+    @contextmanager
+    def stage(self, name, data_in=None):
+        """Measure the code run in a with block
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage (e.g. 'recode')
+        data_in : pandas.dataframe, optional
+            Data at the start of the stage, by default None
+
+        Yields
+        ------
+        _StageOutput
+            Call its set method with the data at the end of the stage
+
+        Notes
+        -----
+        Peak memory is the peak memory allocated by Python (tracemalloc)
+        during the stage above the memory allocated at the start. Tracing
+        memory slows down allocation so the wall time is higher when the
+        profiler is enabled.
+        """
+        stage_output = _StageOutput()
+        if not self.enabled:
+            yield stage_output
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start_time = time.perf_counter()
+        try:
+            yield stage_output
+        finally:
+            elapsed = time.perf_counter() - start_time
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+
+        rows_in, cols_in = _shape(data_in)
+        rows_out, cols_out = _shape(stage_output.data_out)
+        record = {
+            'stage': name,
+            'time_s': elapsed,
+            'rows_in': rows_in,
+            'cols_in': cols_in,
+            'rows_out': rows_out,
+            'cols_out': cols_out,
+            'peak_mb': max(peak_memory - start_memory, 0) / 2**20
+        }
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def report(self):
+        """Return the measured stages as a dataframe
+
+        Returns
+        -------
+        pandas.dataframe
+            One row per measured stage in the order they were run; columns
+            are REPORT_COLS
+        """
+        return pd.DataFrame(self.records, columns=REPORT_COLS)
+
+
+def profiled_method(stage_name):
+    """Decorator measuring a method as a stage of self.profiler
+
+    The data at the start of the stage is self.data; the data at the end is
+    the return value, or self.data if the method returns None.
+
+    Parameters
+    ----------
+    stage_name : str
+        Name of the stage
+
+    Returns
+    -------
+    callable
+        Decorator
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.stage(stage_name, self.data) as stage:
+                result = method(self, *args, **kwargs)
+                stage.set(self.data if result is None else result)
+            return result
+        return wrapper
+    return decorator
+
+
+class _StageOutput:
+    """Holds the data at the end of a stage"""
+    def __init__(self):
+        self.data_out = None
+
+    def set(self, data_out):
+        """Set the data at the end of the stage"""
+        self.data_out = data_out
+
+
+def _shape(data):
+    """Return the number of rows and columns of data, or None"""
+    if data is None:
+        return None, None
+    if data.ndim == 1:
+        return data.shape[0], 1
+
+    return data.shape
@@ -0,0 +1,116 @@
+"""Tests for dde_snapshot"""
+
+import gc
+import pandas as pd
+import pytest
+import numpy as np
+import dde_snapshot
+
+test_redcap_dde = pd.DataFrame(
+    {
+        'obs_id': [10100001, 10100001, 10100002, 10100003, 10100002],
+        'redcap_event_name': ['baseline_arm_1'] * 5,
+        'redcap_repeat_instrument': [
+            np.NaN, 'visit', np.NaN, np.NaN, 'visit'
+        ],
+        'redcap_repeat_instance': [np.NaN, 1, np.NaN, np.NaN, 1],
+        'incl_main_ga': ['2', np.NaN, '1', np.NaN, np.NaN],
+        'inclusion_complete': ['2', np.NaN, '2', np.NaN, np.NaN],
+        'visit_dt': [np.NaN, '2019-09-09', np.NaN, np.NaN, '2019-10-01'],
+        'visit_complete': [np.NaN, '2', np.NaN, np.NaN, '0'],
+    },
+    index = [10, 11, 12, 13, 14]
+)
+
+test_data_dict = pd.DataFrame(
+    {
+        'Variable / Field Name': ['obs_id', 'incl_main_ga', 'visit_dt'],
+        'Form Name': ['inclusion', 'inclusion', 'visit'],
+        'Field Type': ['text', 'radio', 'text']
+    }
+)
+
+def test_snapshot():
+    snapshot = dde_snapshot.DdeSnapshot(test_redcap_dde)
+
+    assert snapshot.record_cols == dde_snapshot.RECORD_COLS
+    assert snapshot.record_index[1] == (
+        '10100001', 'baseline_arm_1', 'visit', '1.0'
+    )
+    assert snapshot.obs_ids.tolist() == ['10100001', '10100002', '10100003']
+    # obs_id are compared as strings
+    assert snapshot.rows(['10100002', 10100001, 'not_a_subject']).tolist() == [
+        0, 1, 2, 4
+    ]
+    assert snapshot.rows(repeat_instrument = 'visit').tolist() == [1, 4]
+    actual_df = snapshot.slice(
+        ['obs_id', 'visit_dt'], snapshot.rows([10100002])
+    )
+    expected_df = pd.DataFrame(
+        {
+            'obs_id': ['10100002', '10100002'],
+            'visit_dt': [np.NaN, '2019-10-01']
+        },
+        index = [12, 14]
+    )
+    assert actual_df.equals(expected_df)
+    # columns are converted once and are read only
+    assert snapshot.str_column('visit_dt') is snapshot.str_column('visit_dt')
+    with pytest.raises(ValueError):
+        snapshot.str_column('visit_dt')[0] = 'changed'
+
+@pytest.mark.parametrize('redcap_data_dict', [None, test_data_dict])
+
+def test_instrument(redcap_data_dict):
+    snapshot = dde_snapshot.DdeSnapshot(test_redcap_dde, redcap_data_dict)
+
+    assert snapshot.instrument_cols('inclusion') == [
+        'incl_main_ga', 'inclusion_complete'
+    ]
+    assert snapshot.instrument_cols('visit') == ['visit_dt', 'visit_complete']
+    assert snapshot.instrument_cols('not_an_instrument') == []
+    actual_df = snapshot.instrument('visit', repeating = True)
+    assert actual_df.index.tolist() == [11, 14]
+    assert actual_df.columns.tolist() == (
+        dde_snapshot.RECORD_COLS + ['visit_dt', 'visit_complete']
+    )
+    # only rows with data in the instrument
+    actual_df = snapshot.instrument('inclusion', obs_ids = ['10100003'])
+    assert actual_df.empty
+
+def test_shared_cols():
+    redcap_dde = test_redcap_dde.assign(other_field = '1')
+    snapshot = dde_snapshot.DdeSnapshot(redcap_dde)
+
+    # columns in the order of the export, including columns outside any
+    # instrument
+    assert snapshot.shared_cols(
+        ['visit_dt', 'not_a_column', 'other_field', 'obs_id', 'incl_main_ga']
+    ) == ['obs_id', 'incl_main_ga', 'visit_dt', 'other_field']
+    assert snapshot.shared_cols(['not_a_column']) == []
+    assert snapshot.rows(repeat_instrument = 'not_an_instrument').size == 0
+
+def test_snapshot_of():
+    redcap_dde = test_redcap_dde.copy()
+    snapshot = dde_snapshot.DdeSnapshot.of(redcap_dde)
+
+    # same export shares a snapshot; a different one does not
+    assert dde_snapshot.DdeSnapshot.of(redcap_dde) is snapshot
+    assert dde_snapshot.DdeSnapshot.of(snapshot) is snapshot
+    assert dde_snapshot.DdeSnapshot.of(test_redcap_dde) is not snapshot
+
+def test_snapshot_of_released():
+    redcap_dde = test_redcap_dde.copy()
+    key = id(redcap_dde)
+    snapshot = dde_snapshot.DdeSnapshot.of(redcap_dde)
+    assert snapshot.str_column('obs_id')[0] == '10100001'
+
+    # the cache does not keep the export alive
+    del redcap_dde
+    gc.collect()
+    assert key not in dde_snapshot._SNAPSHOTS
+    # a kept snapshot still converts columns after the export is released
+    assert snapshot.str_column('visit_dt')[1] == '2019-09-09'
+    assert snapshot.slice(['incl_main_ga']).index.tolist() == [
+        10, 11, 12, 13, 14
+    ]
@@ -0,0 +1,123 @@
+"""Tests for double_data_entry_subjects"""
+
+from itertools import compress
+import pandas as pd
+import pytest
+import numpy as np
+import double_data_entry_subjects
+
+test_rave_df = pd.DataFrame(
+    {
+        'Subject': ['10100001', '10100002', '10100003', '91300001'],
+        'col1': ['Yes', 'Yes', np.NaN, 'Yes'],
+        'col2': ['No', 'No', np.NaN, 'No'],
+        'col3': [np.NaN, 'No', 'Yes', 'Yes'],
+        'col4': [np.NaN, np.NaN, '1', '1'],
+        'col5': [np.NaN, np.NaN, np.NaN, np.NaN],
+    }
+)
+
+param_select_dde_subjects = [
+    (# greedy selection; ties resolved by order
+        test_rave_df,
+        3,
+        double_data_entry_subjects.MAX_SUBJECT_ID,
+        {
+            '10100002': ['col1', 'col2', 'col3'],
+            '10100003': ['col4'],
+            '10100001': []
+        }
+    ),
+    (# subject ID filter removed
+        test_rave_df,
+        2,
+        None,
+        {
+            '91300001': ['col1', 'col2', 'col3', 'col4'],
+            '10100001': []
+        }
+    ),
+    (# more subjects requested than available
+        test_rave_df.iloc[0:1],
+        5,
+        None,
+        {
+            '10100001': ['col1', 'col2']
+        }
+    ),
+]
+
+@pytest.mark.parametrize(
+    'rave_df, num_subjects, max_subject_id, expected',
+    param_select_dde_subjects
+)
+
+def test_select_dde_subjects(rave_df, num_subjects, max_subject_id, expected):
+    actual = double_data_entry_subjects.select_dde_subjects(
+        rave_df,
+        num_subjects = num_subjects,
+        max_subject_id = max_subject_id
+    )
+
+    assert actual == expected
+    assert list(actual) == list(expected)
+
+def _previous_loop(rave_df, num_subjects):
+    """The selection loop select_dde_subjects replaced (prints removed)"""
+    clinic_temp = rave_df.copy()
+    col_names = [
+        col_name for col_name in list(clinic_temp.columns.values)
+        if clinic_temp[col_name].notnull().astype(int).sum() > 0
+    ]
+    min_na_subjects = []
+    for _ in range(num_subjects):
+        clinic_temp['sum_na'] = 0
+        for col_name in col_names:
+            clinic_temp['sum_na'] = (
+                clinic_temp['sum_na']
+                + clinic_temp[col_name].isnull().astype(int)
+            )
+        min_na_subject = clinic_temp['Subject'].loc[
+            clinic_temp['sum_na'] == clinic_temp['sum_na'].min()
+        ].iloc[0]
+        col_names = list(compress(col_names, clinic_temp[
+            clinic_temp['Subject'] == min_na_subject
+        ].isnull().iloc[0].tolist()))
+        col_names.append('Subject')
+        clinic_temp = clinic_temp.loc[
+            clinic_temp['Subject'] != min_na_subject, col_names
+        ]
+        min_na_subjects.append(min_na_subject)
+
+    return min_na_subjects
+
+def test_select_dde_subjects_empty_column():
+    # an empty column before the columns with data
+    rave_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002', '10100003'],
+            'empty': [np.NaN, np.NaN, np.NaN],
+            'col1': ['Yes', np.NaN, 'Yes'],
+            'col2': [np.NaN, 'No', np.NaN],
+            'col3': ['1', np.NaN, np.NaN],
+        }
+    )
+    actual = double_data_entry_subjects.select_dde_subjects(
+        rave_df,
+        num_subjects = 2
+    )
+
+    # 10100002 is the only subject with data in col2, the column 10100001
+    # is missing
+    assert actual == {
+        '10100001': ['col1', 'col3'],
+        '10100002': ['col2']
+    }
+    # the previous loop paired the null mask of every column (including
+    # 'empty') with the columns with data, so after 10100001 it looked for
+    # data in col1 and col3 instead of col2 and selected 10100003
+    assert _previous_loop(rave_df, 2) == ['10100001', '10100003']
+    # without empty columns both select the same subjects
+    assert _previous_loop(rave_df.drop(columns = 'empty'), 2) == list(
+        actual
+    )
@@ -0,0 +1,242 @@
+"""Tests for migration_runner"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import migration_runner
+
+test_rave_df = pd.DataFrame(
+    {
+        'Subject': ['10100001', '10100002', '10100003'],
+        'col1': ['Yes', 'NO', np.NaN],
+        'col2_1': ['Yes', 'No', np.NaN],
+        'col2_2': ['No', np.NaN, np.NaN],
+        'code_col': ['1', '99', np.NaN],
+        'label_col': ['Moved', 'other reason', np.NaN],
+    }
+)
+
+test_data_dict = pd.DataFrame(
+    {
+        'Variable / Field Name': [
+            'incl_main_ga', 'incl_main_eng', 'excl_reason', 'excl_reason_sp'
+        ],
+        'Field Type': ['radio', 'radio', 'radio', 'text'],
+        'Choices, Calculations, OR Slider Labels': [
+            '1, No | 2, Yes', '1, No | 2, Yes', '1, Moved | 99, Other', np.NaN
+        ]
+    }
+)
+
+test_redcap_dde = pd.DataFrame(
+    {
+        'obs_id': ['10100001', '10100002'],
+        'redcap_repeat_instance': [np.NaN, np.NaN],
+        'incl_main_ga': ['2', '2'],
+        'excl_reason': ['1', '99'],
+        'excl_reason_sp': [np.NaN, 'other reason'],
+    }
+)
+
+test_form_specs = [
+    {
+        'name': 'inc_excl',
+        'ravestub_redcap_dict': {
+            'col1': 'incl_main_ga',
+            'label_col': 'excl_reason',
+            'specify_col': 'excl_reason_sp'
+        },
+        'stub_repeat': 0,
+        'event_name': 'baseline_arm_1',
+        'complete_col': 'inclusion_exclusion_criteria_complete',
+        'spelling_dict': {'incl_main_ga': {'NO': 'No'}},
+        'preprocessing': [
+            ('create_specify_col', {
+                'create_col': 'specify_col',
+                'coded_col': 'code_col',
+                'label_col': 'label_col',
+                'label_code': '99',
+                'label_ans': 'Other'
+            })
+        ],
+        'constant_cols': {'incl_excl_entry_type': 1}
+    },
+    {
+        'name': 'repeat_form',
+        'ravestub_redcap_dict': {'col2_': 'incl_main_eng'},
+        'stub_repeat': 2,
+        'event_name': 'baseline_arm_1',
+        'complete_col': 'repeat_form_complete',
+        'repeat_instrument': 'repeat_form',
+        'compare_dde': False
+    },
+]
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+
+def test_run_forms(tmp_path, max_workers):
+    results = migration_runner.run_forms(
+        test_form_specs,
+        output_dir = tmp_path,
+        max_workers = max_workers,
+        main_df = test_rave_df,
+        redcap_data_dict = test_data_dict,
+        redcap_dde = test_redcap_dde
+    )
+
+    inc_excl = pd.read_csv(tmp_path/'inc_excl.csv', dtype=str)
+    expected_inc_excl = pd.DataFrame(
+        {
+            'obs_id': ['10100001', '10100002'],
+            'incl_main_ga': ['2', '1'],
+            'excl_reason': ['1', '99'],
+            'excl_reason_sp': [np.NaN, 'other reason'],
+            'incl_excl_entry_type': ['1', '1'],
+            'redcap_event_name': ['baseline_arm_1'] * 2,
+            'inclusion_exclusion_criteria_complete': ['2', '2'],
+        }
+    )
+    assert inc_excl.equals(expected_inc_excl)
+    assert results['inc_excl']['num_rows'] == 2
+    # 'NO' is only corrected by the spelling_dict after recoding
+    assert results['inc_excl']['recode_issues']['raw_value'].tolist() == [
+        'NO'
+    ]
+    assert results['inc_excl']['choice_violations'].empty
+    assert results['inc_excl']['dde_discrepancies']['obs_id'].tolist() == [
+        '10100002', '10100002'
+    ]
+
+    repeat_form = pd.read_csv(tmp_path/'repeat_form.csv', dtype=str)
+    assert repeat_form.columns.tolist() == [
+        'obs_id', 'redcap_repeat_instance', 'incl_main_eng',
+        'redcap_event_name', 'repeat_form_complete',
+        'redcap_repeat_instrument'
+    ]
+    assert repeat_form['incl_main_eng'].tolist() == ['2', '1', '1']
+    assert results['repeat_form']['dde_discrepancies'] is None
+
+    # source data is not modified by preprocessing
+    assert 'specify_col' not in test_rave_df
+
+def test_validate_form_spec():
+    with pytest.raises(ValueError):
+        migration_runner.validate_form_spec({'name': 'missing_keys'})
+    with pytest.raises(ValueError):
+        migration_runner.validate_form_spec(
+            {**test_form_specs[1], 'unknown_key': None}
+        )
+
+def test_run_form_preprocessed_stub(tmp_path):
+    rave_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002'],
+            'MEDHX_NY_1': ['Yes', 'No'],
+            'ONSET_YR_YYYY_1': ['2019', np.NaN],
+            'ONSET_YR_MM_1': ['12', np.NaN],
+            'ONSET_YR_DD_1': [np.NaN, np.NaN],
+            'MEDHX_NY_2': ['Yes', np.NaN],
+            'ONSET_YR_YYYY_2': ['1900', np.NaN],
+            'ONSET_YR_MM_2': [np.NaN, np.NaN],
+            'ONSET_YR_DD_2': [np.NaN, np.NaN],
+        }
+    )
+    form_spec = {
+        'name': 'onset_form',
+        # 'ONSET_YR_yn_date_' is only created by the preprocessing
+        'ravestub_redcap_dict': {'ONSET_YR_yn_date_': 'onset_yn'},
+        'stub_repeat': None,
+        'event_name': 'baseline_arm_1',
+        'complete_col': 'onset_form_complete',
+        'repeat_instrument': 'onset_form',
+        'preprocessing': [
+            ('rave_date_unknown', {
+                'date_dependency': 'MEDHX_NY_',
+                'dependency_answer': 'Yes',
+                'rave_date_stub': 'ONSET_YR_',
+                'max_occur_num': 2
+            })
+        ],
+        'compare_dde': False,
+        'validate_choices': False
+    }
+
+    migration_runner.run_forms(
+        [form_spec],
+        output_dir = tmp_path,
+        max_workers = 1,
+        main_df = rave_df,
+        redcap_data_dict = test_data_dict
+    )
+
+    onset_form = pd.read_csv(tmp_path/'onset_form.csv', dtype=str)
+    assert onset_form['redcap_repeat_instance'].tolist() == ['1', '2']
+    assert onset_form['onset_yn'].tolist() == ['Yes', 'No']
+
+def test_run_forms_incremental(tmp_path):
+    fingerprint_dir = tmp_path/'fingerprints'
+    run_kwargs = {
+        'output_dir': tmp_path,
+        'max_workers': 1,
+        'redcap_data_dict': test_data_dict,
+        'redcap_dde': test_redcap_dde,
+        'fingerprint_dir': fingerprint_dir
+    }
+
+    # first run converts every subject
+    results = migration_runner.run_forms(
+        test_form_specs, main_df=test_rave_df, **run_kwargs
+    )
+    assert results['inc_excl']['num_subjects'] == 3
+    assert results['inc_excl']['output_path'] == tmp_path/'inc_excl.csv'
+    # fingerprints are only saved once the import succeeded
+    assert not (fingerprint_dir/'inc_excl.json').exists()
+
+    # import failed (not committed): every subject is converted again
+    results = migration_runner.run_forms(
+        test_form_specs, main_df=test_rave_df, **run_kwargs
+    )
+    assert results['inc_excl']['num_subjects'] == 3
+    for result in results.values():
+        migration_runner.commit_fingerprints(result)
+    assert (fingerprint_dir/'inc_excl.json').exists()
+
+    # unchanged export: nothing to convert
+    results = migration_runner.run_forms(
+        test_form_specs, main_df=test_rave_df, **run_kwargs
+    )
+    assert results['inc_excl']['num_subjects'] == 0
+    assert results['inc_excl']['output_path'] is None
+    for result in results.values():
+        migration_runner.commit_fingerprints(result)
+
+    # one subject changed, one removed and one added
+    new_rave_df = pd.concat(
+        [
+            test_rave_df.iloc[[0, 1]],
+            pd.DataFrame({'Subject': ['10100004'], 'col1': ['Yes']})
+        ],
+        ignore_index=True
+    )
+    new_rave_df.loc[1, 'col2_2'] = 'Yes'
+    results = migration_runner.run_forms(
+        test_form_specs, main_df=new_rave_df, **run_kwargs
+    )
+    assert results['inc_excl']['num_subjects'] == 1
+    assert results['inc_excl']['removed_subjects'] == ['10100003']
+    delta = pd.read_csv(tmp_path/'inc_excl_delta.csv', dtype=str)
+    assert delta['obs_id'].tolist() == ['10100004']
+    assert results['repeat_form']['num_subjects'] == 2
+    delta = pd.read_csv(tmp_path/'repeat_form_delta.csv', dtype=str)
+    assert delta['obs_id'].tolist() == ['10100002', '10100002']
+    for result in results.values():
+        migration_runner.commit_fingerprints(result)
+
+    # changing the form spec converts every subject again
+    changed_specs = [
+        {**test_form_specs[0], 'constant_cols': {'incl_excl_entry_type': 2}}
+    ]
+    results = migration_runner.run_forms(
+        changed_specs, main_df=new_rave_df, **run_kwargs
+    )
+    assert results['inc_excl']['num_subjects'] == 3
@@ -1,9 +1,13 @@
 """Tests for obs_clinic_migration"""
 
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import pytest
 import numpy as np
+import dde_snapshot
 import obs_clinic_migration
+import obs_data_sets
+import source_view
 
 param_RedcapCov_init = [
     (# stub_repeat = 0; recode_long = True
@@ -469,6 +473,36 @@ def test_compare_conv_dde(
     for col_name in actual_df.columns.values.tolist():
         assert all(actual_df[col_name] == expected_df_3[col_name])
 
+def test_compare_conv_dde_column_order():
+    initialized_class = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {
+            'col1': 'incl_main_ga',
+            'col2': 'incl_main_eng'
+        },
+        stub_repeat = 0,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002'],
+                'col1': ['Yes', 'No'],
+                'col2': ['No', 'No']
+            }
+        )
+    )
+    redcap_dde = pd.DataFrame(
+        {
+            'incl_main_eng': ['1', '2'],
+            'obs_id': ['10100001', '10100002'],
+            'incl_main_ga': ['2', '1'],
+        }
+    )
+
+    # columns are in the order of the double data entry export
+    actual_df = initialized_class.compare_conv_dde(redcap_dde = redcap_dde)
+    assert actual_df.columns.tolist() == [
+        'incl_main_eng', 'obs_id', 'incl_main_ga', 'Source'
+    ]
+    assert actual_df['obs_id'].tolist() == ['10100002', '10100002']
+
 param_prep_imp = [
     ( # stub_repeat = 0; recode_long = False
         {
@@ -557,3 +591,576 @@ def test_prep_imp(
     for col_name in expected_df_4.columns.values.tolist():
         assert all(actual_df[col_name] == expected_df_4[col_name])
     assert actual_df.columns.tolist() == expected_cols_4
+
+param_recode_col = [
+    (# labels, codes, unmapped labels and missing values
+        pd.Series(['Yes', 'No', np.NaN, '2', 'Maybe', 'Yes']),
+        [{'No': '1', 'Yes': '2'}],
+        pd.Series(['2', '1', np.NaN, '2', 'Maybe', '2']),
+        ['2', 'Maybe']
+    ),
+    (# spelling correction applied before coding
+        pd.Series(['YES', 'Noo', np.NaN, 'No']),
+        [{'YES': 'Yes', 'Noo': 'No'}, {'No': '1', 'Yes': '2'}],
+        pd.Series(['2', '1', np.NaN, '1']),
+        []
+    ),
+    (# non-string values are recoded as strings
+        pd.Series([1, 2, np.NaN], dtype=object),
+        [{'1': 'one'}],
+        pd.Series(['one', '2', np.NaN]),
+        ['2']
+    ),
+    (# only missing values
+        pd.Series([np.NaN, np.NaN], dtype=object),
+        [{'No': '1', 'Yes': '2'}],
+        pd.Series([np.NaN, np.NaN], dtype=object),
+        []
+    ),
+]
+
+@pytest.mark.parametrize(
+    'rave_col_5, label_maps_5, expected_col_5, expected_unmapped_5',
+    param_recode_col
+)
+
+def test_recode_col(
+    rave_col_5, label_maps_5, expected_col_5, expected_unmapped_5
+):
+    actual_col, actual_unmapped = obs_clinic_migration.RedcapConv._recode_col(
+        rave_col_5, *label_maps_5
+    )
+
+    assert actual_col.equals(expected_col_5)
+    assert sorted(actual_unmapped) == sorted(expected_unmapped_5)
+
+def test_RedcapConv_missing_values():
+    actual_df = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {
+            'col1': 'incl_main_ga',
+            'col2': 'uncoded_text_col'
+        },
+        stub_repeat = 0,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002', '10100003'],
+                'col1': ['Yes', np.NaN, 'No'],
+                'col2': ['Financial', 'nanny', np.NaN]
+            }
+        ),
+        recode_long = True
+    ).data
+
+    # missing values are np.NaN and text containing 'nan' is unchanged
+    assert actual_df['incl_main_ga'].tolist()[0::2] == ['2', '1']
+    assert actual_df['incl_main_ga'].isna().tolist() == [False, True, False]
+    assert actual_df['uncoded_text_col'].tolist()[0:2] == [
+        'Financial', 'nanny'
+    ]
+    assert actual_df['uncoded_text_col'].isna().tolist() == [
+        False, False, True
+    ]
+
+@pytest.mark.parametrize('chunksize_6', [1, 2, 10])
+
+def test_convert_in_chunks(tmp_path, chunksize_6):
+    csv_path = tmp_path/'rave.csv'
+    output_path = tmp_path/'redcap_import.csv'
+    pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002', '10100003'],
+            'col1_1': ['Yes', 'NO', np.NaN],
+            'col1_2': ['No', np.NaN, np.NaN],
+            'unused_col': ['a', 'b', 'c']
+        }
+    ).to_csv(csv_path, index=False)
+
+    num_rows = obs_clinic_migration.convert_in_chunks(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 2,
+        output_path = output_path,
+        event_name = 'test_event_name',
+        complete_col = 'test_complete_col',
+        repeat_instrument = 'test_repeat_instrument',
+        spelling_dict = {'incl_main_ga': {'NO': 'No'}},
+        csv_path = csv_path,
+        chunksize = chunksize_6
+    )
+    actual_df = pd.read_csv(output_path, dtype=str)
+    actual_df = actual_df.sort_values(
+        ['obs_id', 'redcap_repeat_instance']
+    ).reset_index(drop=True)
+
+    expected_df = pd.DataFrame(
+        {
+            'obs_id': ['10100001', '10100001', '10100002'],
+            'redcap_repeat_instance': ['1', '2', '1'],
+            'incl_main_ga': ['2', '1', '1'],
+            'redcap_event_name': ['test_event_name'] * 3,
+            'test_complete_col': ['2'] * 3,
+            'redcap_repeat_instrument': ['test_repeat_instrument'] * 3
+        }
+    )
+    assert num_rows == 3
+    assert actual_df.equals(expected_df)
+
+def test_convert_in_chunks_encoding(tmp_path, monkeypatch):
+    pd.DataFrame(
+        {'Subject': ['10100001'], 'col1': ['Yes']}
+    ).to_csv(tmp_path/'rave.csv', index=False, encoding='utf-8')
+    # an unknown encoding fails if the explicit encoding is not used
+    monkeypatch.setattr(obs_data_sets, 'RAW_DIR', tmp_path)
+    monkeypatch.setitem(
+        obs_data_sets.SOURCES, 'rave_clinic', ('rave.csv', 'not_an_encoding')
+    )
+
+    num_rows = obs_clinic_migration.convert_in_chunks(
+        ravestub_redcap_dict = {'col1': 'incl_main_ga'},
+        stub_repeat = 0,
+        output_path = tmp_path/'redcap_import.csv',
+        event_name = 'test_event_name',
+        complete_col = 'test_complete_col',
+        encoding = 'utf-8'
+    )
+    assert num_rows == 1
+
+def test_convert_in_chunks_issues(tmp_path):
+    csv_path = tmp_path/'rave.csv'
+    pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002', '10100003'],
+            'col1': ['Yes', 'Maybe', 'Maybe'],
+        }
+    ).to_csv(csv_path, index=False)
+
+    # the unmapped label is in two of the three chunks
+    num_rows, recode_issues = obs_clinic_migration.convert_in_chunks(
+        ravestub_redcap_dict = {'col1': 'incl_main_ga'},
+        stub_repeat = 0,
+        output_path = tmp_path/'redcap_import.csv',
+        event_name = 'test_event_name',
+        complete_col = 'test_complete_col',
+        csv_path = csv_path,
+        chunksize = 1,
+        return_issues = True
+    )
+    assert num_rows == 3
+    assert recode_issues.columns.tolist() == obs_clinic_migration.ISSUE_COLS
+    assert recode_issues['raw_value'].tolist() == ['Maybe']
+    assert recode_issues['count'].tolist() == [2]
+    assert recode_issues['example_obs_ids'].tolist() == [
+        ['10100002', '10100003']
+    ]
+
+param_compare_conv_dde_cells = [
+    (# single instance; one discrepancy, subject only in DDE is ignored
+        {
+            'col1': 'incl_main_ga',
+            'col2': 'incl_main_eng',
+        },
+        0,
+        pd.DataFrame(# pandas sample raw df
+            {
+                'Subject': ['10100001', '10100002', '10100003'],
+                'col1': ['Yes', 'Yes', 'No'],
+                'col2': ['No', np.NaN, 'Yes']
+            }
+        ),
+        pd.DataFrame(# redcap double data entry
+            {
+                'obs_id': ['10100001', '10100002', '10100003', '10100009'],
+                'incl_main_ga': ['2', '2', '2', '1'],
+                'incl_main_eng': ['1', np.NaN, '2', '1']
+            }
+        ),
+        [],
+        pd.DataFrame(# expected df
+            {
+                'obs_id': ['10100003'],
+                'field': ['incl_main_ga'],
+                'rave_value': ['1'],
+                'dde_value': ['2']
+            }
+        )
+    ),
+    (# repeat instances; instance missing from DDE, ignored column
+        {
+            'col1_': 'incl_main_ga',
+            'col2_': 'incl_main_eng',
+        },
+        2,
+        pd.DataFrame(# pandas sample raw df
+            {
+                'Subject': ['10100001', '10100002'],
+                'col1_1': ['Yes', 'No'],
+                'col2_1': ['Yes', 'No'],
+                'col1_2': ['Yes', np.NaN],
+                'col2_2': ['No', np.NaN]
+            }
+        ),
+        pd.DataFrame(# redcap double data entry
+            {
+                'obs_id': ['10100001', '10100002'],
+                'redcap_repeat_instance': ['1', '1'],
+                'incl_main_ga': ['2', '1'],
+                'incl_main_eng': ['1', '2']
+            }
+        ),
+        ['incl_main_eng'],
+        pd.DataFrame(# expected df
+            {
+                'obs_id': ['10100001'],
+                'redcap_repeat_instance': ['2'],
+                'field': ['incl_main_ga'],
+                'rave_value': ['2'],
+                'dde_value': [np.NaN]
+            }
+        )
+    ),
+]
+
+@pytest.mark.parametrize(
+    (
+        'ref_dict_7, stub_repeat_7, sample_raw_df_7, redcap_dde_7, '
+        'additional_ignore_cols_7, expected_df_7'
+    ), param_compare_conv_dde_cells
+)
+
+def test_compare_conv_dde_cells(
+    ref_dict_7, stub_repeat_7, sample_raw_df_7, redcap_dde_7,
+    additional_ignore_cols_7, expected_df_7
+):
+    initialized_class = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = ref_dict_7,
+        stub_repeat = stub_repeat_7,
+        main_df = sample_raw_df_7
+    )
+    actual_df = initialized_class.compare_conv_dde_cells(
+        redcap_dde = redcap_dde_7,
+        additional_ignore_cols = additional_ignore_cols_7
+    )
+
+    assert actual_df.columns.tolist() == expected_df_7.columns.tolist()
+    assert actual_df.astype(object).equals(expected_df_7.astype(object))
+
+@pytest.mark.parametrize(
+    'ref_dict_8, stub_repeat_8, sample_raw_df_8, recode_bool_8, expected_df_8',
+    param_RedcapCov_init + param_remove_na
+)
+
+def test_RedcapConv_compact_dtypes(
+    ref_dict_8, stub_repeat_8, sample_raw_df_8, recode_bool_8, expected_df_8
+):
+    # same result when the Rave data uses categoricals / Arrow-backed strings
+    actual = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = dict(ref_dict_8),
+        stub_repeat = stub_repeat_8,
+        main_df = obs_data_sets.compact_dtypes(
+            sample_raw_df_8, max_categories=1
+        ),
+        recode_long = recode_bool_8
+    )
+    actual.remove_na()
+    expected = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = dict(ref_dict_8),
+        stub_repeat = stub_repeat_8,
+        main_df = sample_raw_df_8,
+        recode_long = recode_bool_8
+    )
+    expected.remove_na()
+
+    actual_df = actual.data.reset_index(drop=True).astype(object)
+    expected_df = expected.data.reset_index(drop=True).astype(object)
+    assert actual_df.where(actual_df.notna(), np.NaN).equals(expected_df)
+
+def test_rave_wide_long():
+    actual_df = obs_clinic_migration.RedcapConv._rave_wide_long(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga', 'col2_': 'free_text'},
+        stub_repeat = 3,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002'],
+                'col1_1': ['Yes', np.NaN],
+                'col2_1': [np.NaN, np.NaN],
+                'col1_2': [np.NaN, np.NaN],
+                'col2_2': ['text', np.NaN],
+                'col1_3': [np.NaN, np.NaN],
+                'col2_3': [np.NaN, np.NaN],
+                'unused_col': ['a', 'b'],
+            }
+        )
+    )
+    expected_df = pd.DataFrame(
+        {
+            'obs_id': ['10100001', '10100001'],
+            'redcap_repeat_instance': ['1', '2'],
+            'incl_main_ga': ['Yes', np.NaN],
+            'free_text': [np.NaN, 'text']
+        },
+        # index of the stacked instances (instance * num subjects + row)
+        index=[0, 2]
+    )
+
+    assert actual_df.equals(expected_df)
+
+def test_RedcapConv_profile():
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 2,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002', '10100003'],
+                'col1_1': ['Yes', 'No', np.NaN],
+                'col1_2': ['No', np.NaN, np.NaN],
+                'other_col': ['a', 'b', 'c']
+            }
+        ),
+        profile = True
+    )
+    conv.remove_na()
+    conv.prep_imp('baseline_arm_1', 'form_complete')
+
+    report = conv.profiler.report()
+    assert report['stage'].tolist() == [
+        'subset', 'wide_to_long', 'recode', 'remove_na', 'prep_imp'
+    ]
+    assert report[['rows_in', 'cols_in', 'rows_out', 'cols_out']]\
+        .values.tolist() == [
+            [3, 4, 3, 3],
+            [3, 3, 3, 3],
+            [3, 3, 3, 3],
+            [3, 3, 3, 3],
+            [3, 5, 3, 5],
+        ]
+
+    # not measured by default
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 2,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001'],
+                'col1_1': ['Yes'],
+                'col1_2': ['No']
+            }
+        )
+    )
+    assert conv.profiler.report().empty
+
+def test_recode_issues(capsys):
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 2,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002', '10100003'],
+                'col1_1': ['YES', 'NO', 'NO'],
+                'col1_2': ['NO', '3', np.NaN]
+            }
+        )
+    )
+
+    # nothing is printed unless requested
+    assert capsys.readouterr().out == ''
+    expected_issues = pd.DataFrame(
+        {
+            'stage': ['recode', 'recode'],
+            'field': ['incl_main_ga', 'incl_main_ga'],
+            'raw_value': ['NO', 'YES'],
+            'count': [3, 1],
+            'example_obs_ids': [
+                ['10100002', '10100003', '10100001'], ['10100001']
+            ],
+            'exception': [np.NaN, np.NaN]
+        },
+        columns = obs_clinic_migration.ISSUE_COLS
+    )
+    pd.testing.assert_frame_equal(
+        conv.recode_issues, expected_issues, check_dtype=False
+    )
+
+    conv.change_str(
+        {'incl_main_ga': {'YES': 'Yes'}, 'not_a_col': {'a': 'b'}},
+        print_issues = True
+    )
+    issues = conv.recode_issues.iloc[2:]
+    assert issues['stage'].tolist() == ['change_str', 'change_str']
+    assert issues['field'].tolist() == ['incl_main_ga', 'not_a_col']
+    assert issues['raw_value'].iloc[0] == 'NO'
+    assert issues['exception'].iloc[1].startswith(
+        'An exception of type KeyError'
+    )
+    assert conv.data['incl_main_ga'].tolist() == [
+        '2', 'NO', 'NO', 'NO', '3'
+    ]
+    printed = capsys.readouterr().out
+    assert (
+        "change_str: column 'incl_main_ga' has 1 value(s) in 3 row(s)"
+        in printed
+    )
+    assert "change_str: column 'not_a_col' An exception" in printed
+
+def test_remove_na_empty_values():
+    test_data_dict = pd.DataFrame(
+        {
+            'Variable / Field Name': ['yesno_col', 'radio_col', 'text_col'],
+            'Field Type': ['yesno', 'radio', 'text'],
+            'Choices, Calculations, OR Slider Labels': [
+                np.NaN, '0, None | 1, Some', np.NaN
+            ]
+        }
+    )
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {
+            'col1': 'yesno_col', 'col2': 'radio_col', 'col3': 'text_col'
+        },
+        stub_repeat = 0,
+        main_df = pd.DataFrame(
+            {
+                'Subject': [str(10100001 + i) for i in range(5)],
+                'col1': ['0', np.NaN, np.NaN, '1', np.NaN],
+                'col2': [np.NaN, 'None', np.NaN, np.NaN, np.NaN],
+                'col3': [np.NaN, np.NaN, 'nan', np.NaN, '-'],
+            }
+        ),
+        redcap_data_dict = test_data_dict
+    )
+    original_data = conv.data
+
+    conv.remove_na()
+    assert conv.data['obs_id'].tolist() == ['10100004', '10100005']
+
+    conv.data = original_data
+    conv.remove_na(keep_valid_codes=True)
+    assert conv.data['obs_id'].tolist() == [
+        '10100001', '10100002', '10100004', '10100005'
+    ]
+
+    conv.data = original_data
+    conv.remove_na(empty_values=['0'], field_empty_values={'text_col': ['-']})
+    assert conv.data['obs_id'].tolist() == ['10100003', '10100004']
+
+def test_RedcapConv_inputs_unchanged():
+    ravestub_redcap_dicts = [
+        ({'col1': 'incl_main_ga', 'col2': 'free_text'}, 0),
+        ({'col3_': 'incl_main_eng'}, 2),
+    ]
+    main_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002'],
+            'col1': ['Yes', 'No'],
+            'col2': ['text', np.NaN],
+            'col3_1': ['No', np.NaN],
+            'col3_2': ['Yes', 'No'],
+        }
+    )
+    original_df = main_df.copy()
+    view = source_view.SourceView(main_df)
+
+    # forms share one view and can be converted concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        convs = list(executor.map(
+            lambda args: obs_clinic_migration.RedcapConv(
+                args[0], args[1], main_df=view
+            ),
+            ravestub_redcap_dicts * 2
+        ))
+    for conv in convs:
+        conv.remove_na()
+        conv.prep_imp('baseline_arm_1', 'form_complete')
+
+    assert main_df.equals(original_df)
+    assert ravestub_redcap_dicts[0][0] == {
+        'col1': 'incl_main_ga', 'col2': 'free_text'
+    }
+    assert convs[0].data.equals(convs[2].data)
+    assert convs[1].data.equals(convs[3].data)
+    assert convs[0].data['incl_main_ga'].tolist() == ['2', '1']
+    assert convs[1].data['incl_main_eng'].tolist() == ['1', '2', '1']
+
+def test_RedcapConv_detect_stub_repeat(capsys):
+    sample_raw_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002'],
+            'col1_1': ['Yes', 'No'],
+            'col1_2': ['No', np.NaN],
+            'col1_3': [np.NaN, np.NaN]
+        }
+    )
+    actual = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = None,
+        main_df = sample_raw_df
+    )
+    expected = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 3,
+        main_df = sample_raw_df
+    )
+
+    assert actual.data.equals(expected.data)
+    # instances without data are not reported
+    assert actual.recode_issues.empty
+    assert expected.recode_issues.empty
+
+    # instance columns beyond stub_repeat are recorded, not printed
+    actual = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 2,
+        main_df = sample_raw_df
+    )
+    assert capsys.readouterr().out == ''
+    assert actual.recode_issues[['stage', 'field']].values.tolist() == [
+        ['wide_to_long', 'incl_main_ga']
+    ]
+    actual.print_recode_issues()
+    assert "'col1_'" in capsys.readouterr().out
+
+def test_validate_choices():
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1_': 'incl_main_ga'},
+        stub_repeat = 2,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002', '10100003'],
+                'col1_1': ['Yes', '3', 'No'],
+                'col1_2': ['No', np.NaN, '3']
+            }
+        )
+    )
+
+    # numeric values are not recode issues but are not allowed codes
+    assert conv.recode_issues.empty
+    violations = conv.validate_choices()
+    assert violations[['field', 'value', 'count']].values.tolist() == [
+        ['incl_main_ga', '3', 2]
+    ]
+    assert conv.data.loc[violations['rows'][0], 'obs_id'].tolist() == [
+        '10100002', '10100003'
+    ]
+
+def test_compare_conv_dde_snapshot():
+    conv = obs_clinic_migration.RedcapConv(
+        ravestub_redcap_dict = {'col1': 'incl_main_ga'},
+        stub_repeat = 0,
+        main_df = pd.DataFrame(
+            {
+                'Subject': ['10100001', '10100002', '10100003'],
+                'col1': ['Yes', 'No', 'Yes']
+            }
+        )
+    )
+    redcap_dde = pd.DataFrame(
+        {
+            'obs_id': ['10100001', '10100002', '10100004'],
+            'incl_main_ga': ['2', '2', '1'],
+            'other_form_col': ['a', 'b', 'c']
+        }
+    )
+
+    expected_df = conv.compare_conv_dde(redcap_dde.copy())
+    actual_df = conv.compare_conv_dde(
+        dde_snapshot.DdeSnapshot(redcap_dde)
+    )
+    assert actual_df.equals(expected_df)
+    assert actual_df['obs_id'].tolist() == ['10100002', '10100002']
@@ -2,7 +2,9 @@
 
 import pandas as pd
 import obs_clinic_migration_preprocessing
+import obs_data_sets
 import numpy as np
+import pytest
 
 def test_rave_date_unknown():
     test_df = pd.DataFrame(
@@ -49,6 +51,61 @@ def test_rave_date_unknown():
     )
     assert actual_df.equals(expected_df)
 
+def test_rave_date_unknown_batch():
+    test_df = pd.DataFrame(
+        {
+            'dep_a_1': ['Yes', 'Yes', np.NaN],
+            'a_YYYY_1': ['1900', '1900', '2001'],
+            'a_MM_1': ['2', np.NaN, np.NaN],
+            'a_DD_1': [np.NaN, np.NaN, '3'],
+            'dep_a_2': ['No', 'Yes', 'Yes'],
+            'a_YYYY_2': [np.NaN, np.NaN, '1900'],
+            'a_MM_2': [np.NaN, np.NaN, np.NaN],
+            'a_DD_2': [np.NaN, np.NaN, np.NaN],
+            'dep_b_1': ['No', 'Yes', 'No'],
+            'b_YYYY_1': ['1900', np.NaN, '2010'],
+            'b_MM_1': [np.NaN, np.NaN, '5'],
+            'b_DD_1': [np.NaN, np.NaN, np.NaN],
+        }
+    )
+    date_specs = [('dep_a_', 'Yes', 'a_', 2), ('dep_b_', 'No', 'b_', 1)]
+
+    actual_df = obs_clinic_migration_preprocessing.rave_date_unknown_batch(
+        test_df.copy(), date_specs
+    )
+
+    # same result as calling rave_date_unknown for each date stub
+    expected_df = test_df.copy()
+    for date_spec in date_specs:
+        expected_df = obs_clinic_migration_preprocessing.rave_date_unknown(
+            expected_df, *date_spec
+        )
+    assert actual_df.equals(expected_df)
+    assert actual_df['a_yn_date_1'].tolist() == ['Yes', 'No', 'Yes']
+    assert actual_df['a_YYYY_1'].tolist() == ['99', np.NaN, '2001']
+    assert actual_df['a_DD_1'].tolist() == ['99', np.NaN, '3']
+    assert actual_df['b_yn_date_1'].tolist() == ['No', np.NaN, 'Yes']
+    # input dataframe is modified in place
+    rave_df = test_df.copy()
+    assert obs_clinic_migration_preprocessing.rave_date_unknown_batch(
+        rave_df, date_specs
+    ) is rave_df
+    assert rave_df['a_YYYY_1'].tolist() == ['99', np.NaN, '2001']
+
+    with pytest.raises(ValueError):
+        obs_clinic_migration_preprocessing.rave_date_unknown_batch(
+            test_df, date_specs + [('dep_b_', 'Yes', 'b_', 1)]
+        )
+    # only the 'yn_date_' columns may be missing
+    with pytest.raises(KeyError):
+        obs_clinic_migration_preprocessing.rave_date_unknown_batch(
+            test_df, [('dep_a_', 'Yes', 'aa_', 1)]
+        )
+    with pytest.raises(KeyError):
+        obs_clinic_migration_preprocessing.rave_date_unknown(
+            test_df, 'dep_a_', 'Yes', 'a_', 3
+        )
+
 def test_create_specify_col():
     test_df = pd.DataFrame(
         {
@@ -74,3 +131,179 @@ def test_create_specify_col():
         }
     )
     assert actual_df.equals(expected_df)
+
+def test_create_specify_col_batch():
+    test_df = pd.DataFrame(
+        {
+            'label_1': ['coded_1', 'uncoded_a', np.NaN],
+            'code_1': ['1', '99', np.NaN],
+            'label_2': ['uncoded_b', 'coded_2', 'coded_2'],
+            'code_2': ['99', '2', '2'],
+            'other_label': ['coded_1', 'text', 'text'],
+            'other_code': ['1', '9', '9'],
+        }
+    )
+    specify_specs = pd.DataFrame(
+        {
+            'create_col': ['specify_', 'other_specify'],
+            'coded_col': ['code_', 'other_code'],
+            'label_col': ['label_', 'other_label'],
+            'label_code': ['99', '9'],
+            'label_ans': ['other', 'Other'],
+            'max_occur_num': [2, np.NaN]
+        }
+    )
+
+    actual_df = obs_clinic_migration_preprocessing.create_specify_col_batch(
+        test_df.copy(), specify_specs
+    )
+
+    expected_df = pd.DataFrame(
+        {
+            'label_1': ['coded_1', 'other', np.NaN],
+            'code_1': ['1', '99', np.NaN],
+            'label_2': ['other', 'coded_2', 'coded_2'],
+            'code_2': ['99', '2', '2'],
+            'other_label': ['coded_1', 'Other', 'Other'],
+            'other_code': ['1', '9', '9'],
+            'specify_1': [np.NaN, 'uncoded_a', np.NaN],
+            'specify_2': ['uncoded_b', np.NaN, np.NaN],
+            'other_specify': [np.NaN, 'text', 'text'],
+        }
+    )
+    assert actual_df.equals(expected_df)
+    # input dataframe is modified in place
+    rave_df = test_df.copy()
+    assert obs_clinic_migration_preprocessing.create_specify_col_batch(
+        rave_df, specify_specs
+    ) is rave_df
+    assert rave_df['specify_1'].tolist()[1] == 'uncoded_a'
+
+    with pytest.raises(ValueError):
+        obs_clinic_migration_preprocessing.create_specify_col_batch(
+            test_df, specify_specs.iloc[[0, 0]]
+        )
+
+    # chained specs use the columns modified by the previous specs
+    chained_specs = [
+        {
+            'create_col': 'specify_a', 'coded_col': 'code_1',
+            'label_col': 'label_1', 'label_code': '99', 'label_ans': 'other'
+        },
+        {
+            'create_col': 'specify_b', 'coded_col': 'label_1',
+            'label_col': 'code_1', 'label_code': 'other', 'label_ans': '98'
+        },
+        {
+            'create_col': 'specify_c', 'coded_col': 'code_2',
+            'label_col': 'specify_a', 'label_code': '2', 'label_ans': 'none'
+        },
+    ]
+    actual_df = obs_clinic_migration_preprocessing.create_specify_col_batch(
+        test_df.copy(), chained_specs
+    )
+    expected_df = test_df.copy()
+    for specify_spec in chained_specs:
+        expected_df = obs_clinic_migration_preprocessing.create_specify_col(
+            rave_df=expected_df, **specify_spec
+        )
+    assert actual_df.equals(expected_df)
+    assert actual_df['code_1'].tolist() == ['1', '98', np.NaN]
+    assert actual_df['specify_a'].tolist()[1:] == ['none', 'none']
+
+def test_normalize_dates():
+    test_df = pd.DataFrame(
+        {
+            'BASE_ASSESS_DT': ['09SEP2019', '01jan2000', np.NaN, '2019-09-09'],
+            'DOB': ['01JAN2000', '31FEB2000', '09SEP2019', np.NaN],
+            'other_col': ['09SEP2019'] * 4
+        }
+    )
+
+    actual_df, actual_report = (
+        obs_clinic_migration_preprocessing.normalize_dates(
+            rave_df = test_df.copy(),
+            date_cols = ['BASE_ASSESS_DT', 'DOB'],
+            return_report = True
+        )
+    )
+
+    expected_df = pd.DataFrame(
+        {
+            'BASE_ASSESS_DT': ['2019-09-09', '2000-01-01', np.NaN, np.NaN],
+            'DOB': ['2000-01-01', np.NaN, '2019-09-09', np.NaN],
+            'other_col': ['09SEP2019'] * 4
+        }
+    )
+    expected_report = pd.DataFrame(
+        {
+            'column': ['BASE_ASSESS_DT', 'DOB'],
+            'value': ['2019-09-09', '31FEB2000'],
+            'count': [1, 1]
+        }
+    )
+    assert actual_df.equals(expected_df)
+    pd.testing.assert_frame_equal(
+        actual_report, expected_report, check_dtype=False
+    )
+
+    # rave_df is modified in place
+    actual_df = obs_clinic_migration_preprocessing.normalize_dates(
+        rave_df = test_df,
+        date_cols = ['BASE_ASSESS_DT'],
+        keep_unparseable = True
+    )
+    assert actual_df is test_df
+    assert actual_df['BASE_ASSESS_DT'].tolist()[3] == '2019-09-09'
+    assert actual_df['DOB'].tolist()[0] == '01JAN2000'
+    with pytest.raises(KeyError):
+        obs_clinic_migration_preprocessing.normalize_dates(
+            test_df, ['not_a_col']
+        )
+
+def test_normalize_dates_time():
+    test_df = pd.DataFrame({'DT_TM': ['09SEP2019 14:30:00', np.NaN]})
+
+    actual_df = obs_clinic_migration_preprocessing.normalize_dates(
+        rave_df = test_df,
+        date_cols = ['DT_TM'],
+        date_format = '%d%b%Y %H:%M:%S',
+        output_format = '%Y-%m-%d %H:%M'
+    )
+
+    assert actual_df['DT_TM'].tolist()[0] == '2019-09-09 14:30'
+
+def test_preprocessing_compact_dtypes():
+    # categorical and Arrow-backed string columns give the same result
+    test_df = pd.DataFrame(
+        {
+            'date_dependency_col_1': ['No', 'Yes', 'Yes'],
+            'date_stub_YYYY_1': ['2000', '1900', '1900'],
+            'date_stub_MM_1': ['1', np.NaN, '2'],
+            'date_stub_DD_1': ['1', np.NaN, np.NaN],
+            'df_label_col': ['coded_1', 'uncoded', 'uncoded'],
+            'df_code_col': ['1', '99', np.NaN],
+        }
+    )
+    compact_df = obs_data_sets.compact_dtypes(test_df, max_categories=1)
+    actual_dfs = []
+    for rave_df in [test_df, compact_df]:
+        rave_df = obs_clinic_migration_preprocessing.rave_date_unknown(
+            rave_df = rave_df,
+            date_dependency = 'date_dependency_col_',
+            dependency_answer = 'Yes',
+            rave_date_stub = 'date_stub_',
+            max_occur_num = 1
+        )
+        rave_df = obs_clinic_migration_preprocessing.create_specify_col(
+            create_col = 'new_specify_col',
+            coded_col = 'df_code_col',
+            label_col = 'df_label_col',
+            label_code = '99',
+            label_ans = 'other',
+            rave_df = rave_df
+        )
+        rave_df = rave_df.astype(object)
+        actual_dfs.append(rave_df.where(rave_df.notna(), np.NaN))
+
+    assert actual_dfs[1].equals(actual_dfs[0])
@@ -0,0 +1,62 @@
+"""Tests for obs_data_sets"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import obs_data_sets
+
+def test_read_csv_cached(tmp_path):
+    pytest.importorskip('pyarrow')
+    csv_path = tmp_path/'raw.csv'
+    cache_dir = tmp_path/'interim'
+    csv_path.write_text('Subject,col1,col2\n10100001,Yes,\n10100002,,99\n')
+    expected_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002'],
+            'col1': ['Yes', np.NaN],
+            'col2': [np.NaN, '99']
+        }
+    )
+
+    # first read parses the CSV and writes the cache
+    actual_df = obs_data_sets.read_csv_cached(csv_path, cache_dir=cache_dir)
+    assert actual_df.equals(expected_df)
+    assert len(list(cache_dir.glob('raw-*.feather'))) == 1
+    # the temporary file is renamed to the cached copy
+    assert list(cache_dir.glob('*.tmp')) == []
+
+    # second read is from the cache
+    actual_df = obs_data_sets.read_csv_cached(csv_path, cache_dir=cache_dir)
+    assert actual_df.equals(expected_df)
+
+    # changing the raw CSV replaces the cached copy
+    csv_path.write_text('Subject,col1,col2\n10100001,No,\n')
+    actual_df = obs_data_sets.read_csv_cached(csv_path, cache_dir=cache_dir)
+    assert actual_df['col1'].tolist() == ['No']
+    assert len(list(cache_dir.glob('raw-*.feather'))) == 1
+
+def test_lazy_load():
+    with pytest.raises(AttributeError):
+        obs_data_sets.not_a_data_set
+
+def test_compact_dtypes():
+    test_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002', '10100003', '10100004'],
+            'col1': ['Yes', 'Yes', 'Yes', np.NaN],
+            'col2': ['a', 'b', 'c', np.NaN],
+            'col3': [np.NaN] * 4
+        }
+    )
+
+    actual_df = obs_data_sets.compact_dtypes(test_df)
+
+    assert actual_df['Subject'].dtype == object
+    assert actual_df['col1'].dtype == 'category'
+    assert actual_df['col3'].dtype == 'category'
+    if obs_data_sets._arrow_string_dtype() is not None:
+        assert actual_df['col2'].dtype == obs_data_sets._arrow_string_dtype()
+    # values are unchanged
+    assert actual_df.astype(object).where(actual_df.notna(), np.NaN).equals(
+        test_df.astype(object)
+    )
@@ -0,0 +1,133 @@
+"""Tests for preprocessing_plan"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import obs_clinic_migration_preprocessing
+import preprocessing_plan
+
+test_rave_df = pd.DataFrame(
+    {
+        'Subject': ['10100001', '10100002', '10100003'],
+        'MEDHX_NY_1': ['Yes', 'Yes', np.NaN],
+        'ONSET_YR_YYYY_1': ['1900', '2019', np.NaN],
+        'ONSET_YR_MM_1': [np.NaN, '12', np.NaN],
+        'ONSET_YR_DD_1': [np.NaN, np.NaN, np.NaN],
+        'CONTINUE_NY_1': ['No', np.NaN, 'No'],
+        'RESOLUTION_YR_YYYY_1': [np.NaN, np.NaN, '1900'],
+        'RESOLUTION_YR_MM_1': [np.NaN, np.NaN, np.NaN],
+        'RESOLUTION_YR_DD_1': [np.NaN, np.NaN, np.NaN],
+        'code_col': ['1', '99', np.NaN],
+        'label_col': ['Moved', 'other reason', np.NaN],
+        'unused_col': ['a', 'b', 'c'],
+    }
+)
+
+def test_plan():
+    plan = preprocessing_plan.PreprocessingPlan(test_rave_df)
+    plan.rave_date_unknown('MEDHX_NY_', 'Yes', 'ONSET_YR_', 1)
+    plan.rave_date_unknown('CONTINUE_NY_', 'No', 'RESOLUTION_YR_', 1)
+    plan.create_specify_col(
+        'specify_col', 'code_col', 'label_col', '99', 'Other'
+    )
+
+    expected_df = obs_clinic_migration_preprocessing.rave_date_unknown(
+        test_rave_df.copy(), 'MEDHX_NY_', 'Yes', 'ONSET_YR_', 1
+    )
+    expected_df = obs_clinic_migration_preprocessing.rave_date_unknown(
+        expected_df, 'CONTINUE_NY_', 'No', 'RESOLUTION_YR_', 1
+    )
+    expected_df = obs_clinic_migration_preprocessing.create_specify_col(
+        'specify_col', 'code_col', 'label_col', '99', 'Other', expected_df
+    )
+    actual_df = plan.materialize(
+        ['Subject', 'ONSET_YR_YYYY_1', 'ONSET_YR_yn_date_1', 'specify_col']
+    )
+
+    # columns created by the steps follow the source columns
+    assert plan.columns.tolist() == test_rave_df.columns.tolist() + [
+        'ONSET_YR_yn_date_1', 'RESOLUTION_YR_yn_date_1', 'specify_col'
+    ]
+
+    # only the needed steps are run on the needed columns
+    assert 'unused_col' not in actual_df
+    assert 'RESOLUTION_YR_yn_date_1' not in actual_df
+    for col_name in actual_df.columns:
+        assert actual_df[col_name].equals(expected_df[col_name])
+    # the source dataframe is not modified
+    assert 'specify_col' not in test_rave_df
+    assert test_rave_df['label_col'].tolist()[1] == 'other reason'
+
+def test_prune():
+    plan = preprocessing_plan.PreprocessingPlan(test_rave_df)
+    plan.create_specify_col(
+        'specify_col', 'code_col', 'label_col', '99', 'Other'
+    )
+    plan.add_step(
+        lambda rave_df, suffix: rave_df.assign(
+            upper_col=rave_df['specify_col'] + suffix
+        ),
+        input_cols = ['specify_col'],
+        output_cols = ['upper_col'],
+        suffix = '!'
+    )
+    plan.rave_date_unknown('MEDHX_NY_', 'Yes', 'ONSET_YR_', 1)
+
+    # the custom step needs the specify column
+    needed_steps, needed_cols = plan.prune(['Subject', 'upper_col'])
+    assert len(needed_steps) == 2
+    assert needed_steps[0].func == 'create_specify_col'
+    assert {'code_col', 'label_col'} <= needed_cols
+    actual_df = plan.materialize(['Subject', 'upper_col'])
+    assert actual_df['upper_col'].tolist()[1] == 'other reason!'
+    assert plan.prune(['Subject', 'unused_col'])[0] == []
+
+def test_fuse():
+    plan = preprocessing_plan.PreprocessingPlan(test_rave_df)
+    plan.rave_date_unknown('MEDHX_NY_', 'Yes', 'ONSET_YR_', 1)
+    plan.rave_date_unknown('CONTINUE_NY_', 'No', 'RESOLUTION_YR_', 1)
+    plan.create_specify_col(
+        'specify_col', 'code_col', 'label_col', '99', 'Other'
+    )
+    # uses the column modified by the previous step
+    plan.create_specify_col(
+        'specify_col2', 'label_col', 'code_col', 'Other', '98'
+    )
+
+    plan.normalize_dates(['DATE_1'])
+    plan.normalize_dates(['DATE_2'])
+    plan.normalize_dates(['DATE_3'], date_format='%Y%m%d')
+
+    step_groups = preprocessing_plan._fuse(plan.steps)
+    assert [len(step_group) for step_group in step_groups] == [2, 1, 1, 2, 1]
+
+def test_plan_normalize_dates():
+    plan = preprocessing_plan.PreprocessingPlan(
+        test_rave_df.assign(
+            DATE_1=['09SEP2019', np.NaN, 'bad'],
+            DATE_2=['01JAN2000', '02JAN2000', np.NaN]
+        )
+    )
+    plan.add_form_spec_steps([
+        ('normalize_dates', {'date_cols': ['DATE_1']}),
+        ('normalize_dates', {'date_cols': ['DATE_2']})
+    ])
+
+    actual_df = plan.materialize(['Subject', 'DATE_1', 'DATE_2'])
+    assert actual_df.columns.tolist() == ['Subject', 'DATE_1', 'DATE_2']
+    assert actual_df['DATE_1'].tolist()[0] == '2019-09-09'
+    assert actual_df['DATE_2'].tolist() == [
+        '2000-01-01', '2000-01-02', np.NaN
+    ]
+
+def test_plan_missing_columns():
+    plan = preprocessing_plan.PreprocessingPlan(test_rave_df)
+    plan.rave_date_unknown('MEDHX_NY_', 'Yes', 'ONSET_YRR_', 1)
+
+    with pytest.raises(KeyError):
+        plan.materialize(['Subject', 'ONSET_YRR_yn_date_1'])
+
+def test_add_form_spec_steps():
+    plan = preprocessing_plan.PreprocessingPlan(test_rave_df)
+    with pytest.raises(ValueError):
+        plan.add_form_spec_steps([(len, {})])
@@ -0,0 +1,72 @@
+"""Tests for rave_header_index"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import rave_header_index
+
+test_columns = [
+    'Subject', 'DOB', 'MEDHX_NY_1', 'ONSET_YR_YYYY_1', 'ONSET_YR_MM_1',
+    'MEDHX_NY_2', 'ONSET_YR_YYYY_2', 'ONSET_YR_MM_2', 'MEDHX_NY_10'
+]
+
+def test_index_columns():
+    index = rave_header_index.RaveHeaderIndex(test_columns)
+
+    assert index.cols.loc['ONSET_YR_MM_2'].tolist() == [
+        7, 'ONSET_YR_MM_', 2, 'ONSET_YR_', 'MM_'
+    ]
+    assert index.cols.loc['DOB', 'instance'] == 0
+    assert index.cols.loc['MEDHX_NY_10', 'stub'] == 'MEDHX_NY_'
+    assert index.instances('MEDHX_NY_') == 10
+    assert index.instances('DOB') == 0
+
+@pytest.mark.parametrize(
+    'ravestub_redcap_dict, expected_stub_repeat',
+    [
+        ({'DOB': 'base_dem_dob'}, 0),
+        ({'Subject': 'obs_id', 'DOB': 'base_dem_dob'}, 0),
+        ({'ONSET_YR_YYYY_': 'onset_yr', 'ONSET_YR_MM_': 'onset_mm'}, 2),
+        ({'MEDHX_NY_': 'medhx_ny', 'ONSET_YR_YYYY_': 'onset_yr'}, 10),
+    ]
+)
+
+def test_stub_repeat(ravestub_redcap_dict, expected_stub_repeat):
+    index = rave_header_index.RaveHeaderIndex(test_columns)
+
+    assert index.stub_repeat(ravestub_redcap_dict) == expected_stub_repeat
+
+def test_stub_repeat_errors():
+    index = rave_header_index.RaveHeaderIndex(test_columns)
+
+    with pytest.raises(KeyError):
+        index.stub_repeat({'NOT_A_COL': 'not_a_field'})
+    with pytest.raises(ValueError):
+        index.stub_repeat({'DOB': 'base_dem_dob', 'MEDHX_NY_': 'medhx_ny'})
+
+def test_read_form(tmp_path):
+    csv_path = tmp_path/'raw.csv'
+    csv_path.write_text(
+        'Subject,DOB,col1_1,unused_col,col1_2\n'
+        '10100001,2000-01-01,Yes,a,\n'
+        '10100002,,No,b,Yes\n'
+    )
+    index = rave_header_index.RaveHeaderIndex.from_csv(csv_path)
+
+    actual_df = index.read_form({'col1_': 'incl_main_ga'})
+    expected_df = pd.DataFrame(
+        {
+            'Subject': ['10100001', '10100002'],
+            'col1_1': ['Yes', 'No'],
+            'col1_2': [np.NaN, 'Yes']
+        }
+    )
+    assert actual_df.equals(expected_df)
+
+    # columns are returned in the order requested
+    actual_df = index.read_columns(['DOB', 'Subject'])
+    assert actual_df.columns.tolist() == ['DOB', 'Subject']
+    with pytest.raises(KeyError):
+        index.read_columns(['not_a_col'])
+    with pytest.raises(ValueError):
+        rave_header_index.RaveHeaderIndex(test_columns).read_columns(['DOB'])
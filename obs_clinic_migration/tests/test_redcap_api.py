@@ -0,0 +1,93 @@
+"""Tests for redcap_api"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import redcap_api
+
+test_import_df = pd.DataFrame(
+    {
+        'obs_id': [str(10100001 + i // 2) for i in range(20)],
+        'redcap_repeat_instance': [str(i % 2 + 1) for i in range(20)],
+        'text_col': ['a, b', np.NaN, 'say "hi"', 'café'] * 5,
+        'redcap_event_name': ['baseline_arm_1'] * 20,
+    }
+)
+
+@pytest.mark.parametrize('max_records, max_workers, expected_batches', [
+    (500, 1, 1),
+    (3, 4, 4),
+    (1, 4, 10),
+])
+
+def test_import_records(max_records, max_workers, expected_batches):
+    with redcap_api.StandInRedcapServer(token='test-token') as server:
+        client = redcap_api.RedcapImportClient(
+            server.url, 'test-token',
+            max_records = max_records,
+            max_workers = max_workers
+        )
+        report = client.import_records(test_import_df)
+        imported_df = server.records()
+
+    assert len(report) == expected_batches
+    assert report['count'].sum() == 10
+    assert report['num_rows'].sum() == 20
+    assert report['error'].isna().all()
+    assert server.num_requests == expected_batches
+    assert server.max_concurrent <= max_workers
+    # every row is imported once with its values
+    imported_df = imported_df.sort_values(
+        ['obs_id', 'redcap_repeat_instance']
+    ).reset_index(drop=True)
+    assert imported_df.equals(test_import_df)
+
+def test_import_records_retry():
+    with redcap_api.StandInRedcapServer(fail_requests=2) as server:
+        client = redcap_api.RedcapImportClient(
+            server.url, server.token, max_workers=1, backoff=0
+        )
+        report = client.import_records(test_import_df)
+
+    assert report['attempts'].tolist() == [3]
+    assert report['count'].tolist() == [10]
+
+def test_import_records_error():
+    with redcap_api.StandInRedcapServer(fail_requests=10) as server:
+        client = redcap_api.RedcapImportClient(
+            server.url, server.token, max_records=5, max_retries=1, backoff=0
+        )
+        with pytest.raises(redcap_api.RedcapApiError) as error:
+            client.import_records(test_import_df)
+        assert error.value.report['error'].str.startswith('HTTP 503').all()
+
+        # not retried when the request is rejected
+        server.fail_requests = 0
+        client = redcap_api.RedcapImportClient(
+            server.url, 'wrong-token', max_records=5, backoff=0
+        )
+        report = client.import_records(test_import_df, raise_on_error=False)
+
+    assert report['attempts'].tolist() == [1, 1]
+    assert report['error'].str.startswith('HTTP 403').all()
+
+@pytest.mark.parametrize('response', [
+    '<html>Maintenance</html>',
+    '{"error": "no count"}',
+    '[10]',
+    '{"count": "ten"}',
+])
+
+def test_import_records_invalid_response(monkeypatch, response):
+    client = redcap_api.RedcapImportClient(
+        'http://127.0.0.1/api/', 'test-token', max_records=5, backoff=0
+    )
+    monkeypatch.setattr(client, '_post', lambda body: (200, response))
+    report = client.import_records(test_import_df, raise_on_error=False)
+
+    # recorded as the batch's error and not retried
+    assert report['count'].isna().all()
+    assert report['attempts'].tolist() == [1, 1]
+    assert report['error'].str.startswith('Invalid response').all()
+    with pytest.raises(redcap_api.RedcapApiError):
+        client.import_records(test_import_df)
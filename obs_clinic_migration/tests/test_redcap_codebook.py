@@ -0,0 +1,110 @@
+"""Tests for redcap_codebook"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import redcap_codebook
+
+test_data_dict = pd.DataFrame(
+    {
+        'Variable / Field Name': [
+            'obs_id', 'incl_main_ga', 'incl_main_reason', 'incl_main_dt',
+            'incl_main_bmi'
+        ],
+        'Field Type': ['text', 'radio', 'dropdown', 'text', 'calc'],
+        'Choices, Calculations, OR Slider Labels': [
+            np.NaN, '1, No | 2, Yes', '1, Moved, no contact | 99, Other',
+            np.NaN, 'round([wt], [ht])'
+        ],
+        'Text Validation Type OR Show Slider Number': [
+            np.NaN, np.NaN, np.NaN, 'date_ymd', np.NaN
+        ]
+    }
+)
+
+param_redcap_str_dict = [
+    ('1, No | 2, Yes', {'No': '1', 'Yes': '2'}),
+    (
+        '1, Moved, no contact | 99, Other',
+        {'Moved, no contact': '1', 'Other': '99'}
+    ),
+    (' 1, No', {'No': '1'}),
+]
+
+@pytest.mark.parametrize('input_str, expected_dict', param_redcap_str_dict)
+
+def test_redcap_str_dict(input_str, expected_dict):
+    assert redcap_codebook.redcap_str_dict(input_str) == expected_dict
+
+def test_codebook():
+    codebook = redcap_codebook.Codebook(test_data_dict)
+
+    assert codebook.choices('incl_main_ga') == {'No': '1', 'Yes': '2'}
+    assert codebook.code_label['incl_main_reason'] == {
+        '1': 'Moved, no contact', '99': 'Other'
+    }
+    # no coding information
+    assert codebook.choices('obs_id') is None
+    assert codebook.choices('incl_main_bmi') is None
+    assert codebook.choices('not_a_field') is None
+    assert codebook.field_types['incl_main_bmi'] == 'calc'
+    assert codebook.validations == {'incl_main_dt': 'date_ymd'}
+
+def test_codebook_from_data_dict():
+    data_dict = test_data_dict.copy()
+    codebook = redcap_codebook.Codebook.from_data_dict(data_dict)
+
+    # same data dictionary shares a codebook; a different one does not
+    assert redcap_codebook.Codebook.from_data_dict(data_dict) is codebook
+    assert (
+        redcap_codebook.Codebook.from_data_dict(test_data_dict)
+        is not codebook
+    )
+
+def test_allowed_codes():
+    data_dict = pd.DataFrame(
+        {
+            'Variable / Field Name': ['yesno_col', 'check_col', 'text_col'],
+            'Field Type': ['yesno', 'checkbox', 'text'],
+            'Choices, Calculations, OR Slider Labels': [
+                np.NaN, '1, Nausea | 2, Fever', np.NaN
+            ]
+        }
+    )
+    codebook = redcap_codebook.Codebook(data_dict)
+
+    assert codebook.allowed_codes('yesno_col') == ['0', '1']
+    assert codebook.allowed_codes('check_col') == ['1', '2']
+    assert codebook.allowed_codes('check_col___2') == ['0', '1']
+    assert codebook.allowed_codes('check_col___3') is None
+    assert codebook.allowed_codes('text_col') is None
+    assert codebook.allowed_codes('not_a_field') is None
+
+def test_choice_violations():
+    codebook = redcap_codebook.Codebook(test_data_dict)
+    data_df = pd.DataFrame(
+        {
+            'obs_id': ['10100001', '10100002', '10100003', '10100004'],
+            'incl_main_ga': ['1', '3', np.NaN, '3'],
+            'incl_main_reason': ['99', 'Moved', '1', '1'],
+            'incl_main_bmi': ['1', '2', '3', '4']
+        },
+        index = [5, 6, 7, 8]
+    )
+
+    expected_df = pd.DataFrame(
+        {
+            'field': ['incl_main_ga', 'incl_main_reason'],
+            'value': ['3', 'Moved'],
+            'count': [2, 1],
+            'rows': [[6, 8], [6]]
+        }
+    )
+    actual_df = codebook.choice_violations(data_df)
+    assert actual_df.equals(expected_df)
+
+    assert codebook.choice_violations(data_df, ['incl_main_bmi']).empty
+    # integers are compared as strings
+    assert codebook.choice_violations(
+        pd.DataFrame({'incl_main_ga': [1, 2]})
+    ).empty
@@ -0,0 +1,79 @@
+"""Tests for redcap_import_writer"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import redcap_import_writer
+
+test_import_df = pd.DataFrame(
+    {
+        'obs_id': [
+            '10100001', '10100002', '10100001', '10100003', '10100003'
+        ],
+        'redcap_repeat_instance': ['1', '1', '2', '1', '2'],
+        'text_col': ['a, b', 'say "hi"', np.NaN, 'café', 'long ' * 10],
+        'redcap_event_name': ['baseline_arm_1'] * 5,
+    }
+)
+
+def test_csv_row_bytes(tmp_path):
+    test_import_df.to_csv(tmp_path/'import.csv', index=False)
+    header_bytes = redcap_import_writer._header_bytes(test_import_df)
+    row_bytes = redcap_import_writer.csv_row_bytes(test_import_df)
+    assert header_bytes + row_bytes.sum() == (
+        (tmp_path/'import.csv').stat().st_size
+    )
+
+subject_1 = ['10100001', '10100001']
+subject_2 = ['10100002']
+subject_3 = ['10100003', '10100003']
+
+@pytest.mark.parametrize('max_records, max_bytes, expected_obs_ids', [
+    (None, None, [subject_1 + subject_2 + subject_3]),
+    (2, None, [subject_1 + subject_2, subject_3]),
+    (None, 180, [subject_1 + subject_2, subject_3]),
+    (None, 1, [subject_1, subject_2, subject_3]),
+])
+
+def test_write_import_files(
+    tmp_path, max_records, max_bytes, expected_obs_ids
+):
+    output_paths = redcap_import_writer.write_import_files(
+        test_import_df, tmp_path, 'form',
+        max_records = max_records,
+        max_bytes = max_bytes
+    )
+
+    assert [output_path.name for output_path in output_paths] == [
+        f'form_00{i}.csv' for i in range(1, len(expected_obs_ids) + 1)
+    ]
+    actual_dfs = [
+        pd.read_csv(output_path, dtype=str) for output_path in output_paths
+    ]
+    assert [
+        actual_df['obs_id'].tolist() for actual_df in actual_dfs
+    ] == expected_obs_ids
+    # only a file with a single record can be larger than max_bytes
+    for output_path, actual_df in zip(output_paths, actual_dfs):
+        if max_bytes is not None and actual_df['obs_id'].nunique() > 1:
+            assert output_path.stat().st_size <= max_bytes
+    # every row is written once
+    combined_df = pd.concat(actual_dfs, ignore_index=True)
+    expected_df = test_import_df.sort_values(
+        'obs_id', kind='mergesort'
+    ).reset_index(drop=True)
+    assert combined_df.equals(expected_df)
+
+def test_write_import_files_compress(tmp_path):
+    output_paths = redcap_import_writer.write_import_files(
+        test_import_df, tmp_path, 'form', max_records=2, compress=True
+    )
+
+    assert [output_path.name for output_path in output_paths] == [
+        'form_001.csv.gz', 'form_002.csv.gz'
+    ]
+    assert len(pd.read_csv(output_paths[1], dtype=str)) == 2
+
+def test_split_records_invalid():
+    with pytest.raises(ValueError):
+        redcap_import_writer.split_records(test_import_df, max_records=0)
@@ -0,0 +1,48 @@
+"""Tests for source_view"""
+
+import pandas as pd
+import pytest
+import numpy as np
+import source_view
+
+test_rave_df = pd.DataFrame(
+    {
+        'Subject': ['10100001', '10100002'],
+        'col1': ['Yes', np.NaN],
+        'col2': pd.Categorical(['a', 'b']),
+        'col3': [1.0, np.NaN],
+    }
+)
+
+def test_project():
+    view = source_view.SourceView(test_rave_df)
+    projection = view.project(['Subject', 'col1', 'col3'])
+
+    assert projection.shape == (2, 3)
+    # projections are cached and columns are not copied
+    assert view.project(['Subject', 'col1', 'col3']) is projection
+    assert np.shares_memory(
+        projection['col1'], test_rave_df['col1'].to_numpy()
+    )
+    # columns are read only
+    with pytest.raises(ValueError):
+        projection['col1'][0] = 'No'
+    assert projection.notna().tolist() == [
+        [True, True, True], [True, False, False]
+    ]
+    assert projection.object_values('col3').dtype == object
+    with pytest.raises(KeyError):
+        view.project(['not_a_col'])
+
+def test_to_frame():
+    projection = source_view.project(test_rave_df, ['col1', 'col2'])
+    actual_df = projection.to_frame({'col2': 'new_col2', 'col1': 'new_col1'})
+
+    assert actual_df.columns.tolist() == ['new_col2', 'new_col1']
+    assert actual_df['new_col2'].dtype == 'category'
+    # the new dataframe does not share data with the Rave dataframe
+    actual_df.loc[0, 'new_col1'] = 'No'
+    actual_df.loc[0, 'new_col2'] = 'b'
+    assert test_rave_df['col1'].tolist()[0] == 'Yes'
+    assert test_rave_df['col2'].tolist() == ['a', 'b']
+    assert actual_df['new_col2'].tolist() == ['b', 'b']
@@ -0,0 +1,43 @@
+"""Tests for stage_profiler"""
+
+import pandas as pd
+import pytest
+import stage_profiler
+
+test_df = pd.DataFrame({'col1': [1, 2, 3], 'col2': [4, 5, 6]})
+
+@pytest.mark.parametrize('profile, expected_enabled', [
+    (False, False),
+    (True, True),
+    (print, True),
+])
+
+def test_from_option(profile, expected_enabled):
+    profiler = stage_profiler.StageProfiler.from_option(profile)
+    assert profiler.enabled == expected_enabled
+    assert stage_profiler.StageProfiler.from_option(profiler) is profiler
+
+def test_stage():
+    records = []
+    profiler = stage_profiler.StageProfiler(callback=records.append)
+
+    with profiler.stage('filter', test_df) as stage:
+        filtered_df = test_df.loc[test_df['col1'] > 1, ['col1']]
+        stage.set(filtered_df)
+
+    report = profiler.report()
+    assert report.columns.tolist() == stage_profiler.REPORT_COLS
+    assert report[['stage', 'rows_in', 'cols_in', 'rows_out', 'cols_out']]\
+        .values.tolist() == [['filter', 3, 2, 2, 1]]
+    assert report.loc[0, 'time_s'] >= 0
+    assert report.loc[0, 'peak_mb'] >= 0
+    assert records == profiler.records
+
+def test_stage_disabled():
+    profiler = stage_profiler.StageProfiler()
+
+    with profiler.stage('filter', test_df) as stage:
+        stage.set(test_df)
+
+    assert profiler.records == []
+    assert profiler.report().empty